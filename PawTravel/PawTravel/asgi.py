@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
+
+Chat push endpoint (chat.views.poll) is asynchronous, serve the project through this
+application (ex. uvicorn PawTravel.asgi:application) so waiting clients do not occupy worker threads.
 """
 
 import os
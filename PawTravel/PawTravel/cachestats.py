@@ -0,0 +1,60 @@
+from django.core.cache import cache
+
+COUNTERS = ('cards', 'pages', 'search')  # Names of caches which count their hits and misses
+
+
+def _key(name, result):
+    return 'cache_stats_{}_{}'.format(name, result)
+
+
+def _increment(key, amount):
+    if not amount:
+        return
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        # First count or the counter was evicted, someone else could have just added it
+        if not cache.add(key, amount, None):
+            cache.incr(key, amount)
+
+
+def hit(name, amount=1):
+    """
+    Count cache hits
+    :param name: Name of the cache from COUNTERS
+    :param amount: Amount of hits
+    """
+    _increment(_key(name, 'hits'), amount)
+
+
+def miss(name, amount=1):
+    """
+    Count cache misses
+    :param name: Name of the cache from COUNTERS
+    :param amount: Amount of misses
+    """
+    _increment(_key(name, 'misses'), amount)
+
+
+def get_stats():
+    """
+    :return: Dictionary with amount of hits, misses and hit rate of every counted cache
+    """
+    values = cache.get_many([_key(name, result) for name in COUNTERS for result in ('hits', 'misses')])
+    stats = {}
+    for name in COUNTERS:
+        hits = values.get(_key(name, 'hits'), 0)
+        misses = values.get(_key(name, 'misses'), 0)
+        stats[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+    return stats
+
+
+def reset():
+    """
+    Set all counters back to zero
+    """
+    cache.delete_many([_key(name, result) for name in COUNTERS for result in ('hits', 'misses')])
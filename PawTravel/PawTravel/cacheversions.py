@@ -0,0 +1,30 @@
+import time
+
+from django.core.cache import cache
+
+
+def bump(keys):
+    """
+    Increase version counters stored in the cache, which invalidates everything cached under their old values
+    :param keys: Cache keys of the counters
+    """
+    for key in keys:
+        # Missing version starts from current time, so it never repeats a version which got evicted
+        cache.add(key, int(time.time() * 1000), None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, int(time.time() * 1000), None)
+
+
+def get(keys):
+    """
+    :param keys: Cache keys of version counters
+    :return: List of current versions, in the same order as keys
+    """
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        bump(missing)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key, 0) for key in keys]
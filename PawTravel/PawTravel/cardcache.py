@@ -0,0 +1,83 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+
+from . import cachestats
+
+register = template.Library()
+
+PREFETCHED_CARDS = 'prefetched_cards'  # Key of render context with cards fetched by prefetchcards tag
+
+
+def get_card_key(obj):
+    """
+    :param obj: Object shown on the card, its model has to have card_version column
+    :return: Cache key of rendered card of given object in its current version
+    """
+    return 'card_{}_{}_{}'.format(obj._meta.label_lower, obj.pk, obj.card_version)
+
+
+class CachedCardNode(template.Node):
+    def __init__(self, nodelist, obj):
+        self.nodelist = nodelist
+        self.obj = obj
+
+    def render(self, context):
+        key = get_card_key(self.obj.resolve(context))
+        prefetched = context.render_context.get(PREFETCHED_CARDS, {})
+        if key in prefetched:
+            # Already counted by prefetchcards
+            html = prefetched[key]
+        else:
+            html = cache.get(key)
+            if html is not None:
+                cachestats.hit('cards')
+            else:
+                cachestats.miss('cards')
+        if html is not None:
+            return html
+        html = self.nodelist.render(context)
+        cache.set(key, html, settings.CARD_CACHE_TIMEOUT)
+        return html
+
+
+@register.tag
+def cachedcard(parser, token):
+    """
+    Caches rendered card of an object until its card_version changes, usage:
+    {% cachedcard offer %} ... {% endcachedcard %}
+    Content of the card must not depend on anything else than the object and its relations.
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError("'{}' tag takes exactly one argument".format(bits[0]))
+    nodelist = parser.parse(('endcachedcard',))
+    parser.delete_first_token()
+    return CachedCardNode(nodelist, parser.compile_filter(bits[1]))
+
+
+class PrefetchCardsNode(template.Node):
+    def __init__(self, objects):
+        self.objects = objects
+
+    def render(self, context):
+        keys = [get_card_key(obj) for obj in self.objects.resolve(context) or []]
+        found = cache.get_many(keys)
+        cachestats.hit('cards', len(found))
+        cachestats.miss('cards', len(set(keys)) - len(found))
+        prefetched = context.render_context.setdefault(PREFETCHED_CARDS, {})
+        prefetched.update({key: found.get(key) for key in keys})
+        return ''
+
+
+@register.tag
+def prefetchcards(parser, token):
+    """
+    Fetches cached cards of all objects with a single cache query, so following cachedcard tags
+    do not have to query the cache one by one, usage:
+    {% prefetchcards offers %}{% for offer in offers %}{% cachedcard offer %} ... {% endcachedcard %}{% endfor %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError("'{}' tag takes exactly one argument".format(bits[0]))
+    return PrefetchCardsNode(parser.compile_filter(bits[1]))
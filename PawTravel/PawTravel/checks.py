@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Backends which keep data only inside of a single process
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Rate limits, cached page, card and search versions and their invalidation only work across worker processes
+    when all of them use the same cache, so production must not use a process local one
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_CACHES:
+        return [Warning(
+            'Default cache {} is not shared between processes.'.format(backend),
+            hint='Every worker process then allows the full rate limit and keeps serving its own stale pages. '
+                 'Set CACHE_BACKEND and CACHE_LOCATION environment variables to a shared cache, e.g. memcached.',
+            id='PawTravel.W001',
+        )]
+    return []
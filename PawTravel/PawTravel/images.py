@@ -0,0 +1,191 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import F
+from PIL import Image, ImageOps, features
+
+from . import pagecache
+
+# Maximal width and height of every derivative, images are scaled down to fit, never up
+DERIVATIVE_SIZES = {
+    'icon': (64, 64),
+    'thumbnail': (320, 320),
+    'card': (640, 480),
+    'hero': (1600, 900),
+}
+IMAGE_DERIVATIVES = ('thumbnail', 'card', 'hero')  # Generated for offer and guide images
+ICON_DERIVATIVES = ('icon',)  # Generated for category icons
+# Seconds for which an image with missing derivatives is not checked again, complete ones are remembered for good
+MISSING_DERIVATIVES_TIMEOUT = 60
+
+logger = logging.getLogger(__name__)
+
+
+def get_format():
+    """
+    :return: Tuple of Pillow format name and file extension of derivatives,
+    WEBP is used if Pillow was built with it, JPEG otherwise
+    """
+    if features.check('webp'):
+        return 'WEBP', 'webp'
+    return 'JPEG', 'jpg'
+
+
+def derivative_name(name, derivative):
+    """
+    :param name: Storage name of the original image
+    :param derivative: Name of the derivative from DERIVATIVE_SIZES
+    :return: Storage name of the derivative
+    """
+    # Original extension is kept, so photo.jpg and photo.png do not share derivatives
+    return 'derivatives/{}/{}.{}'.format(derivative, name.lstrip('/'), get_format()[1])
+
+
+def render_derivatives(source, targets, image_format, quality):
+    """
+    Scale image down to all target sizes. It only uses the filesystem and Pillow, so it can run in another process.
+    :param source: Path of the original image
+    :param targets: List of (path, (width, height)) tuples
+    :param image_format: Pillow format name of derivatives
+    :param quality: Quality of derivatives from 1 to 100
+    :return: Amount of written derivatives
+    """
+    with Image.open(source) as original:
+        original = ImageOps.exif_transpose(original)
+        if image_format == 'JPEG' and original.mode not in ('RGB', 'L'):
+            original = original.convert('RGB')
+        for path, size in targets:
+            image = original.copy()
+            image.thumbnail(size, Image.LANCZOS)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written under temporary name, so a half written file is never served
+            temporary = path + '.part'
+            image.save(temporary, image_format, quality=quality)
+            os.replace(temporary, path)
+    return len(targets)
+
+
+def get_missing_targets(name, derivatives, force=False):
+    """
+    :return: List of (path, size) of derivatives of the image which do not exist yet
+    """
+    return [(default_storage.path(derivative_name(name, derivative)), DERIVATIVE_SIZES[derivative])
+            for derivative in derivatives
+            if force or not default_storage.exists(derivative_name(name, derivative))]
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    """
+    Get process pool of this process, its size is defined by IMAGE_DERIVATIVE_WORKERS setting
+    """
+    return ProcessPoolExecutor(max_workers=settings.IMAGE_DERIVATIVE_WORKERS)
+
+
+def get_generated_cache_key(name):
+    return 'image_derivatives_{}'.format(hashlib.md5(name.encode()).hexdigest())
+
+
+def refresh_owners(owners):
+    """
+    Render cards and pages showing the image again, so they link its derivatives instead of the original
+    :param owners: Query set of objects with card_version column showing the image
+    """
+    pks = list(owners.values_list('pk', flat=True))
+    if not pks:
+        return
+    owners.model.objects.filter(pk__in=pks).update(card_version=F('card_version') + 1)
+    if len(pks) == 1:
+        pagecache.purge(owners.model, pks[0])
+    else:
+        pagecache.purge(owners.model)
+
+
+def forget_derivatives(name, owners=None, future=None):
+    """
+    Check existence of derivatives of the image again on the next render, it is called once they are generated.
+    It can be used as a done callback of the future rendering them, failures are logged.
+    :param name: Storage name of the original image
+    :param owners: Query set of objects showing the image, see refresh_owners
+    :param future: Finished future of render_derivatives
+    """
+    cache.delete(get_generated_cache_key(name))
+    if future is not None and future.exception() is not None:
+        logger.error('Generating derivatives of image %s failed', name, exc_info=future.exception())
+        return
+    if owners is not None:
+        try:
+            refresh_owners(owners)
+        finally:
+            if future is not None:
+                # Done callbacks run in a thread of the pool, which must not keep its own connection open
+                connection.close()
+
+
+def get_generated_derivatives(name):
+    """
+    Check all derivatives of the image at once and cache the result, so rendering an image
+    does not touch the storage for each of its derivatives
+    :param name: Storage name of the original image
+    :return: Frozenset of names of generated derivatives
+    """
+    key = get_generated_cache_key(name)
+    generated = cache.get(key)
+    if generated is None:
+        generated = frozenset(derivative for derivative in DERIVATIVE_SIZES
+                              if default_storage.exists(derivative_name(name, derivative)))
+        complete = generated.issuperset(IMAGE_DERIVATIVES) or generated.issuperset(ICON_DERIVATIVES)
+        cache.set(key, generated, None if complete else MISSING_DERIVATIVES_TIMEOUT)
+    return generated
+
+
+def schedule_derivatives(image, derivatives, owners=None):
+    """
+    Generate missing derivatives of uploaded image in the process pool once the current transaction commits.
+    If IMAGE_DERIVATIVE_WORKERS is 0, derivatives are generated right away in this process.
+    :param image: Value of an ImageField
+    :param derivatives: Names of generated derivatives
+    :param owners: Query set of objects with card_version column showing the image, refreshed once it is done
+    """
+    if not image or not image.name:
+        return
+    name = image.name
+
+    def submit():
+        try:
+            if not default_storage.exists(name):
+                return
+        except SuspiciousFileOperation:
+            # Name points outside of the media directory
+            return
+        targets = get_missing_targets(name, derivatives)
+        if not targets:
+            return
+        arguments = (default_storage.path(name), targets, get_format()[0], settings.IMAGE_DERIVATIVE_QUALITY)
+        if settings.IMAGE_DERIVATIVE_WORKERS:
+            future = get_executor().submit(render_derivatives, *arguments)
+            future.add_done_callback(partial(forget_derivatives, name, owners))
+        else:
+            render_derivatives(*arguments)
+            forget_derivatives(name, owners)
+
+    transaction.on_commit(submit)
+
+
+def get_derivative_url(image, derivative):
+    """
+    :return: Url of the derivative or None if it was not generated yet
+    """
+    if not image or not image.name:
+        return None
+    if derivative not in get_generated_derivatives(image.name):
+        return None
+    return default_storage.url(derivative_name(image.name, derivative))
@@ -0,0 +1,30 @@
+from django import template
+
+from . import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def derivative_url(image, derivative):
+    """
+    Url of image scaled down to given derivative size, falls back to the original if it is not generated yet, usage:
+    <img src="{% derivative_url category.icon_image 'icon' %}">
+    """
+    if not image:
+        return ''
+    return images.get_derivative_url(image, derivative) or image.url
+
+
+@register.simple_tag
+def image_srcset(image):
+    """
+    Value of srcset attribute listing all generated derivatives of the image with their widths, usage:
+    <img src="{% derivative_url offer.image 'card' %}" srcset="{% image_srcset offer.image %}" sizes="150px">
+    Empty srcset is ignored by browsers, so the tag can be used before derivatives are generated.
+    """
+    if not image:
+        return ''
+    candidates = [(url, images.DERIVATIVE_SIZES[name][0]) for name in images.IMAGE_DERIVATIVES
+                  for url in [images.get_derivative_url(image, name)] if url]
+    return ', '.join('{} {}w'.format(url, width) for url, width in candidates)
@@ -0,0 +1,138 @@
+import base64
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """Raised for cursors which were not created by the paginator, e.g. edited by hand"""
+
+
+class KeysetPage:
+    """
+    Single page of a keyset paginated listing. Unlike Django's Page it knows only whether
+    neighbouring pages exist and cursors pointing at them, not its number or amount of pages.
+    """
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.total = None  # Approximate amount of all objects, set if the listing shows it
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+
+class KeysetPaginator:
+    """
+    Paginates query set by its unique ordering instead of OFFSET, so every page costs the same
+    single indexed query no matter how deep it is, and no COUNT(*) is needed to know if there is a next page.
+    Pages are addressed by opaque cursors made of ordering values of the first or last shown object.
+    Usage: KeysetPaginator(guides, 20, ('-publish', '-id')).get_page(after=request.GET.get('after'))
+    """
+
+    def __init__(self, queryset, per_page, ordering):
+        """
+        :param queryset: Query set of paginated objects
+        :param per_page: Amount of objects on a single page
+        :param ordering: Fields ordering the objects, all descending or all ascending, the last one must be unique
+        """
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = ordering
+        self.fields = [field.lstrip('-') for field in ordering]
+        self.descending = ordering[0].startswith('-')
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, field) for field in self.fields]
+        # Dates keep their microseconds, DjangoJSONEncoder would round them and break comparisons
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        """
+        :return: Values of ordering fields stored in the cursor
+        :raise InvalidCursor: If the cursor was not created by this paginator
+        """
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError):
+            raise InvalidCursor(cursor)
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            raise InvalidCursor(cursor)
+        try:
+            return [self.queryset.model._meta.get_field(field).to_python(value)
+                    for field, value in zip(self.fields, values)]
+        except ValidationError:
+            raise InvalidCursor(cursor)
+
+    def get_filter(self, values, forward):
+        """
+        :return: Condition selecting objects after (forward) or before the position given by ordering values
+        """
+        lookup = 'lt' if self.descending == forward else 'gt'
+        condition = Q()
+        for index, field in enumerate(self.fields):
+            equal = {name: value for name, value in zip(self.fields[:index], values[:index])}
+            condition |= Q(**equal, **{'{}__{}'.format(field, lookup): values[index]})
+        # Redundant bound of the leading field lets the database seek the index instead of scanning from its start
+        return Q(**{'{}__{}e'.format(self.fields[0], lookup): values[0]}) & condition
+
+    def get_page(self, after=None, before=None):
+        """
+        Get page of objects following cursor after or preceding cursor before, the first page if none is given
+        :raise InvalidCursor: If the given cursor is malformed
+        """
+        forward = before is None
+        queryset = self.queryset
+        ordering = self.ordering
+        if not forward:
+            ordering = [field[1:] if field.startswith('-') else '-' + field for field in ordering]
+            queryset = queryset.filter(self.get_filter(self.decode_cursor(before), forward=False))
+        elif after is not None:
+            queryset = queryset.filter(self.get_filter(self.decode_cursor(after), forward=True))
+        # One more object tells whether there is another page without counting
+        objects = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+        if forward:
+            has_next, has_previous = has_more, after is not None
+        else:
+            objects.reverse()
+            has_next, has_previous = True, has_more
+        return KeysetPage(
+            objects, has_next, has_previous,
+            next_cursor=self.encode_cursor(objects[-1]) if has_next and objects else None,
+            previous_cursor=self.encode_cursor(objects[0]) if has_previous and objects else None,
+        )
+
+    def get_approximate_total(self):
+        """
+        :return: Amount of all objects, which is counted at most once per LIST_COUNT_CACHE_TIMEOUT seconds
+        """
+        sql, params = self.queryset.query.sql_with_params()
+        key = 'list_count_{}'.format(hashlib.md5('{}{}'.format(sql, params).encode()).hexdigest())
+        total = cache.get(key)
+        if total is None:
+            total = self.queryset.count()
+            cache.set(key, total, settings.LIST_COUNT_CACHE_TIMEOUT)
+        return total
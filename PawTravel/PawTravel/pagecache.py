@@ -0,0 +1,63 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from . import cachestats, cacheversions
+
+
+def _version_key(model, scope):
+    return 'page_version_{}_{}'.format(model._meta.label_lower, scope)
+
+
+def purge(model, pk=None):
+    """
+    Purge cached pages showing objects of given model
+    :param model: Model of changed object
+    :param pk: Primary key of changed object, its detail page and listings of the model are purged.
+    If it is not given, all pages of the model are purged, e.g. after a bulk update.
+    """
+    if pk is None:
+        cacheversions.bump([_version_key(model, 'all')])
+    else:
+        cacheversions.bump([_version_key(model, 'list'), _version_key(model, pk)])
+
+
+def cache_anonymous_page(model, object_kwarg=None):
+    """
+    Caches pages rendered for anonymous users until objects they show change, see purge.
+    Pages which set cookies or use a CSRF token are not cached, because they are different for every visitor.
+    Usage: path('<int:pk>/', cache_anonymous_page(Offer, 'pk')(OfferDetailView.as_view()))
+    :param model: Model of objects shown on the page
+    :param object_kwarg: Name of url argument with primary key of the shown object,
+    if it is not given the page is treated as a listing of the model
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            scope = kwargs[object_kwarg] if object_kwarg else 'list'
+            versions = cacheversions.get([_version_key(model, 'all'), _version_key(model, scope)])
+            key = 'page_{}_{}_{}'.format(hashlib.md5(request.get_full_path().encode()).hexdigest(), *versions)
+            cached = cache.get(key)
+            if cached is not None:
+                cachestats.hit('pages')
+                status, content_type, content = cached
+                response = HttpResponse(content, content_type=content_type, status=status)
+            else:
+                cachestats.miss('pages')
+                response = view(request, *args, **kwargs)
+                if hasattr(response, 'render') and callable(response.render):
+                    response.render()
+                if (response.status_code == 200 and not response.streaming and not response.cookies
+                        and not request.META.get('CSRF_COOKIE_USED')):
+                    cache.set(key, (response.status_code, response['Content-Type'], response.content),
+                              settings.PAGE_CACHE_TIMEOUT)
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,98 @@
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when user tries to do an action more times than it is allowed
+    """
+    def __init__(self, action, retry_after):
+        super().__init__('Rate limit of "{}" exceeded, retry after {} seconds'.format(action, retry_after))
+        self.action = action
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    It is used in situations where a certain action of a user should not be allowed to do infinite amount of times.
+    Actions are counted in a sliding window, approximated with counters of the current and the previous fixed window.
+    Counters are kept in the cache and changed only with atomic add/incr operations,
+    so the limit holds across many worker processes sharing the same cache (see CACHES setting).
+    Limits are defined per action in RATE_LIMITS setting as (maximum amount of actions, window in seconds).
+    """
+    def __init__(self, action, limit=None, window=None):
+        self.action = action
+        self.limit = limit
+        self.window = window
+
+    def get_limit(self):
+        """
+        :return: Tuple of (maximum amount of actions, window in seconds)
+        """
+        if self.limit is not None and self.window is not None:
+            return self.limit, self.window
+        return settings.RATE_LIMITS[self.action]
+
+    def _key(self, user_id, window_number):
+        return 'ratelimit_{}_{}_{}'.format(self.action, user_id, window_number)
+
+    def _increment(self, key, window):
+        """
+        Atomically increase counter, creating it if it does not exist yet
+        """
+        cache.add(key, 0, window * 2)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # Counter has expired in between
+            cache.add(key, 1, window * 2)
+            return 1
+
+    def hit(self, user_id):
+        """
+        Count a single action of the user
+        :param user_id: Id of the user doing the action
+        :raises RateLimitExceeded: If user has already reached the limit, rejected action is not counted
+        """
+        limit, window = self.get_limit()
+        now = time.time()
+        window_number = int(now // window)
+        elapsed = now - window_number * window
+        key = self._key(user_id, window_number)
+        current = self._increment(key, window)
+        previous = cache.get(self._key(user_id, window_number - 1), 0)
+        if previous * (1 - elapsed / window) + current > limit:
+            try:
+                cache.decr(key)
+            except ValueError:
+                pass
+            raise RateLimitExceeded(self.action, self._retry_after(limit, window, elapsed, previous, current - 1))
+
+    @staticmethod
+    def _retry_after(limit, window, elapsed, previous, current):
+        """
+        Compute after how many seconds the next action will be accepted
+        """
+        if current + 1 <= limit:
+            wait = window * (1 - (limit - current - 1) / previous) - elapsed
+        else:
+            # Current window is already full, it has to become the previous one and lose enough weight
+            wait = window - elapsed + window * (1 - (limit - 1) / current)
+        return max(1, math.ceil(wait))
+
+
+def too_many_requests(error, response=None):
+    """
+    Turn response into 429 Too Many Requests response with Retry-After header
+    :param error: RateLimitExceeded exception
+    :param response: Response to be changed, by default json response with error message is created
+    """
+    if response is None:
+        response = JsonResponse(data={'message': "You are doing this too quickly, try again later"})
+    response.status_code = 429
+    response['Retry-After'] = str(error.retry_after)
+    return response
@@ -0,0 +1,170 @@
+import math
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from voting.managers import ZERO_VOTES_ALLOWED
+from voting.models import Vote
+
+from . import pagecache
+
+HOTNESS_EPOCH = 1640995200  # 2022-01-01 UTC, hotness of items posted then does not depend on age
+HOTNESS_DECAY = 45000  # Every this amount of seconds newer item is worth 10 times more votes
+COMMENT_WEIGHT = 0.5  # Ten times more comments is worth the same as five times more votes
+# Columns changed only by votes and comments, saving an already loaded item must not overwrite them
+COUNTER_FIELDS = ('score', 'num_votes', 'num_comments', 'hotness')
+
+
+def hotness(score, num_comments, posted):
+    """
+    Compute hotness of an item, the higher the hotter. Newer items get a constant bonus for the time
+    they were posted, so hotness of an item does not have to change as it gets older to make it sink
+    below newer ones. Thanks to that, it only needs to be refreshed when item gets votes or comments.
+    :param score: Sum of votes of the item
+    :param num_comments: Amount of comments of the item
+    :param posted: Datetime when the item was posted
+    :return: Hotness as float
+    """
+    votes = math.copysign(math.log10(max(abs(score), 1)), score)
+    comments = COMMENT_WEIGHT * math.log10(1 + num_comments)
+    age = (posted.timestamp() - HOTNESS_EPOCH) / HOTNESS_DECAY
+    return round(votes + comments + age, 7)
+
+
+def refresh_hotness(model, pk):
+    """
+    Recompute stored hotness of a single item from its current columns
+    :param model: Model with score, num_comments and hotness columns and hotness_date_field attribute
+    :param pk: Primary key of the item
+    :return: Dictionary with current score, num_votes and num_comments of the item
+    """
+    row = model.objects.filter(pk=pk).values('score', 'num_votes', 'num_comments', model.hotness_date_field).get()
+    model.objects.filter(pk=pk).update(hotness=hotness(row['score'], row['num_comments'],
+                                                       row.pop(model.hotness_date_field)))
+    return row
+
+
+def get_saved_fields(obj):
+    """
+    Get fields written by a save of an existing item, without counters which could have changed since it was loaded
+    :param obj: Item with COUNTER_FIELDS
+    :return: List of field names usable as update_fields
+    """
+    deferred = obj.get_deferred_fields()
+    return [field.name for field in obj._meta.concrete_fields
+            if not field.primary_key and field.name not in COUNTER_FIELDS and field.attname not in deferred]
+
+
+def record_comment(model, pk, change):
+    """
+    Change comment counter of commented item and refresh its hotness
+    :param model: Model of commented item, models which are not ranked by hotness are skipped
+    :param pk: Primary key of commented item
+    :param change: 1 for added comment, -1 for deleted one
+    """
+    if not hasattr(model, 'hotness_date_field'):
+        return
+    with transaction.atomic():
+        if model.objects.filter(pk=pk).update(num_comments=F('num_comments') + change,
+                                              card_version=F('card_version') + 1):
+            refresh_hotness(model, pk)
+    pagecache.purge(model, pk)
+
+
+def recompute_hotness(model, batch_size=1000):
+    """
+    Recount comments and recompute hotness of all items of given model
+    :param model: Model with score, num_comments and hotness columns and hotness_date_field attribute
+    :param batch_size: Amount of items updated at once
+    :return: Amount of items processed
+    """
+    from comments.models import Comment
+
+    content_type = ContentType.objects.get_for_model(model)
+    processed = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            objects = list(model.objects.select_for_update().filter(pk__gt=last_id).order_by('pk')
+                           .only('pk', 'score', 'num_comments', 'hotness', model.hotness_date_field)[:batch_size])
+            if not objects:
+                pagecache.purge(model)
+                return processed
+            last_id = objects[-1].pk
+            comments = dict(Comment.objects.filter(content_type=content_type,
+                                                   object_id__in=[obj.pk for obj in objects])
+                            .order_by().values('object_id').annotate(amount=Count('id'))
+                            .values_list('object_id', 'amount'))
+            for obj in objects:
+                obj.num_comments = comments.get(obj.pk, 0)
+                obj.hotness = hotness(obj.score, obj.num_comments, getattr(obj, model.hotness_date_field))
+            model.objects.bulk_update(objects, ['num_comments', 'hotness'])
+        processed += len(objects)
+
+
+def record_vote(obj, user, vote):
+    """
+    Record user's vote and update score, num_votes and hotness columns of voted object in the same transaction.
+    Row of the object is locked, so concurrent votes can not overwrite each other's changes.
+    :param obj: Voted object, its model has to have score, num_votes and hotness columns
+    :param user: User who votes
+    :param vote: +1, -1 or 0 which removes user's vote
+    :return: Dictionary with current score and num_votes of the object
+    """
+    model = type(obj)
+    with transaction.atomic():
+        model.objects.select_for_update().filter(pk=obj.pk).values_list('pk').first()
+        previous = Vote.objects.get_for_user(obj, user)
+        Vote.objects.record_vote(obj, user, vote)
+        counted = vote != 0 or ZERO_VOTES_ALLOWED
+        score_change = vote - (previous.vote if previous is not None else 0)
+        num_votes_change = int(counted) - int(previous is not None)
+        if score_change or num_votes_change:
+            model.objects.filter(pk=obj.pk).update(score=F('score') + score_change,
+                                                   num_votes=F('num_votes') + num_votes_change,
+                                                   card_version=F('card_version') + 1)
+        row = refresh_hotness(model, obj.pk)
+        obj.score, obj.num_votes = row['score'], row['num_votes']
+    pagecache.purge(model, obj.pk)
+    return {'score': obj.score, 'num_votes': obj.num_votes}
+
+
+def reconcile_scores(model, batch_size=1000):
+    """
+    Repair score and num_votes columns which drifted from votes stored in the database,
+    hotness of repaired objects is recomputed as well
+    :param model: Model with score and num_votes columns, hotness is kept only if it has hotness_date_field
+    :param batch_size: Amount of objects compared and updated at once
+    :return: Amount of repaired objects
+    """
+    content_type = ContentType.objects.get_for_model(model)
+    ranked = hasattr(model, 'hotness_date_field')
+    fields = ['pk', 'score', 'num_votes'] + (['num_comments', model.hotness_date_field] if ranked else [])
+    updated_fields = ['score', 'num_votes', 'card_version'] + (['hotness'] if ranked else [])
+    repaired = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            # Rows are locked before votes are counted, the same way record_vote does it
+            objects = list(model.objects.select_for_update().filter(pk__gt=last_id).order_by('pk')
+                           .only(*fields)[:batch_size])
+            if not objects:
+                if repaired:
+                    pagecache.purge(model)
+                return repaired
+            last_id = objects[-1].pk
+            scores = {row['object_id']: row for row in
+                      Vote.objects.filter(content_type=content_type, object_id__in=[str(obj.pk) for obj in objects])
+                      .order_by().values('object_id').annotate(total=Sum('vote'), amount=Count('id'))}
+            drifted = []
+            for obj in objects:
+                # Votes keep object ids as text
+                row = scores.get(str(obj.pk), {'total': 0, 'amount': 0})
+                if (obj.score, obj.num_votes) != (row['total'] or 0, row['amount']):
+                    obj.score, obj.num_votes = row['total'] or 0, row['amount']
+                    obj.card_version = F('card_version') + 1
+                    if ranked:
+                        obj.hotness = hotness(obj.score, obj.num_comments, getattr(obj, model.hotness_date_field))
+                    drifted.append(obj)
+            model.objects.bulk_update(drifted, updated_fields)
+        repaired += len(drifted)
@@ -94,7 +94,12 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'social_django.context_processors.backends',
                 'social_django.context_processors.login_redirect',
+                'chat.context_processors.unread_messages',
             ],
+            'libraries': {
+                'cardcache': 'PawTravel.cardcache',
+                'images': 'PawTravel.imagetags',
+            },
         },
     },
 ]
@@ -184,3 +189,50 @@ SECRET_KEY = str(getenv('SECRET_KEY'))
 SOCIAL_AUTH_FACEBOOK_SECRET = str(getenv('SOCIAL_AUTH_FACEBOOK_SECRET'))
 SOCIAL_AUTH_GOOGLE_OAUTH2_SECRET = str(getenv('SOCIAL_AUTH_GOOGLE_OAUTH2_SECRET'))
 AVATAR_THUMB_FORMAT = "PNG"
+
+# Rate limits, versions of cached pages, cards and searches, and cache counters are kept in the default cache.
+# They hold across worker processes only if all of them share it, which manage.py check --deploy verifies.
+CACHES = {
+    'default': {
+        'BACKEND': getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Rate limits of user actions: (maximum amount of actions, window in seconds)
+RATE_LIMITS = {
+    'add_comment': (1, 30),
+    'send_message': (30, 60),
+    'broadcast_messages': (5, 60),
+    'vote': (60, 60),
+}
+
+# Rendered offer and guide cards are cached until they change, but at most this amount of seconds,
+# so changes of authors' avatars and names show up eventually
+CARD_CACHE_TIMEOUT = 60 * 60
+
+# Pages of anonymous users are purged when objects they show change, this timeout only
+# bounds changes which happen with time, e.g. offers which end
+PAGE_CACHE_TIMEOUT = 15 * 60
+
+# Ids of guides found by keyword searches are cached for this amount of seconds, any change of a guide
+# invalidates all of them, see travel_guides.search
+SEARCH_CACHE_TIMEOUT = 5 * 60
+
+# Approximate amounts of guides shown in lists paginated by cursors are counted at most once per this amount of seconds
+LIST_COUNT_CACHE_TIMEOUT = 10 * 60
+
+# Autocomplete of guide search, see travel_guides.typeahead
+TYPEAHEAD_GUIDES = 2000  # Amount of the hottest guides whose titles are suggested
+TYPEAHEAD_RESULTS = 8  # Maximum amount of suggestions for a single prefix
+TYPEAHEAD_PREFIX_LENGTH = 20  # Longer prefixes are matched by their first characters, bounds size of the trie
+TYPEAHEAD_CHECK_INTERVAL = 5  # Seconds between checks whether suggestions changed
+
+# Scaled down copies of uploaded images, see PawTravel.images
+IMAGE_DERIVATIVE_WORKERS = 2  # Size of the process pool generating them, 0 generates them during the request
+IMAGE_DERIVATIVE_QUALITY = 80
+
+# Chat settings
+CHAT_BROKER = 'chat.broker.InProcessBroker'  # Class delivering new message notifications to waiting clients
+CHAT_POLL_TIMEOUT = 25  # Maximum time in seconds a client waits for new messages
+CHAT_ARCHIVE_AFTER_DAYS = 365  # Messages older than this are moved into the archive by archive_messages
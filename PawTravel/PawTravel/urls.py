@@ -26,6 +26,9 @@ from django.urls import path, include
 
 from . import settings
 from offers.views import OfferHomepageView
+from .views import CacheStatsView
+from .pagecache import cache_anonymous_page
+from offers.models import Offer
 
 sys.path.append('..')
 
@@ -45,7 +48,8 @@ urlpatterns = [
     path('users/', include('users.urls')),
     path('avatar/', include('avatar.urls')),
     path('messages/', include('chat.urls')),
-    path('', OfferHomepageView.as_view(), name="offer_homepage")
+    path('cache-stats/', CacheStatsView.as_view(), name="cache_stats"),
+    path('', cache_anonymous_page(Offer)(OfferHomepageView.as_view()), name="offer_homepage")
 ]
 
 urlpatterns += staticfiles_urlpatterns()
@@ -0,0 +1,16 @@
+from django.http import JsonResponse
+from django.views import View
+
+from . import cachestats
+
+
+class CacheStatsView(View):
+    """
+    View showing hit and miss counters of application caches to staff members
+    Return format: {"<cache name>": {"hits": ..., "misses": ..., "hit_rate": ...}, ...}
+    """
+
+    def get(self, request):
+        if not request.user.is_staff:
+            return JsonResponse(status=403, data={'message': "You must be a staff member to access this endpoint"})
+        return JsonResponse(cachestats.get_stats())
@@ -3,3 +3,5 @@ from . import models
 
 # Register your models here.
 admin.site.register(models.Message)
+admin.site.register(models.Conversation)
+admin.site.register(models.ArchivedMessage)
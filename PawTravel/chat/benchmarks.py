@@ -0,0 +1,134 @@
+import random
+import statistics
+import sys
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from users.models import CustomUser
+from .models import Message, Conversation
+from .views import ConversationView, ChatAPIView
+
+# Maximum amount of SQL queries of each measured action, it must not depend on the amount of data
+QUERY_BUDGETS = {
+    'inbox': 1,
+    # Pages which run short of hot messages and reads of new messages also look into the archive
+    'conversation_page': 4,
+    'conversation_older_page': 4,
+    'send_message': 5,
+}
+
+# Transaction control statements are not counted
+IGNORED_QUERIES = ('BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+def seed(users_amount, messages_amount, rng):
+    """
+    Fill the database with users and messages. Conversation sizes are skewed,
+    a few pairs of users have most of the messages just like in a real inbox.
+    :param users_amount: Amount of created users
+    :param messages_amount: Amount of created messages
+    :param rng: Random instance, so the data can be reproduced
+    :return: List of created users
+    """
+    prefix = 'benchmark{}_'.format(rng.randrange(10 ** 9))
+    CustomUser.objects.bulk_create([CustomUser(username='{}{}'.format(prefix, number),
+                                               email='{}{}@benchmark.test'.format(prefix, number))
+                                    for number in range(users_amount)])
+    users = list(CustomUser.objects.filter(username__startswith=prefix).order_by('id'))
+    pairs = [tuple(rng.sample(users, 2)) for _ in range(max(users_amount * 2, 1))]
+    weights = [1 / rank for rank in range(1, len(pairs) + 1)]
+    messages_by_sender = {}
+    for sender, receiver in rng.choices(pairs, weights=weights, k=messages_amount):
+        messages_by_sender.setdefault(sender, []).append((receiver.id, 'Benchmark message'))
+    for sender, messages in messages_by_sender.items():
+        Message.search.send_many(sender, messages)
+    return users
+
+
+def measure(action, repeat):
+    """
+    Run the action several times
+    :param action: Function without arguments returning response
+    :param repeat: Amount of runs
+    :return: Dict with amount of queries of a single run, median time in milliseconds
+             and amount of responses which were not successful
+    """
+    timings = []
+    queries = 0
+    failed = 0
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            response = action()
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = len([query for query in context.captured_queries if not query['sql'].startswith(IGNORED_QUERIES)])
+        if response.status_code != 200:
+            failed += 1
+    return {'queries': queries, 'median_ms': round(statistics.median(timings), 3), 'failed_responses': failed}
+
+
+def benchmark_size(users_amount, messages_amount, repeat, rng):
+    """
+    Seed data of given size and measure chat views on the busiest user and conversation
+    :return: Dict of results of every action
+    """
+    seed(users_amount, messages_amount, rng)
+    busiest = Conversation.objects.order_by('-last_message_id').first()
+    user = CustomUser.objects.get(id=busiest.low_user_id)
+    partner = CustomUser.objects.get(id=busiest.high_user_id)
+    user.is_authenticated  # Do not count lazy attributes into measured queries
+    factory = RequestFactory()
+
+    def request(method, path, data=None):
+        request = getattr(factory, method)(path, data or {})
+        request.user = user
+        return request
+
+    def inbox():
+        return ConversationView.as_view()(request('get', '/messages/inbox/'))
+
+    def conversation_page():
+        return ChatAPIView.as_view()(request('get', '/messages/conversation/'), receiver=partner.id)
+
+    def conversation_older_page():
+        return ChatAPIView.as_view()(request('get', '/messages/conversation/', {'before': busiest.last_message_id}),
+                                     receiver=partner.id)
+
+    def send_message():
+        view = ChatAPIView
+        return view.post(self=view, request=request('post', '/messages/conversation/'), receiver=partner.id,
+                         content='Benchmark message', timestamp=busiest.last_message_id)
+
+    return {name: dict(measure(action, repeat), budget=QUERY_BUDGETS[name])
+            for name, action in (('inbox', inbox), ('conversation_page', conversation_page),
+                                 ('conversation_older_page', conversation_older_page),
+                                 ('send_message', send_message))}
+
+
+def run_benchmark(sizes, repeat=5, random_seed=0):
+    """
+    Measure chat views for every data size
+    Data of each size is added on top of the previous one, run it inside of a transaction
+    which is rolled back afterwards.
+    :param sizes: List of (users amount, messages amount) tuples
+    :param repeat: Amount of runs of every action
+    :param random_seed: Seed of generated data
+    :return: Machine readable report, 'passed' is False if any action exceeded its query budget or failed
+    """
+    rng = random.Random(random_seed)
+    report = {'seed': random_seed, 'repeat': repeat, 'sizes': []}
+    # Rate limits would turn repeated actions into measurements of rejected requests
+    with override_settings(RATE_LIMITS={action: (sys.maxsize, 1) for action in settings.RATE_LIMITS}):
+        for users_amount, messages_amount in sizes:
+            report['sizes'].append({
+                'users': users_amount,
+                'messages': messages_amount,
+                'results': benchmark_size(users_amount, messages_amount, repeat, rng),
+            })
+    report['passed'] = all(result['queries'] <= result['budget'] and not result['failed_responses']
+                           for size in report['sizes'] for result in size['results'].values())
+    return report
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class Subscription:
+    """
+    Single waiting client of the broker.
+    It has to be created inside of a running event loop, because it will be woken up within that loop.
+    """
+    def __init__(self, broker, user_id):
+        self.broker = broker
+        self.user_id = user_id
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+
+    def notify(self):
+        """
+        Wake up the subscription. It is safe to call it from any thread
+        """
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            # Event loop of this subscription is already closed
+            pass
+
+    async def wait(self, timeout):
+        """
+        Wait until a new message is published for the subscribed user
+        :param timeout: Maximum waiting time in seconds
+        :return: True if a message was published, False on timeout
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """
+    Publish/subscribe of new message notifications within a single process.
+    Any other broker (ex. backed by Redis) has to provide the same subscribe, unsubscribe and publish methods
+    and can be used instead of this one with CHAT_BROKER setting.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, user_id):
+        """
+        Start listening for new messages of given user
+        :param user_id: Id of the user who receives messages
+        :return: Subscription object, it must be closed when it is no longer needed
+        """
+        subscription = Subscription(self, user_id)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.user_id, None)
+
+    def publish(self, user_id, message_id):
+        """
+        Notify every waiting subscription of the user about new message
+        :param user_id: Id of the user who received message
+        :param message_id: Id of the new message
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.notify()
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    """
+    Get broker of this process, its class is defined by CHAT_BROKER setting
+    """
+    broker_class = getattr(settings, 'CHAT_BROKER', 'chat.broker.InProcessBroker')
+    return import_string(broker_class)()
@@ -0,0 +1,14 @@
+from django.utils.functional import SimpleLazyObject
+
+from .models import Conversation
+
+
+def unread_messages(request):
+    """
+    Adds total amount of unread messages of currently logged user to the context,
+    it is computed only if a template really uses it
+    """
+    if not request.user.is_authenticated:
+        return {}
+    return {'unread_messages': SimpleLazyObject(
+        lambda: sum(Conversation.objects.get_unread_counts(request.user).values()))}
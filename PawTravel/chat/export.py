@@ -0,0 +1,63 @@
+import csv
+import json
+from itertools import chain
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from .models import Message, ArchivedMessage
+
+EXPORT_FIELDS = ('id', 'sent_by', 'sent_to', 'content', 'date')
+EXPORT_FORMATS = ('jsonl', 'csv')
+
+
+class Echo:
+    """
+    File-like object which returns written value instead of keeping it, so csv writer can be streamed
+    """
+    def write(self, value):
+        return value
+
+
+def get_export_rows(user, chunk_size=2000):
+    """
+    Walk through all messages sent or received by the user without loading all of them into memory
+    :param user: User whose messages are exported
+    :param chunk_size: Amount of rows fetched from the database at once
+    :return: Iterator of tuples with values of EXPORT_FIELDS, oldest message first
+    """
+    # Archived messages are older than every message in the hot table
+    return chain(*[(manager.filter(Q(sent_by=user) | Q(sent_to=user)).order_by('id')
+                    .values_list('id', 'sent_by__username', 'sent_to__username', 'content', 'date')
+                    .iterator(chunk_size=chunk_size))
+                   for manager in (ArchivedMessage.objects, Message.search)])
+
+
+def render_jsonl(rows):
+    """
+    Render rows as json lines, one message per line
+    """
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def render_csv(rows):
+    """
+    Render rows as csv with a header line
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def export_messages(user, export_format='jsonl', chunk_size=2000):
+    """
+    Get generator of exported messages of given user
+    :param user: User whose messages are exported
+    :param export_format: One of EXPORT_FORMATS
+    :param chunk_size: Amount of rows fetched from the database at once
+    :return: Generator of text chunks
+    """
+    renderer = render_csv if export_format == 'csv' else render_jsonl
+    return renderer(get_export_rows(user, chunk_size))
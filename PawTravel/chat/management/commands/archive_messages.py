@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.models import ArchivedMessage
+
+
+class Command(BaseCommand):
+    """
+    Moves old messages from the hot Message table into the archive.
+    Every batch is committed on its own, so locks are held only for a short time
+    and an interrupted run simply continues from the oldest remaining message.
+    """
+    help = 'Moves messages older than given age into the archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CHAT_ARCHIVE_AFTER_DAYS,
+                            help='Messages older than this amount of days are archived')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Amount of messages moved in a single transaction')
+
+    def handle(self, *args, **options):
+        older_than = timezone.now() - timedelta(days=options['days'])
+        total = 0
+        while True:
+            moved = ArchivedMessage.objects.archive_batch(older_than, options['batch_size'])
+            if not moved:
+                break
+            total += moved
+        self.stdout.write(self.style.SUCCESS('Archived {} messages'.format(total)))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.functions import Least, Greatest
+
+from chat.models import Message
+
+
+class Command(BaseCommand):
+    """
+    Fills canonical user pair of messages saved before the pair was introduced.
+    Work is done in id ranges, each one in its own transaction, so the command can be safely
+    interrupted and started again.
+    """
+    help = 'Fills canonical (low_user, high_user) pair of existing messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Size of id range updated in a single transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = Message.search.aggregate(last_id=Max('id'))['last_id'] or 0
+        start = 0
+        updated = 0
+        while start < last_id:
+            with transaction.atomic():
+                updated += Message.search.filter(id__gt=start, id__lte=start + batch_size,
+                                                 low_user__isnull=True).update(
+                    low_user=Least('sent_by', 'sent_to'),
+                    high_user=Greatest('sent_by', 'sent_to'))
+            start += batch_size
+        self.stdout.write(self.style.SUCCESS('Filled user pair of {} messages'.format(updated)))
@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from chat.benchmarks import run_benchmark
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Seeds users and messages, measures chat views and rolls every change back.
+    Fails when any view needs more SQL queries than its declared budget.
+    """
+    help = 'Benchmarks chat views at several data sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='50:1000,200:10000',
+                            help='Comma separated list of users:messages data sizes')
+        parser.add_argument('--repeat', type=int, default=5, help='Amount of runs of every measured action')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of generated data')
+        parser.add_argument('--output', help='Path of json report, standard output by default')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [tuple(int(value) for value in size.split(':')) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('Sizes must have format users:messages,users:messages')
+
+        report = None
+        try:
+            with transaction.atomic():
+                report = run_benchmark(sizes, options['repeat'], options['seed'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+        if not report['passed']:
+            raise CommandError('Query budget exceeded or requests failed')
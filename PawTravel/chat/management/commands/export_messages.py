@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.export import export_messages, EXPORT_FORMATS
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    """
+    Writes every message sent or received by the user to a file or to standard output
+    """
+    help = 'Exports full message history of a user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Username of the user whose messages are exported')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='jsonl')
+        parser.add_argument('--output', help='Path of the output file, standard output by default')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Amount of messages fetched from the database at once')
+
+    def handle(self, *args, **options):
+        try:
+            user = CustomUser.objects.get(username=options['username'])
+        except CustomUser.DoesNotExist:
+            raise CommandError('User "{}" does not exist'.format(options['username']))
+
+        chunks = export_messages(user, options['format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
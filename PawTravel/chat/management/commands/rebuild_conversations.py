@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.functions import Least, Greatest
+
+from chat.models import Message, Conversation
+
+
+class Command(BaseCommand):
+    """
+    Fills the conversation index with conversations of already existing messages.
+    Unread counters of newly created conversations start at zero,
+    counters of conversations which already exist are left untouched.
+    """
+    help = 'Rebuilds conversation index from existing messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Amount of conversations written in a single transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pairs = (Message.search.annotate(low=Least('sent_by', 'sent_to'), high=Greatest('sent_by', 'sent_to'))
+                 .values('low', 'high').annotate(last_id=Max('id')).order_by('last_id'))
+        batch = []
+        total = 0
+        for pair in pairs.iterator():
+            batch.append(pair)
+            if len(batch) >= batch_size:
+                total += self._write_batch(batch)
+                batch = []
+        total += self._write_batch(batch)
+        self.stdout.write(self.style.SUCCESS('Rebuilt {} conversations'.format(total)))
+
+    @staticmethod
+    def _write_batch(pairs):
+        """
+        Creates or moves forward conversations of given user pairs
+        :param pairs: List of dicts with low, high user id and id of their last message
+        :return: Amount of processed conversations
+        """
+        if not pairs:
+            return 0
+        last_messages = Message.search.in_bulk([pair['last_id'] for pair in pairs])
+        with transaction.atomic():
+            existing = {(conversation.low_user_id, conversation.high_user_id): conversation
+                        for conversation in Conversation.objects.filter(
+                            low_user_id__in={pair['low'] for pair in pairs},
+                            high_user_id__in={pair['high'] for pair in pairs})}
+            to_create = []
+            to_update = []
+            for pair in pairs:
+                message = last_messages[pair['last_id']]
+                conversation = existing.get((pair['low'], pair['high']))
+                if conversation is None:
+                    conversation = Conversation(low_user_id=pair['low'], high_user_id=pair['high'])
+                    to_create.append(conversation)
+                elif conversation.last_message_id < message.id:
+                    to_update.append(conversation)
+                else:
+                    continue
+                conversation.last_message_id = message.id
+                conversation.last_message_content = message.content
+                conversation.last_message_date = message.date
+            Conversation.objects.bulk_create(to_create, ignore_conflicts=True)
+            Conversation.objects.bulk_update(to_update, ['last_message_id', 'last_message_content',
+                                                         'last_message_date'])
+        return len(pairs)
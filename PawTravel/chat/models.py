@@ -1,14 +1,27 @@
 import datetime
 
 import pytz
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q, F, Max
 # Create your models here.
 from django.conf import settings
-from itertools import chain
+
+from .broker import get_broker
 
 
 class MessageManager(models.Manager):
+    SERIALIZED_FIELDS = ('id', 'sent_by_id', 'sent_to_id', 'content', 'date')
+
+    @staticmethod
+    def get_pair(user_one, user_two):
+        """
+        Get canonical pair of users, the same for both directions of conversation
+        :param user_one: First user in conversation (object or id)
+        :param user_two: Second user in conversation (object or id)
+        :return: Tuple of (lower user id, higher user id)
+        """
+        return tuple(sorted((getattr(user_one, 'pk', user_one), getattr(user_two, 'pk', user_two))))
+
     def get_conversation(self, user_one, user_two, oldest_id=None):
         """
         Get all messages between two users
@@ -23,10 +36,59 @@ class MessageManager(models.Manager):
         if oldest_id==None:
             oldest_id=0
 
-        quert_set_one= super().get_queryset().filter(id__gt=oldest_id, sent_by=user_one, sent_to=user_two)
-        quert_set_two= super().get_queryset().filter(id__gt=oldest_id, sent_by=user_two, sent_to=user_one)
-        result= quert_set_one | quert_set_two
-        return list(result.order_by('date').values())
+        low_user_id, high_user_id = self.get_pair(user_one, user_two)
+        result = super().get_queryset().filter(low_user_id=low_user_id, high_user_id=high_user_id, id__gt=oldest_id)
+        return list(result.order_by('id').values(*self.SERIALIZED_FIELDS))
+
+    def get_conversation_page(self, user_one, user_two, before=None, after=None, limit=50):
+        """
+        Get single page of messages between two users, using message ids as cursors
+        :param user_one: First user in conversation
+        :param user_two: Second user in conversation
+        :param before: Optional cursor, only messages older than the message with this id are returned
+        :param after: Optional cursor, only messages newer than the message with this id are returned
+        :param limit: Maximum amount of returned messages
+        :return: Dict with list of serialized messages (oldest first) and cursors of
+                 previous (older) and next (newer) page, cursor is None if there is no such page
+
+        Without cursors the newest page of conversation is returned.
+        If only 'after' is provided the page starts right after it, otherwise the page ends right before 'before'.
+        Archived messages are read only when the page reaches past the messages kept in this table.
+        """
+        low_user_id, high_user_id = self.get_pair(user_one, user_two)
+        filters = {'low_user_id': low_user_id, 'high_user_id': high_user_id}
+        if before is not None:
+            filters['id__lt'] = before
+        # Hot messages are newer than all archived ones, so reading backwards touches the archive only when
+        # the hot table runs short. Its contents are not remembered, archiving runs in another process.
+        if after is not None:
+            filters['id__gt'] = after
+            messages = self._read_page([ArchivedMessage.objects, self], filters, 'id', limit)
+            has_older, has_newer = True, len(messages) > limit
+            messages = messages[:limit]
+        else:
+            messages = self._read_page([self, ArchivedMessage.objects], filters, '-id', limit)
+            has_older, has_newer = len(messages) > limit, before is not None
+            messages = messages[:limit][::-1]
+        return {
+            'messages': messages,
+            'previous': messages[0]['id'] if messages and has_older else None,
+            'next': messages[-1]['id'] if messages and has_newer else None,
+        }
+
+    def _read_page(self, sources, filters, ordering, limit):
+        """
+        Read up to limit + 1 messages, moving to the next source only if the previous one has run out of messages
+        :param sources: Managers of hot and archived messages, in order of reading
+        :return: List of serialized messages sorted by ordering
+        """
+        messages = []
+        for source in sources:
+            query_set = source.filter(**filters).order_by(ordering).values(*self.SERIALIZED_FIELDS)
+            messages += list(query_set[:limit + 1 - len(messages)])
+            if len(messages) > limit:
+                break
+        return messages
 
     def _get_last_message(self, user_tuple):
         """
@@ -34,31 +96,50 @@ class MessageManager(models.Manager):
         :param user_tuple: Tuple of two users ids
         :return: Message object
         """
-        quert_set_one= super().get_queryset().filter(sent_by=user_tuple[0], sent_to=user_tuple[1])
-        quert_set_two= super().get_queryset().filter(sent_by=user_tuple[1], sent_to=user_tuple[0])
-        result= quert_set_one | quert_set_two
-        id=result.order_by('-pk')[0].id
-        return super().get_queryset().get(id=id)
+        low_user_id, high_user_id = self.get_pair(*user_tuple)
+        return super().get_queryset().filter(low_user_id=low_user_id, high_user_id=high_user_id).latest('id')
+
+    def send_many(self, sender, messages):
+        """
+        Send many messages of a single user at once
+        Messages are inserted with a single query and conversations are refreshed in the same transaction.
+        :param sender: User who sends messages
+        :param messages: List of (receiver id, content) tuples
+        :return: List of created Message objects, in the same order as provided
+        """
+        if not messages:
+            return []
+        objects = []
+        for receiver_id, content in messages:
+            low_user_id, high_user_id = self.get_pair(sender, receiver_id)
+            objects.append(Message(sent_by=sender, sent_to_id=receiver_id, content=content,
+                                   low_user_id=low_user_id, high_user_id=high_user_id))
+        with transaction.atomic():
+            last_id = super().get_queryset().aggregate(last_id=Max('id'))['last_id'] or 0
+            objects = self.bulk_create(objects)
+            if objects[0].pk is None:
+                # Database does not return ids of inserted rows, so they have to be read again. The same sender
+                # could have sent other messages meanwhile, inserted rows are the run matching sent messages.
+                expected = [(message.sent_to_id, message.content) for message in objects]
+                candidates = list(super().get_queryset().filter(sent_by=sender, id__gt=last_id).order_by('id'))
+                for start in range(len(candidates) - len(expected) + 1):
+                    run = candidates[start:start + len(expected)]
+                    if [(message.sent_to_id, message.content) for message in run] == expected:
+                        objects = run
+                        break
+            Conversation.objects.record_messages(objects)
+            transaction.on_commit(lambda: [get_broker().publish(message.sent_to_id, message.id)
+                                           for message in objects])
+        return objects
 
     def get_conversation_users(self, user):
         """
         Get all user whith whom given user have conversation
         :param user: user whose list of conversation we want
-        :return: list of unique user id's which have at least one message with given user, additionally last message will be zipped with each user id
+        :return: list of (user id, Conversation) tuples, the most recently active conversation goes first
         """
-        quert_set_one= super().get_queryset().filter(sent_by=user)
-        q_one=quert_set_one.values_list('sent_to')
-        q_one=(list(q_one))
-
-        quert_set_two= super().get_queryset().filter(sent_to=user)
-        q_two=quert_set_two.values_list('sent_by')
-        q_two=(list(q_two))
-        result=q_one+q_two
-        result=list(chain(*result))
-        res=list(dict.fromkeys(result))
-        res=map(lambda e: (e, user.id), res)
-        res=list(map(self._get_last_message, res))
-        return list((zip(list(dict.fromkeys(result)), res)))
+        return [(conversation.get_partner_id(user), conversation)
+                for conversation in Conversation.objects.for_user(user)]
 
 
 class Message(models.Model):
@@ -75,9 +156,308 @@ class Message(models.Model):
         on_delete=models.CASCADE,
         related_name="receiver"
     )
+    # Canonical pair of conversation users, the one with the lower id goes first.
+    # It lets both directions of a conversation be read with a single index range scan.
+    low_user=models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="+",
+        db_index=False,
+        null=True,
+        editable=False
+    )
+    high_user=models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="+",
+        db_index=False,
+        null=True,
+        editable=False
+    )
     content=models.CharField(max_length=1024)
     date=models.DateTimeField(auto_now_add=True)
     search = MessageManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['low_user', 'high_user', 'id'], name='chat_message_pair_idx'),
+        ]
+
+    def __str__(self):
+        return "{} to {} [{}]: {}".format(self.sent_by, self.sent_to, self.date, self.content)
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the message and, if it is a new one, refreshes the conversation
+        it belongs to in the same transaction
+        """
+        created = self.pk is None
+        self.low_user_id, self.high_user_id = Message.search.get_pair(self.sent_by_id, self.sent_to_id)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if created:
+                Conversation.objects.record_message(self)
+                transaction.on_commit(lambda: get_broker().publish(self.sent_to_id, self.id))
+
+
+class ArchivedMessageManager(models.Manager):
+    def archive_batch(self, older_than, batch_size):
+        """
+        Move single batch of the oldest messages into the archive, in its own transaction
+        :param older_than: Only messages sent before this date are archived
+        :param batch_size: Maximum amount of moved messages
+        :return: Amount of moved messages
+        """
+        with transaction.atomic():
+            messages = list(Message.search.filter(date__lt=older_than).order_by('id')[:batch_size])
+            if not messages:
+                return 0
+            self.bulk_create([ArchivedMessage(id=message.id, sent_by_id=message.sent_by_id,
+                                              sent_to_id=message.sent_to_id, low_user_id=message.low_user_id,
+                                              high_user_id=message.high_user_id, content=message.content,
+                                              date=message.date)
+                              for message in messages], ignore_conflicts=True)
+            Message.search.filter(id__in=[message.id for message in messages]).delete()
+        return len(messages)
+
+
+class ArchivedMessage(models.Model):
+    """
+    Class representing message moved out of the hot Message table, it keeps id of the original message
+    """
+    id=models.BigIntegerField(primary_key=True)
+    sent_by=models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="+"
+    )
+    sent_to=models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="+"
+    )
+    low_user=models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="+",
+        db_index=False,
+        null=True
+    )
+    high_user=models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="+",
+        db_index=False,
+        null=True
+    )
+    content=models.CharField(max_length=1024)
+    date=models.DateTimeField()
+    objects = ArchivedMessageManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['low_user', 'high_user', 'id'], name='chat_archive_pair_idx'),
+        ]
+
+    def __str__(self):
+        return "{} to {} [{}]: {}".format(self.sent_by, self.sent_to, self.date, self.content)
+
+
+class ConversationManager(models.Manager):
+    def for_user(self, user):
+        """
+        Get all conversations of given user
+        :param user: User whose conversations we want
+        :return: Query set of conversations, the most recently active one goes first
+        """
+        return super().get_queryset().filter(Q(low_user=user) | Q(high_user=user)).order_by('-last_message_date')
+
+    def get_unread_counts(self, user):
+        """
+        Get amount of unread messages of given user in each of his conversations
+        :param user: User whose unread messages we want
+        :return: Dict of {partner id: amount of unread messages}, conversations without unread messages are omitted
+        """
+        conversations = super().get_queryset().filter(Q(low_user=user, low_unread__gt=0) |
+                                                      Q(high_user=user, high_unread__gt=0))
+        return {conversation.get_partner_id(user): conversation.get_unread(user)
+                for conversation in conversations.only('low_user', 'high_user', 'low_unread', 'high_unread')}
+
+    def mark_read(self, user, partner, up_to=None):
+        """
+        Move read marker of given user forward
+        :param user: User who has read messages
+        :param partner: Second user of the conversation
+        :param up_to: Id of the last read message, by default the whole conversation is read
+        :return: Conversation object or None if those users have no conversation
+        """
+        low_user_id, high_user_id = Message.search.get_pair(user, partner)
+        side = 'low' if user.id == low_user_id else 'high'
+        with transaction.atomic():
+            conversation = super().get_queryset().select_for_update().filter(
+                low_user_id=low_user_id, high_user_id=high_user_id).first()
+            if conversation is None:
+                return None
+            read_up_to = getattr(conversation, side + '_read_up_to')
+            target = conversation.last_message_id if up_to is None else min(up_to, conversation.last_message_id)
+            if target <= read_up_to:
+                return conversation
+            if target == conversation.last_message_id:
+                unread = 0
+            else:
+                # Unlike the rest of unread state, a partial read needs a count, the counter alone can not tell it.
+                # Only messages between the old and the new marker are counted, it is a short index range
+                # of both the hot table and the archive, since the older of them could have been archived already.
+                newly_read = sum(source.filter(low_user_id=low_user_id, high_user_id=high_user_id,
+                                               id__gt=read_up_to, id__lte=target, sent_to=user).count()
+                                 for source in (Message.search, ArchivedMessage.objects))
+                unread = max(getattr(conversation, side + '_unread') - newly_read, 0)
+            setattr(conversation, side + '_read_up_to', target)
+            setattr(conversation, side + '_unread', unread)
+            conversation.save(update_fields=[side + '_read_up_to', side + '_unread'])
+        return conversation
+
+    def record_message(self, message):
+        """
+        Moves the conversation of the message sender and receiver forward to the given message.
+        Conversation is created if those two users have never talked before.
+        :param message: Freshly saved Message object
+        """
+        low_user_id, high_user_id = Message.search.get_pair(message.sent_by_id, message.sent_to_id)
+        unread_field = 'low_unread' if message.sent_to_id == low_user_id else 'high_unread'
+        values = {
+            'last_message_id': message.id,
+            'last_message_content': message.content,
+            'last_message_date': message.date,
+        }
+        conversation = super().get_queryset().filter(low_user_id=low_user_id, high_user_id=high_user_id)
+        if conversation.update(**values, **{unread_field: F(unread_field) + 1}):
+            return
+        try:
+            with transaction.atomic():
+                self.create(low_user_id=low_user_id, high_user_id=high_user_id, **values, **{unread_field: 1})
+        except IntegrityError:
+            # Someone else has just created this conversation
+            conversation.update(**values, **{unread_field: F(unread_field) + 1})
+
+    def get_by_pairs(self, pairs):
+        """
+        :param pairs: Iterable of (low user id, high user id) tuples
+        :return: Dict of {pair: conversation} of pairs which have a conversation
+        """
+        pairs = set(pairs)
+        conversations = super().get_queryset().filter(low_user_id__in={pair[0] for pair in pairs},
+                                                      high_user_id__in={pair[1] for pair in pairs})
+        return {(conversation.low_user_id, conversation.high_user_id): conversation
+                for conversation in conversations
+                if (conversation.low_user_id, conversation.high_user_id) in pairs}
+
+    def record_messages(self, messages):
+        """
+        Moves many conversations forward at once, it is meant for messages created with bulk_create
+        :param messages: List of freshly saved Message objects
+        """
+        changes = {}
+        for message in sorted(messages, key=lambda message: message.id):
+            pair = Message.search.get_pair(message.sent_by_id, message.sent_to_id)
+            change = changes.setdefault(pair, {'message': message, 'low_unread': 0, 'high_unread': 0})
+            change['message'] = message
+            change['low_unread' if message.sent_to_id == pair[0] else 'high_unread'] += 1
+
+        existing = self.get_by_pairs(changes)
+        to_create = []
+        to_update = []
+        for pair, change in changes.items():
+            conversation = existing.get(pair)
+            if conversation is None:
+                conversation = Conversation(low_user_id=pair[0], high_user_id=pair[1],
+                                            low_unread=change['low_unread'], high_unread=change['high_unread'])
+                to_create.append(conversation)
+            else:
+                conversation.low_unread = F('low_unread') + change['low_unread']
+                conversation.high_unread = F('high_unread') + change['high_unread']
+                to_update.append(conversation)
+            conversation.last_message_id = change['message'].id
+            conversation.last_message_content = change['message'].content
+            conversation.last_message_date = change['message'].date
+        try:
+            with transaction.atomic():
+                self.bulk_create(to_create)
+        except IntegrityError:
+            # Someone else has just created some of those conversations, they are moved forward one by one
+            for conversation in to_create:
+                try:
+                    with transaction.atomic():
+                        conversation.save(force_insert=True)
+                except IntegrityError:
+                    super().get_queryset().filter(
+                        low_user_id=conversation.low_user_id, high_user_id=conversation.high_user_id,
+                    ).update(last_message_id=conversation.last_message_id,
+                             last_message_content=conversation.last_message_content,
+                             last_message_date=conversation.last_message_date,
+                             low_unread=F('low_unread') + conversation.low_unread,
+                             high_unread=F('high_unread') + conversation.high_unread)
+        self.bulk_update(to_update, ['last_message_id', 'last_message_content', 'last_message_date',
+                                     'low_unread', 'high_unread'])
+
+
+class Conversation(models.Model):
+    """
+    Class representing conversation between two users.
+    It keeps the last message of the conversation and unread counters of both sides,
+    so the inbox does not have to look through all the messages.
+    Users are always stored in order, the one with the lower id goes first.
+    """
+    low_user=models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="+"
+    )
+    high_user=models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="+"
+    )
+    last_message_id=models.BigIntegerField(default=0)
+    last_message_content=models.CharField(max_length=1024, blank=True)
+    last_message_date=models.DateTimeField()
+    low_unread=models.PositiveIntegerField(default=0)
+    high_unread=models.PositiveIntegerField(default=0)
+    # Id of the last message each side has read
+    low_read_up_to=models.BigIntegerField(default=0)
+    high_read_up_to=models.BigIntegerField(default=0)
+    objects = ConversationManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['low_user', 'high_user'], name='chat_conversation_unique_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['low_user', '-last_message_date'], name='chat_conv_low_recent_idx'),
+            models.Index(fields=['high_user', '-last_message_date'], name='chat_conv_high_recent_idx'),
+        ]
+
     def __str__(self):
-        return "{} to {} [{}]: {}".format(self.sent_by, self.sent_to, self.date, self.content)
\ No newline at end of file
+        return "{} and {} [{}]".format(self.low_user, self.high_user, self.last_message_date)
+
+    def get_partner_id(self, user):
+        """
+        Get id of the other side of conversation
+        :param user: One of the conversation users
+        :return: Id of the second user
+        """
+        return self.high_user_id if self.low_user_id == user.id else self.low_user_id
+
+    def get_unread(self, user):
+        """
+        Get amount of messages given user has not read yet
+        :param user: One of the conversation users
+        """
+        return self.low_unread if self.low_user_id == user.id else self.high_unread
+
+    def get_read_up_to(self, user):
+        """
+        Get id of the last message given user has read
+        :param user: One of the conversation users
+        """
+        return self.low_read_up_to if self.low_user_id == user.id else self.high_read_up_to
@@ -1,16 +1,28 @@
+import asyncio
+import csv
 import json
+import threading
 import time
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils.timezone import make_aware
 from users.models import CustomUser
 # Create your tests here.
 from django.test.client import RequestFactory, Client
-from chat.views import ConversationView, ChatAPIView
-from chat.models import Message
+from chat.views import ConversationView, ChatAPIView, ReadMarkerView, UnreadView, poll
+from chat.broker import InProcessBroker
+from chat.benchmarks import run_benchmark
+from chat.models import Message, Conversation, ArchivedMessage
+from django.conf import settings
+from django.core.cache import cache
 from datetime import timedelta, datetime
 from unittest import mock
 from datetime import date
+from io import StringIO
+from django.core.management import call_command, CommandError
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 class ConversationListTests(TestCase):
     def setUp(self):
@@ -120,12 +132,32 @@ class ChattingAPITests(TestCase):
         request.user = self.user_one
         view = ChatAPIView
         response = view.post(self=view, request=request, receiver=self.user_two.id, content="Lorem Ipsum")
-        json_response = json.loads(response.content.decode())
+        json_response = json.loads(response.content.decode())['messages']
         self.assertEqual(len(json_response), 1, "Expected single message, got {}".format(len(json_response)))
         self.assertEqual(json_response[0]['sent_by_id'], 1)
         self.assertEqual(json_response[0]['sent_to_id'], 2)
         self.assertEqual(json_response[0]['content'], "Lorem Ipsum")
 
+    @override_settings(RATE_LIMITS={'send_message': (2, 60)})
+    def test_sending_too_quickly(self):
+        """
+        Checks if user sending messages too quickly gets 429 code with Retry-After header
+        and the rejected message is not saved
+        """
+        cache.clear()
+        factory = RequestFactory()
+        request = factory.post("/conversation")
+        request.user = self.user_one
+        view = ChatAPIView
+        for _ in range(2):
+            response = view.post(self=view, request=request, receiver=self.user_two.id, content="Lorem Ipsum")
+            self.assertEqual(response.status_code, 200)
+        response = view.post(self=view, request=request, receiver=self.user_two.id, content="Lorem Ipsum")
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(int(response['Retry-After']) >= 1)
+        self.assertEqual(Message.search.count(), 2)
+        cache.clear()
+
     def test_sending_to_yourself(self):
         """
         Checks if user can send message to himself
@@ -185,7 +217,7 @@ class ChattingAPITests(TestCase):
         view = ChatAPIView
         response = view.get(self=view, request=request, receiver=self.user_one.id)
         json_response_two = json.loads(response.content.decode())
-        self.assertEqual(len(json_response), 5)
+        self.assertEqual(len(json_response['messages']), 5)
         self.assertEqual(json_response, json_response_two)
 
     def test_message_filter_range(self):
@@ -210,7 +242,7 @@ class ChattingAPITests(TestCase):
         request.user = self.user_one
         view = ChatAPIView
         response = view.get(self=view, request=request, receiver=self.user_two.id, timestamp=third_message.id)
-        json_response = json.loads(response.content.decode())
+        json_response = json.loads(response.content.decode())['messages']
         self.assertEqual(len(json_response), 3, "Expected 3 messages, got {}".format(len(json_response)))
 
         factory = RequestFactory()
@@ -218,5 +250,679 @@ class ChattingAPITests(TestCase):
         request.user = self.user_one
         view = ChatAPIView
         response = view.get(self=view, request=request, receiver=self.user_two.id, timestamp=last_message.id)
+        json_response = json.loads(response.content.decode())['messages']
+        self.assertEqual(len(json_response), 0, "Expected 0 messages, got {}".format(len(json_response)))
+
+class ConversationPaginationTests(TestCase):
+    """
+    Class responsible for testing cursor pagination of conversation
+    """
+    def setUp(self):
+        """
+        Preparing two user accounts with a conversation of ten messages
+        """
+        self.user_one = CustomUser(username="TestUser", email="test_email@test.com")
+        self.user_one.save()
+        self.user_two = CustomUser(username="TestUser2", email="test_email2@test.com")
+        self.user_two.save()
+        self.messages = []
+        for number in range(10):
+            message = Message(content="Lorem Ipsum {}".format(number), sent_by=self.user_one, sent_to=self.user_two)
+            message.save()
+            self.messages.append(message)
+
+    def _get(self, **params):
+        factory = RequestFactory()
+        request = factory.get("/conversation", params)
+        request.user = self.user_one
+        view = ChatAPIView
+        return view.get(self=view, request=request, receiver=self.user_two.id)
+
+    def test_newest_page(self):
+        """
+        Checks if newest page is returned without cursors
+        """
+        json_response = json.loads(self._get(limit=4).content.decode())
+        self.assertEqual([message['id'] for message in json_response['messages']],
+                         [message.id for message in self.messages[6:]])
+        self.assertEqual(json_response['previous'], self.messages[6].id)
+        self.assertIsNone(json_response['next'])
+
+    def test_walking_backwards(self):
+        """
+        Checks if 'before' cursor returns older messages until the beginning of conversation
+        """
+        json_response = json.loads(self._get(limit=4, before=self.messages[6].id).content.decode())
+        self.assertEqual([message['id'] for message in json_response['messages']],
+                         [message.id for message in self.messages[2:6]])
+        self.assertEqual(json_response['next'], self.messages[5].id)
+        json_response = json.loads(self._get(limit=4, before=json_response['previous']).content.decode())
+        self.assertEqual(len(json_response['messages']), 2)
+        self.assertIsNone(json_response['previous'])
+
+    def test_walking_forward(self):
+        """
+        Checks if 'after' cursor returns newer messages
+        """
+        json_response = json.loads(self._get(limit=4, after=self.messages[1].id).content.decode())
+        self.assertEqual([message['id'] for message in json_response['messages']],
+                         [message.id for message in self.messages[2:6]])
+        self.assertEqual(json_response['next'], self.messages[5].id)
+
+    def test_limit_cap(self):
+        """
+        Checks if page is never bigger than the server side maximum
+        """
+        with mock.patch.object(ChatAPIView, 'max_page_size', 3):
+            json_response = json.loads(self._get(limit=1000).content.decode())
+        self.assertEqual(len(json_response['messages']), 3)
+
+    def test_invalid_limit(self):
+        """
+        Checks if invalid pagination parameters return 400 code
+        """
+        self.assertEqual(self._get(limit=0).status_code, 400)
+        self.assertEqual(self._get(before="abc").status_code, 400)
+
+    def test_send_returns_delta(self):
+        """
+        Checks if sending a message returns only messages newer than the provided timestamp
+        """
+        factory = RequestFactory()
+        request = factory.post("/conversation")
+        request.user = self.user_two
+        view = ChatAPIView
+        response = view.post(self=view, request=request, receiver=self.user_one.id, content="Lorem Ipsum",
+                             timestamp=self.messages[8].id)
+        json_response = json.loads(response.content.decode())
+        self.assertEqual([message['content'] for message in json_response['messages']],
+                         ["Lorem Ipsum 9", "Lorem Ipsum"])
+
+
+class ConversationIndexTests(TestCase):
+    """
+    Class responsible for testing if conversation index is kept up to date
+    """
+    def setUp(self):
+        """
+        Preparing three user accounts
+        """
+        self.user_one = CustomUser(username="TestUser", email="test_email@test.com")
+        self.user_one.save()
+        self.user_two = CustomUser(username="TestUser2", email="test_email2@test.com")
+        self.user_two.save()
+        self.user_three = CustomUser(username="TestUser3", email="test_email3@test.com")
+        self.user_three.save()
+
+    def test_single_conversation_per_pair(self):
+        """
+        Checks if messages sent in both directions end up in a single conversation
+        """
+        Message(content="Lorem Ipsum1", sent_by=self.user_one, sent_to=self.user_two).save()
+        last_message = Message(content="Lorem Ipsum2", sent_by=self.user_two, sent_to=self.user_one)
+        last_message.save()
+        self.assertEqual(Conversation.objects.count(), 1)
+        conversation = Conversation.objects.get()
+        self.assertEqual(conversation.last_message_id, last_message.id)
+        self.assertEqual(conversation.last_message_content, "Lorem Ipsum2")
+
+    def test_unread_counters(self):
+        """
+        Checks if only the receiver side of conversation gets unread messages
+        """
+        Message(content="Lorem Ipsum1", sent_by=self.user_one, sent_to=self.user_two).save()
+        Message(content="Lorem Ipsum2", sent_by=self.user_one, sent_to=self.user_two).save()
+        conversation = Conversation.objects.get()
+        self.assertEqual(conversation.get_unread(self.user_two), 2)
+        self.assertEqual(conversation.get_unread(self.user_one), 0)
+
+    def test_inbox_order_and_query_count(self):
+        """
+        Checks if inbox is sorted by recency and is fetched with a single query
+        """
+        Message(content="Lorem Ipsum1", sent_by=self.user_one, sent_to=self.user_two).save()
+        Message(content="Lorem Ipsum2", sent_by=self.user_three, sent_to=self.user_one).save()
+        factory = RequestFactory()
+        request = factory.get("/messages/inbox/")
+        request.user = self.user_one
+        view = ConversationView
+        with self.assertNumQueries(1):
+            response = view.get(self=view, request=request)
         json_response = json.loads(response.content.decode())
-        self.assertEqual(len(json_response), 0, "Expected 0 messages, got {}".format(len(json_response)))
\ No newline at end of file
+        self.assertEqual([conversation[0] for conversation in json_response], [self.user_three.id, self.user_two.id])
+
+    def test_rebuild_command(self):
+        """
+        Checks if management command restores conversations of existing messages
+        """
+        Message(content="Lorem Ipsum1", sent_by=self.user_one, sent_to=self.user_two).save()
+        Message(content="Lorem Ipsum2", sent_by=self.user_two, sent_to=self.user_one).save()
+        last_message = Message(content="Lorem Ipsum3", sent_by=self.user_three, sent_to=self.user_two)
+        last_message.save()
+        Conversation.objects.all().delete()
+        call_command('rebuild_conversations', stdout=StringIO())
+        self.assertEqual(Conversation.objects.count(), 2)
+        conversation = Conversation.objects.get(low_user=self.user_two, high_user=self.user_three)
+        self.assertEqual(conversation.last_message_id, last_message.id)
+        self.assertEqual(conversation.get_unread(self.user_two), 0)
+
+
+class MessagePairTests(TestCase):
+    """
+    Class responsible for testing canonical user pair of messages
+    """
+    def setUp(self):
+        """
+        Preparing two user accounts and a short conversation
+        """
+        self.user_one = CustomUser(username="TestUser", email="test_email@test.com")
+        self.user_one.save()
+        self.user_two = CustomUser(username="TestUser2", email="test_email2@test.com")
+        self.user_two.save()
+        Message(content="Lorem Ipsum1", sent_by=self.user_one, sent_to=self.user_two).save()
+        Message(content="Lorem Ipsum2", sent_by=self.user_two, sent_to=self.user_one).save()
+
+    def test_pair_is_canonical(self):
+        """
+        Checks if both directions of conversation get the same pair
+        """
+        pairs = set(Message.search.values_list('low_user_id', 'high_user_id'))
+        self.assertEqual(pairs, {(self.user_one.id, self.user_two.id)})
+
+    def test_conversation_query_plan(self):
+        """
+        Checks if conversation fetch is a range scan over pair index, without sorting
+        """
+        low_user_id, high_user_id = Message.search.get_pair(self.user_two, self.user_one)
+        query_sets = [
+            Message.search.filter(low_user_id=low_user_id, high_user_id=high_user_id, id__gt=0).order_by('id'),
+            Message.search.filter(low_user_id=low_user_id, high_user_id=high_user_id).order_by('-id')[:1],
+        ]
+        for query_set in query_sets:
+            plan = query_set.explain()
+            self.assertIn('chat_message_pair_idx', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_last_message(self):
+        """
+        Checks if last message is the same no matter in which order users are provided
+        """
+        last_message = Message.search._get_last_message((self.user_one.id, self.user_two.id))
+        self.assertEqual(last_message.content, "Lorem Ipsum2")
+        self.assertEqual(Message.search._get_last_message((self.user_two.id, self.user_one.id)), last_message)
+
+    def test_backfill_command(self):
+        """
+        Checks if management command fills pair of messages saved without one
+        """
+        Message.search.update(low_user=None, high_user=None)
+        call_command('backfill_message_pairs', batch_size=1, stdout=StringIO())
+        pairs = set(Message.search.values_list('low_user_id', 'high_user_id'))
+        self.assertEqual(pairs, {(self.user_one.id, self.user_two.id)})
+
+
+class PushDeliveryTests(TestCase):
+    """
+    Class responsible for testing long polling of new messages
+    """
+    def setUp(self):
+        """
+        Preparing two user accounts
+        """
+        self.user_one = CustomUser(username="TestUser", email="test_email@test.com")
+        self.user_one.save()
+        self.user_two = CustomUser(username="TestUser2", email="test_email2@test.com")
+        self.user_two.save()
+
+    def _poll(self, user, **params):
+        factory = RequestFactory()
+        request = factory.get("/messages/poll/", params)
+        request.user = user
+        response = async_to_sync(poll)(request)
+        return response.status_code, json.loads(response.content.decode())
+
+    def test_broker_wakes_up_subscription(self):
+        """
+        Checks if message published from another thread wakes up waiting subscription
+        """
+        broker = InProcessBroker()
+
+        async def wait_for_message():
+            subscription = broker.subscribe(self.user_one.id)
+            threading.Timer(0.05, broker.publish, args=(self.user_one.id, 1)).start()
+            try:
+                return await subscription.wait(5)
+            finally:
+                subscription.close()
+
+        started = time.monotonic()
+        self.assertTrue(asyncio.run(wait_for_message()))
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_broker_timeout(self):
+        """
+        Checks if subscription stops waiting after timeout when nothing is published
+        """
+        broker = InProcessBroker()
+
+        async def wait_for_message():
+            subscription = broker.subscribe(self.user_one.id)
+            broker.publish(self.user_two.id, 1)
+            try:
+                return await subscription.wait(0.05)
+            finally:
+                subscription.close()
+
+        self.assertFalse(asyncio.run(wait_for_message()))
+
+    def test_poll_returns_waiting_messages(self):
+        """
+        Checks if poll returns immediately messages newer than 'after'
+        """
+        first_message = Message(content="Lorem Ipsum1", sent_by=self.user_two, sent_to=self.user_one)
+        first_message.save()
+        second_message = Message(content="Lorem Ipsum2", sent_by=self.user_two, sent_to=self.user_one)
+        second_message.save()
+        status, json_response = self._poll(self.user_one, after=first_message.id)
+        self.assertEqual(status, 200)
+        self.assertEqual([message['id'] for message in json_response['messages']], [second_message.id])
+        self.assertEqual(json_response['next'], second_message.id)
+
+    def test_poll_without_messages(self):
+        """
+        Checks if poll returns empty list when nothing arrives before timeout
+        """
+        Message(content="Lorem Ipsum", sent_by=self.user_one, sent_to=self.user_two).save()
+        status, json_response = self._poll(self.user_one, timeout=0)
+        self.assertEqual(json_response, {'messages': [], 'next': 0})
+
+    def test_message_is_published(self):
+        """
+        Checks if saved message is published to its receiver after commit
+        """
+        with mock.patch('chat.models.get_broker') as get_broker:
+            with self.captureOnCommitCallbacks(execute=True):
+                message = Message(content="Lorem Ipsum", sent_by=self.user_one, sent_to=self.user_two)
+                message.save()
+        get_broker.return_value.publish.assert_called_once_with(self.user_two.id, message.id)
+
+
+class BroadcastTests(TestCase):
+    """
+    Class responsible for testing sending many messages at once
+    """
+    def setUp(self):
+        """
+        Preparing organiser account and a few members
+        """
+        self.organiser = CustomUser(username="Organiser", email="organiser@test.com")
+        self.organiser.save()
+        self.members = []
+        for number in range(5):
+            member = CustomUser(username="Member{}".format(number), email="member{}@test.com".format(number))
+            member.save()
+            self.members.append(member)
+        self.client.force_login(self.organiser)
+        cache.clear()
+
+    def _broadcast(self, data):
+        response = self.client.post("/messages/broadcast/", json.dumps(data), content_type="application/json")
+        return response.status_code, json.loads(response.content.decode())
+
+    def test_broadcast(self):
+        """
+        Checks if every member gets the message and conversations are refreshed
+        """
+        status, json_response = self._broadcast({'content': "Meeting at 8",
+                                                 'recipients': [member.id for member in self.members]})
+        self.assertEqual(status, 200)
+        self.assertEqual([result['status'] for result in json_response['results']], ['sent'] * 5)
+        for member, result in zip(self.members, json_response['results']):
+            message = Message.search.get(id=result['id'])
+            self.assertEqual((message.sent_to, message.content), (member, "Meeting at 8"))
+            conversation = Conversation.objects.get(low_user=self.organiser, high_user=member)
+            self.assertEqual(conversation.last_message_id, message.id)
+            self.assertEqual(conversation.get_unread(member), 1)
+
+    def test_broadcast_updates_existing_conversation(self):
+        """
+        Checks if unread counter of already existing conversation is increased
+        """
+        Message(content="Hello", sent_by=self.organiser, sent_to=self.members[0]).save()
+        self._broadcast({'messages': [{'recipient': self.members[0].id, 'content': "Meeting at 8"},
+                                      {'recipient': self.members[0].id, 'content': "Bring a dog"}]})
+        conversation = Conversation.objects.get(low_user=self.organiser, high_user=self.members[0])
+        self.assertEqual(conversation.get_unread(self.members[0]), 3)
+        self.assertEqual(conversation.last_message_content, "Bring a dog")
+
+    def test_broadcast_to_conversation_created_meanwhile(self):
+        """
+        Checks if conversation created by someone else after it was looked up is still moved forward
+        """
+        Message(content="Hello", sent_by=self.organiser, sent_to=self.members[0]).save()
+        with mock.patch.object(Conversation.objects, 'get_by_pairs', return_value={}):
+            status, json_response = self._broadcast({'content': "Meeting at 8",
+                                                     'recipients': [self.members[0].id, self.members[1].id]})
+        self.assertEqual(status, 200)
+        conversation = Conversation.objects.get(low_user=self.organiser, high_user=self.members[0])
+        self.assertEqual(conversation.get_unread(self.members[0]), 2)
+        self.assertEqual(conversation.last_message_id, json_response['results'][0]['id'])
+        self.assertEqual(conversation.last_message_content, "Meeting at 8")
+        conversation = Conversation.objects.get(low_user=self.organiser, high_user=self.members[1])
+        self.assertEqual(conversation.get_unread(self.members[1]), 1)
+
+    def test_broadcast_while_sending_other_message(self):
+        """
+        Checks if message sent by the same user during the broadcast is not taken for a broadcasted one
+        """
+        bulk_create = Message.search.bulk_create
+
+        def send_meanwhile(objects, *args, **kwargs):
+            Message(content="Hello", sent_by=self.organiser, sent_to=self.members[2]).save()
+            return bulk_create(objects, *args, **kwargs)
+
+        with mock.patch.object(Message.search, 'bulk_create', side_effect=send_meanwhile):
+            status, json_response = self._broadcast({'content': "Meeting at 8",
+                                                     'recipients': [self.members[0].id, self.members[1].id]})
+        self.assertEqual(status, 200)
+        for member, result in zip(self.members, json_response['results']):
+            message = Message.search.get(id=result['id'])
+            self.assertEqual((message.sent_to, message.content), (member, "Meeting at 8"))
+        conversation = Conversation.objects.get(low_user=self.organiser, high_user=self.members[2])
+        self.assertEqual(conversation.get_unread(self.members[2]), 1)
+
+    def test_per_recipient_errors(self):
+        """
+        Checks if invalid recipients are reported without stopping the rest
+        """
+        status, json_response = self._broadcast({'content': "Meeting at 8",
+                                                 'recipients': [self.members[0].id, 999, self.organiser.id]})
+        self.assertEqual(status, 200)
+        self.assertEqual([result['status'] for result in json_response['results']], ['sent', 'error', 'error'])
+        self.assertEqual(Message.search.count(), 1)
+
+    def test_query_count_does_not_depend_on_recipients(self):
+        """
+        Checks if sending to more users does not need more queries
+        """
+        with CaptureQueriesContext(connection) as two_recipients:
+            self._broadcast({'content': "Meeting at 8", 'recipients': [member.id for member in self.members[:2]]})
+        with CaptureQueriesContext(connection) as three_recipients:
+            self._broadcast({'content': "Meeting at 8", 'recipients': [member.id for member in self.members[2:]]})
+        self.assertEqual(len(two_recipients), len(three_recipients))
+
+    def test_invalid_body(self):
+        """
+        Checks if malformed request returns 400 code
+        """
+        self.assertEqual(self._broadcast({'content': "Meeting at 8"})[0], 400)
+        self.assertEqual(self._broadcast({'content': None, 'recipients': [self.members[0].id]})[0], 400)
+
+
+class ReadMarkerTests(TestCase):
+    """
+    Class responsible for testing read markers and unread counters
+    """
+    def setUp(self):
+        """
+        Preparing three user accounts, the first one receives a few messages
+        """
+        self.user_one = CustomUser(username="TestUser", email="test_email@test.com")
+        self.user_one.save()
+        self.user_two = CustomUser(username="TestUser2", email="test_email2@test.com")
+        self.user_two.save()
+        self.user_three = CustomUser(username="TestUser3", email="test_email3@test.com")
+        self.user_three.save()
+        self.messages = []
+        for number in range(4):
+            message = Message(content="Lorem Ipsum {}".format(number), sent_by=self.user_two, sent_to=self.user_one)
+            message.save()
+            self.messages.append(message)
+        Message(content="Lorem Ipsum", sent_by=self.user_one, sent_to=self.user_two).save()
+        Message(content="Lorem Ipsum", sent_by=self.user_three, sent_to=self.user_one).save()
+
+    def _mark_read(self, user, receiver, **data):
+        factory = RequestFactory()
+        request = factory.post("/messages/conversation/{}/read".format(receiver.id), data)
+        request.user = user
+        response = ReadMarkerView.as_view()(request, receiver=receiver.id)
+        return response.status_code, json.loads(response.content.decode())
+
+    def test_unread_counts(self):
+        """
+        Checks if unread messages are counted for each conversation
+        """
+        self.assertEqual(Conversation.objects.get_unread_counts(self.user_one),
+                         {self.user_two.id: 4, self.user_three.id: 1})
+        self.assertEqual(Conversation.objects.get_unread_counts(self.user_two), {self.user_one.id: 1})
+
+    def test_partial_read(self):
+        """
+        Checks if moving marker to the middle of conversation leaves newer messages unread
+        """
+        status, json_response = self._mark_read(self.user_one, self.user_two, up_to=self.messages[1].id)
+        self.assertEqual(status, 200)
+        self.assertEqual(json_response, {'read_up_to': self.messages[1].id, 'unread': 2})
+
+    def test_partial_read_of_archived_messages(self):
+        """
+        Checks if archived messages are also subtracted from unread counter
+        """
+        ArchivedMessage.objects.archive_batch(datetime.max.replace(tzinfo=self.messages[0].date.tzinfo), 2)
+        status, json_response = self._mark_read(self.user_one, self.user_two, up_to=self.messages[2].id)
+        self.assertEqual(status, 200)
+        self.assertEqual(json_response, {'read_up_to': self.messages[2].id, 'unread': 1})
+
+    def test_whole_conversation_read(self):
+        """
+        Checks if conversation is read entirely without up_to parameter and marker never moves back
+        """
+        status, json_response = self._mark_read(self.user_one, self.user_two)
+        self.assertEqual(json_response['unread'], 0)
+        status, json_response = self._mark_read(self.user_one, self.user_two, up_to=self.messages[0].id)
+        self.assertEqual(json_response['unread'], 0)
+        self.assertEqual(Conversation.objects.get_unread_counts(self.user_one), {self.user_three.id: 1})
+
+    def test_missing_conversation(self):
+        """
+        Checks if marking conversation which does not exist returns 404 code
+        """
+        status, json_response = self._mark_read(self.user_two, self.user_three)
+        self.assertEqual(status, 404)
+
+    def test_read_receipt(self):
+        """
+        Checks if conversation fetch tells how far the other side has read
+        """
+        self._mark_read(self.user_one, self.user_two, up_to=self.messages[2].id)
+        factory = RequestFactory()
+        request = factory.get("/conversation")
+        request.user = self.user_two
+        view = ChatAPIView
+        response = view.get(self=view, request=request, receiver=self.user_one.id)
+        self.assertEqual(json.loads(response.content.decode())['partner_read_up_to'], self.messages[2].id)
+
+    def test_unread_total(self):
+        """
+        Checks if unread endpoint returns total with a single query
+        """
+        factory = RequestFactory()
+        request = factory.get("/messages/unread/")
+        request.user = self.user_one
+        with self.assertNumQueries(1):
+            response = UnreadView.as_view()(request)
+        self.assertEqual(json.loads(response.content.decode())['total'], 5)
+
+
+class ExportTests(TestCase):
+    """
+    Class responsible for testing export of message history
+    """
+    def setUp(self):
+        """
+        Preparing three user accounts and a few messages
+        """
+        self.user_one = CustomUser(username="TestUser", email="test_email@test.com")
+        self.user_one.save()
+        self.user_two = CustomUser(username="TestUser2", email="test_email2@test.com")
+        self.user_two.save()
+        self.user_three = CustomUser(username="TestUser3", email="test_email3@test.com")
+        self.user_three.save()
+        Message(content="Lorem Ipsum1", sent_by=self.user_one, sent_to=self.user_two).save()
+        Message(content="Lorem, \"Ipsum\"2", sent_by=self.user_three, sent_to=self.user_one).save()
+        Message(content="Lorem Ipsum3", sent_by=self.user_two, sent_to=self.user_three).save()
+
+    def test_jsonl_export(self):
+        """
+        Checks if export streams only messages of the user, one json per line
+        """
+        self.client.force_login(self.user_one)
+        response = self.client.get("/messages/export/")
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([row['content'] for row in rows], ["Lorem Ipsum1", "Lorem, \"Ipsum\"2"])
+        self.assertEqual((rows[1]['sent_by'], rows[1]['sent_to']), ("TestUser3", "TestUser"))
+
+    def test_csv_export(self):
+        """
+        Checks if csv export has a header and escapes message content
+        """
+        self.client.force_login(self.user_one)
+        response = self.client.get("/messages/export/", {'format': 'csv'})
+        rows = list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], ['id', 'sent_by', 'sent_to', 'content', 'date'])
+        self.assertEqual(rows[2][3], "Lorem, \"Ipsum\"2")
+        self.assertEqual(self.client.get("/messages/export/", {'format': 'xml'}).status_code, 400)
+
+    def test_export_command(self):
+        """
+        Checks if management command writes the same export
+        """
+        output = StringIO()
+        call_command('export_messages', 'TestUser3', chunk_size=1, stdout=output)
+        rows = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([row['content'] for row in rows], ["Lorem, \"Ipsum\"2", "Lorem Ipsum3"])
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Class responsible for checking if chat views keep their query budgets at growing data sizes
+    """
+    def test_budgets(self):
+        """
+        Checks if every action fits its budget and query counts do not grow with data
+        """
+        report = run_benchmark([(10, 100), (30, 600)], repeat=1)
+        self.assertTrue(report['passed'], report)
+        small, big = report['sizes']
+        for action in small['results']:
+            self.assertEqual(small['results'][action]['queries'], big['results'][action]['queries'], action)
+
+    def test_rate_limits_are_not_measured(self):
+        """
+        Checks if repeating actions more times than rate limits allow still measures successful requests
+        """
+        report = run_benchmark([(5, 50)], repeat=settings.RATE_LIMITS['send_message'][0] + 10)
+        self.assertTrue(report['passed'], report)
+        for result in report['sizes'][0]['results'].values():
+            self.assertEqual(result['failed_responses'], 0)
+
+    def test_benchmark_command(self):
+        """
+        Checks if management command reports results and leaves no data behind
+        """
+        output = StringIO()
+        call_command('benchmark_chat', sizes='5:50', repeat=1, stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertEqual(report['sizes'][0]['messages'], 50)
+        self.assertEqual(Message.search.count(), 0)
+        self.assertEqual(CustomUser.objects.count(), 0)
+
+    def test_budget_exceeded(self):
+        """
+        Checks if management command fails when a view exceeds its budget
+        """
+        with mock.patch.dict('chat.benchmarks.QUERY_BUDGETS', {'inbox': 0}):
+            with self.assertRaises(CommandError):
+                call_command('benchmark_chat', sizes='5:50', repeat=1, stdout=StringIO())
+
+
+class ArchiveTests(TestCase):
+    """
+    Class responsible for testing moving old messages into the archive
+    """
+    def setUp(self):
+        """
+        Preparing two user accounts with six old and four recent messages
+        """
+        self.user_one = CustomUser(username="TestUser", email="test_email@test.com")
+        self.user_one.save()
+        self.user_two = CustomUser(username="TestUser2", email="test_email2@test.com")
+        self.user_two.save()
+        self.messages = []
+        for number in range(10):
+            creation_date = make_aware(datetime.now() - timedelta(days=400 if number < 6 else 1))
+            with mock.patch('django.utils.timezone.now') as mock_now:
+                mock_now.return_value = creation_date
+                message = Message(content="Lorem Ipsum {}".format(number), sent_by=self.user_one,
+                                  sent_to=self.user_two)
+                message.save()
+            self.messages.append(message)
+        call_command('archive_messages', days=365, batch_size=4, stdout=StringIO())
+
+    def _page(self, **kwargs):
+        page = Message.search.get_conversation_page(self.user_one, self.user_two, **kwargs)
+        return [message['id'] for message in page['messages']], page
+
+    def test_messages_are_moved(self):
+        """
+        Checks if only old messages are moved and running command again changes nothing
+        """
+        self.assertEqual(Message.search.count(), 4)
+        self.assertEqual(list(ArchivedMessage.objects.order_by('id').values_list('id', flat=True)),
+                         [message.id for message in self.messages[:6]])
+        call_command('archive_messages', days=365, stdout=StringIO())
+        self.assertEqual(ArchivedMessage.objects.count(), 6)
+
+    def test_reading_past_hot_window(self):
+        """
+        Checks if page going backwards continues into archived messages
+        """
+        ids, page = self._page(limit=6)
+        self.assertEqual(ids, [message.id for message in self.messages[4:]])
+        ids, page = self._page(before=page['previous'], limit=6)
+        self.assertEqual(ids, [message.id for message in self.messages[:4]])
+        self.assertIsNone(page['previous'])
+
+    def test_reading_forward_from_archive(self):
+        """
+        Checks if page going forward starts in the archive and continues into hot messages
+        """
+        ids, page = self._page(after=self.messages[3].id, limit=4)
+        self.assertEqual(ids, [message.id for message in self.messages[4:8]])
+
+    def test_archiving_by_other_process(self):
+        """
+        Checks if messages archived without this process knowing about it are still read
+        """
+        self._page(limit=6)
+        recent = Message.search.order_by('id')
+        ArchivedMessage.objects.bulk_create([
+            ArchivedMessage(id=message.id, sent_by_id=message.sent_by_id, sent_to_id=message.sent_to_id,
+                            low_user_id=message.low_user_id, high_user_id=message.high_user_id,
+                            content=message.content, date=message.date)
+            for message in recent[:2]])
+        Message.search.filter(id__in=[message.id for message in self.messages[6:8]]).delete()
+        ids, page = self._page(limit=6)
+        self.assertEqual(ids, [message.id for message in self.messages[4:]])
+        ids, page = self._page(after=self.messages[5].id, limit=6)
+        self.assertEqual(ids, [message.id for message in self.messages[6:]])
+
+    def test_export_contains_archive(self):
+        """
+        Checks if export still contains archived messages
+        """
+        output = StringIO()
+        call_command('export_messages', 'TestUser', stdout=output)
+        self.assertEqual(len(output.getvalue().splitlines()), 10)
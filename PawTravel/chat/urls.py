@@ -2,10 +2,16 @@ from django.contrib.auth.views import LoginView
 from django.urls import path, include
 
 from . import views
-from .views import ConversationView, ChatAPIView
+from .views import ConversationView, ChatAPIView, BroadcastView, ReadMarkerView, UnreadView, ExportView, \
+    poll
 
 urlpatterns = [
     path('inbox/', ConversationView.as_view(), name='inbox'),
+    path('poll/', poll, name='poll'),
+    path('broadcast/', BroadcastView.as_view(), name='broadcast'),
+    path('unread/', UnreadView.as_view(), name='unread'),
+    path('export/', ExportView.as_view(), name='export'),
+    path('conversation/<int:receiver>/read', ReadMarkerView.as_view(), name='read'),
     path('conversation/<int:receiver>', ChatAPIView.as_view(), name='send'),
     path('conversation/<int:receiver>/<int:timestamp>', ChatAPIView.as_view(), name='send'),
 ]
@@ -1,15 +1,21 @@
 import datetime
+import json
 import time
 
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.conf import settings
 
+from asgiref.sync import sync_to_async
+
 # Create your views here.
 from django.views import View
-from .models import Message
+from .broker import get_broker
+from .export import export_messages, EXPORT_FORMATS
+from .models import Message, Conversation
 from users.models import CustomUser
+from PawTravel.ratelimit import RateLimiter, RateLimitExceeded, too_many_requests
 
 
 class ConversationView(View):
@@ -25,13 +31,10 @@ class ConversationView(View):
         """
         user = request.user
         if user.is_authenticated:
-            messages=Message.search.get_conversation_users(user)
-            for id, conversation in enumerate(messages):
-                message=messages[id][1]
-                message_tuple=list(messages[id])
-                message_tuple[1]=[message.content, str(message.date)]
-                messages[id]=tuple(message_tuple)
-            return JsonResponse(list(messages), safe=False)
+            conversations=Message.search.get_conversation_users(user)
+            messages=[[partner_id, [conversation.last_message_content, str(conversation.last_message_date)]]
+                      for partner_id, conversation in conversations]
+            return JsonResponse(messages, safe=False)
         else:
             return JsonResponse(status=403, data={'message': "You must be logged in to access this endpoint"})
 
@@ -41,32 +44,240 @@ class ChatAPIView(View):
     View responsible for sending and fetching messages within given conversation
     IMPORTANT: Timestamp means in class methods last message id.
     Usage of ids reduce problem of datetime conversion, timezone issues etc.
+
+    Conversation is returned in pages. Optional GET parameters:
+    before=<id> - page of messages older than given message id
+    after=<id> - page of messages newer than given message id
+    limit=<amount> - size of the page, it is never bigger than max_page_size
     """
+    page_size = 50
+    max_page_size = 200
+    rate_limiter = RateLimiter('send_message')
+
     def post(self, request, receiver, content, timestamp=None):
         """
         Send new message
-        Returns json with new messages in conversation if provided timestamp
+        Returns json with messages newer than provided timestamp,
+        or only the sent message if timestamp is not provided
         """
         user = request.user
         message_receipment = CustomUser.objects.get(id=receiver)
         if user.is_authenticated:
             if user==message_receipment:
                 return JsonResponse(status=400, data={'message':"You can not send message to yourself"})
+            try:
+                self.rate_limiter.hit(user.id)
+            except RateLimitExceeded as error:
+                return too_many_requests(error)
 
-            Message(content=content, sent_by=user, sent_to=message_receipment).save()
-            messages=Message.search.get_conversation(user, message_receipment, timestamp) #While we send message we can use the opportunity to refresh chat
-            return JsonResponse(messages, safe=False)
+            message = Message(content=content, sent_by=user, sent_to=message_receipment)
+            message.save()
+            after = timestamp if timestamp is not None else message.id - 1
+            #While we send message we can use the opportunity to refresh chat
+            page = Message.search.get_conversation_page(user, message_receipment, after=after, limit=self.max_page_size)
+            return JsonResponse(page)
         else:
             return JsonResponse(status=403, data={'message': "You must be logged in to access this endpoint"})
 
     def get(self, request, receiver, timestamp=None):
         """
-        Fetch entire conversation or only new messages if timestamp is provided
+        Fetch newest page of conversation or only new messages if timestamp is provided
         """
         user = request.user
         if user.is_authenticated:
+            try:
+                before, after, limit = self.get_page_arguments(request)
+            except ValueError:
+                return JsonResponse(status=400, data={'message': "Cursors and limit must be positive numbers"})
+            if timestamp is not None:
+                after = timestamp
             message_receipment = CustomUser.objects.get(id=receiver)
-            messages=Message.search.get_conversation(user, message_receipment, timestamp)
-            return JsonResponse(list(messages), safe=False)
+            page = Message.search.get_conversation_page(user, message_receipment, before=before, after=after,
+                                                        limit=limit)
+            conversation = Conversation.objects.filter(
+                low_user_id=min(user.id, message_receipment.id), high_user_id=max(user.id, message_receipment.id)
+            ).first()
+            # Read receipt, id of the last message read by the other side
+            page['partner_read_up_to'] = conversation.get_read_up_to(message_receipment) if conversation else 0
+            return JsonResponse(page)
         else:
             return JsonResponse(status=403, data={'message': "You must be logged in to access this endpoint"})
+
+    @classmethod
+    def get_page_arguments(cls, request):
+        """
+        Read pagination parameters of the request
+        :param request: Request with optional before, after and limit GET parameters
+        :return: Tuple of (before, after, limit)
+        :raises ValueError: If any of parameters is not a positive number
+        """
+        before = request.GET.get('before')
+        after = request.GET.get('after')
+        limit = int(request.GET.get('limit', cls.page_size))
+        before = int(before) if before is not None else None
+        after = int(after) if after is not None else None
+        if limit < 1 or (before is not None and before < 0) or (after is not None and after < 0):
+            raise ValueError("Pagination arguments must be positive")
+        return before, after, min(limit, cls.max_page_size)
+
+
+class ReadMarkerView(View):
+    """
+    View responsible for marking conversation as read by currently logged user
+    Optional POST parameter up_to=<id> - id of the last read message, by default the whole conversation is read
+    Return format: {"read_up_to": id, "unread": amount of still unread messages}
+    """
+    def post(self, request, receiver):
+        user = request.user
+        if not user.is_authenticated:
+            return JsonResponse(status=403, data={'message': "You must be logged in to access this endpoint"})
+        try:
+            up_to = int(request.POST['up_to']) if 'up_to' in request.POST else None
+        except ValueError:
+            return JsonResponse(status=400, data={'message': "up_to must be a message id"})
+        conversation = Conversation.objects.mark_read(user, receiver, up_to)
+        if conversation is None:
+            return JsonResponse(status=404, data={'message': "Conversation does not exist"})
+        return JsonResponse({'read_up_to': conversation.get_read_up_to(user), 'unread': conversation.get_unread(user)})
+
+
+class UnreadView(View):
+    """
+    View responsible for displaying amount of unread messages of currently logged user
+    Return format: {"total": amount, "conversations": {user_id: amount, ...}}
+    """
+    def get(self, request):
+        user = request.user
+        if not user.is_authenticated:
+            return JsonResponse(status=403, data={'message': "You must be logged in to access this endpoint"})
+        unread = Conversation.objects.get_unread_counts(user)
+        return JsonResponse({'total': sum(unread.values()), 'conversations': unread})
+
+
+class ExportView(View):
+    """
+    View responsible for downloading full message history of currently logged user
+    Optional GET parameter format=jsonl|csv, jsonl by default
+    Messages are streamed, so memory usage does not depend on the size of history
+    """
+    content_types = {'jsonl': 'application/x-ndjson', 'csv': 'text/csv'}
+
+    def get(self, request):
+        user = request.user
+        if not user.is_authenticated:
+            return JsonResponse(status=403, data={'message': "You must be logged in to access this endpoint"})
+        export_format = request.GET.get('format', 'jsonl')
+        if export_format not in EXPORT_FORMATS:
+            return JsonResponse(status=400, data={'message': "Format must be one of: {}"
+                                                  .format(", ".join(EXPORT_FORMATS))})
+        response = StreamingHttpResponse(export_messages(user, export_format),
+                                         content_type=self.content_types[export_format])
+        response['Content-Disposition'] = 'attachment; filename="messages.{}"'.format(export_format)
+        return response
+
+
+class BroadcastView(View):
+    """
+    View responsible for sending many messages with a single request
+    Request body is a json in one of formats:
+    {"content": "...", "recipients": [user_id, ...]} - the same message to many users
+    {"messages": [{"recipient": user_id, "content": "..."}, ...]} - different messages
+    Return format: {"results": [{"recipient": user_id, "status": "sent" or "error", ...}, ...]}
+    """
+    max_messages = 100
+    rate_limiter = RateLimiter('broadcast_messages')
+
+    def post(self, request):
+        user = request.user
+        if not user.is_authenticated:
+            return JsonResponse(status=403, data={'message': "You must be logged in to access this endpoint"})
+        try:
+            messages = self.parse_messages(request.body)
+        except ValueError as error:
+            return JsonResponse(status=400, data={'message': str(error)})
+        if len(messages) > self.max_messages:
+            return JsonResponse(status=400, data={'message': "You can send at most {} messages at once"
+                                                  .format(self.max_messages)})
+        try:
+            self.rate_limiter.hit(user.id)
+        except RateLimitExceeded as error:
+            return too_many_requests(error)
+
+        existing_users = set(CustomUser.objects.filter(id__in={recipient for recipient, _ in messages})
+                             .values_list('id', flat=True))
+        results = []
+        to_send = []
+        for recipient, content in messages:
+            error = None
+            if recipient not in existing_users:
+                error = "User does not exist"
+            elif recipient == user.id:
+                error = "You can not send message to yourself"
+            elif not content or len(content) > Message._meta.get_field('content').max_length:
+                error = "Message content must have between 1 and {} characters".format(
+                    Message._meta.get_field('content').max_length)
+            if error:
+                results.append({'recipient': recipient, 'status': 'error', 'message': error})
+            else:
+                result = {'recipient': recipient, 'status': 'sent'}
+                results.append(result)
+                to_send.append((result, (recipient, content)))
+
+        sent = Message.search.send_many(user, [message for _, message in to_send])
+        for (result, _), message in zip(to_send, sent):
+            result['id'] = message.id
+        return JsonResponse({'results': results})
+
+    @staticmethod
+    def parse_messages(body):
+        """
+        Read messages from the request body
+        :param body: Json request body
+        :return: List of (recipient id, content) tuples
+        :raises ValueError: If body has invalid format
+        """
+        try:
+            data = json.loads(body)
+            if 'messages' in data:
+                messages = [(int(message['recipient']), message['content']) for message in data['messages']]
+            else:
+                messages = [(int(recipient), data['content']) for recipient in data['recipients']]
+        except (TypeError, KeyError, AttributeError, json.JSONDecodeError):
+            raise ValueError("Invalid request format")
+        if not all(isinstance(content, str) for _, content in messages):
+            raise ValueError("Message content must be a text")
+        return messages
+
+
+async def poll(request):
+    """
+    Long polling of new messages addressed to currently logged user
+    Request waits until a new message arrives or CHAT_POLL_TIMEOUT passes,
+    so idle clients do not have to query the database again and again.
+    Optional GET parameters:
+    after=<id> - id of the newest message client already has
+    timeout=<seconds> - how long to wait, never longer than CHAT_POLL_TIMEOUT
+    Return format: {'messages': [...], 'next': id to be used as 'after' in the next request}
+    """
+    user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+    if user is None:
+        return JsonResponse(status=403, data={'message': "You must be logged in to access this endpoint"})
+    try:
+        after = int(request.GET.get('after', 0))
+        timeout = min(float(request.GET.get('timeout', settings.CHAT_POLL_TIMEOUT)), settings.CHAT_POLL_TIMEOUT)
+    except ValueError:
+        return JsonResponse(status=400, data={'message': "After and timeout must be numbers"})
+
+    def fetch_messages():
+        return list(Message.search.filter(sent_to=user, id__gt=after).order_by('id')
+                    .values(*Message.search.SERIALIZED_FIELDS)[:ChatAPIView.max_page_size])
+
+    # Subscribe before looking into the database, so no message is missed in between
+    subscription = get_broker().subscribe(user.id)
+    try:
+        messages = await sync_to_async(fetch_messages)()
+        if not messages and timeout > 0 and await subscription.wait(timeout):
+            messages = await sync_to_async(fetch_messages)()
+    finally:
+        subscription.close()
+    return JsonResponse({'messages': messages, 'next': messages[-1]['id'] if messages else after})
@@ -1,8 +1,8 @@
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import models, transaction
 
-from PawTravel import settings
+from PawTravel import settings, scoring
 
 
 class Comment(models.Model):
@@ -21,4 +21,19 @@ class Comment(models.Model):
         ordering = ['id']
 
     def __str__(self):
-        return self.text
\ No newline at end of file
+        return self.text
+
+    def save(self, *args, **kwargs):
+        """
+        Saves comment, new comments are also counted in comment counter of commented object
+        """
+        created = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if created:
+                scoring.record_comment(self.content_type.model_class(), self.object_id, 1)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            scoring.record_comment(self.content_type.model_class(), self.object_id, -1)
+            return super().delete(*args, **kwargs)
\ No newline at end of file
@@ -1,7 +1,9 @@
 import datetime
 import tempfile
+from unittest import mock
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from offers.models import Offer, OfferCategory
 from users.models import CustomUser
@@ -9,6 +11,8 @@ from comments.models import Comment
 from parameterized import parameterized, parameterized_class
 
 from travel_guides.models import Guide, GuideCategory, Country
+from PawTravel.ratelimit import RateLimiter, RateLimitExceeded
+from PawTravel.checks import check_shared_cache
 
 
 class CommentsTestCase(TestCase):
@@ -124,3 +128,109 @@ class DetailOfferWithCommentsTestCase(CommentsTestCase):
     def test_correct_date(self):
         response = self.client.get(reverse(self.page, kwargs={'pk': 1, 'slug_url': self.slug_url}))
         self.assertContains(response, 'May 17, 2020, 4:50 p.m.')
+
+
+class RateLimiterTestCase(TestCase):
+    """Checks counting of actions in the sliding window"""
+
+    def setUp(self):
+        cache.clear()
+        self.limiter = RateLimiter('test_action', limit=2, window=60)
+
+    def tearDown(self):
+        cache.clear()
+
+    def hit_at(self, timestamp, user_id=1):
+        with mock.patch('PawTravel.ratelimit.time.time', return_value=timestamp):
+            self.limiter.hit(user_id)
+
+    def test_limit_is_enforced(self):
+        self.hit_at(600)
+        self.hit_at(601)
+        with self.assertRaises(RateLimitExceeded) as error:
+            self.hit_at(602)
+        self.assertEqual(error.exception.retry_after, 58 + 30)
+
+    def test_users_have_separate_buckets(self):
+        self.hit_at(600, user_id=1)
+        self.hit_at(600, user_id=1)
+        self.hit_at(600, user_id=2)
+        self.hit_at(600, user_id=2)
+        with self.assertRaises(RateLimitExceeded):
+            self.hit_at(600, user_id=2)
+
+    def test_previous_window_is_weighted(self):
+        self.hit_at(650)
+        self.hit_at(651)
+        # 75% of the previous window is still in the sliding window
+        with self.assertRaises(RateLimitExceeded) as error:
+            self.hit_at(675)
+        self.assertEqual(error.exception.retry_after, 15)
+        self.hit_at(690)
+
+    def test_rejected_action_is_not_counted(self):
+        self.hit_at(600)
+        self.hit_at(600)
+        for _ in range(5):
+            with self.assertRaises(RateLimitExceeded):
+                self.hit_at(601)
+        # Previous window weighs half, so exactly one more action fits
+        self.hit_at(690)
+        with self.assertRaises(RateLimitExceeded):
+            self.hit_at(690)
+
+
+class SharedCacheCheckTestCase(TestCase):
+    """Checks warning about caches which are not shared by worker processes"""
+
+    def test_process_local_cache(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([warning.id for warning in check_shared_cache(None)], ['PawTravel.W001'])
+
+    def test_shared_cache(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                                                   'LOCATION': 'cache'}}):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+@override_settings(RATE_LIMITS={'add_comment': (1, 30)})
+@parameterized_class(('page', 'slug_url'), [
+    ('offer',                       'testtitle'),
+    ('travel_guides:guide_detail',  'testguide'),
+ ])
+class RateLimitedCommentsTestCase(CommentsTestCase):
+    """A case to check that users can not add comments too quickly"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.url = reverse(self.page, kwargs={'pk': 1, 'slug_url': self.slug_url})
+        self.other_user = CustomUser.objects.create(username='user2', email='user2@gmail.com')
+        self.other_user.set_password('password')
+        self.other_user.save()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_second_comment_is_rejected(self):
+        self.client.login(username='user1', password='password')
+        response = self.client.post(self.url, {'text': 'First comment'})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.post(self.url, {'text': 'Second comment'})
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(1 <= int(response['Retry-After']) <= 2 * 30)
+        self.assertContains(response, 'You are adding your comments too quickly!', status_code=429)
+        self.assertEqual(Comment.objects.filter(author__username='user1').count(), 1)
+
+    def test_invalid_comment_is_not_counted(self):
+        self.client.login(username='user1', password='password')
+        self.assertNotEqual(self.client.post(self.url, {'text': ''}).status_code, 429)
+        self.assertEqual(self.client.post(self.url, {'text': 'Fixed comment'}).status_code, 302)
+        self.assertEqual(Comment.objects.filter(author__username='user1').count(), 1)
+
+    def test_users_are_limited_separately(self):
+        self.client.login(username='user1', password='password')
+        self.assertEqual(self.client.post(self.url, {'text': 'First comment'}).status_code, 302)
+        self.client.login(username='user2', password='password')
+        self.assertEqual(self.client.post(self.url, {'text': 'Other comment'}).status_code, 302)
+        self.assertEqual(Comment.objects.count(), 2)
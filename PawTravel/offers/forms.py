@@ -0,0 +1,46 @@
+from django import forms
+
+from .models import OfferCategory
+
+
+class OfferFilterForm(forms.Form):
+    """
+    Filters of offer listings, all of them are optional
+    """
+    category = forms.ModelChoiceField(queryset=OfferCategory.objects.all(), required=False)
+    min_price = forms.FloatField(min_value=0, required=False)
+    max_price = forms.FloatField(min_value=0, required=False)
+    min_discount = forms.IntegerField(min_value=0, max_value=100, required=False)
+
+    def filter(self, queryset):
+        """
+        Narrow down offers to the ones matching valid filters, invalid filters are ignored
+        :param queryset: Offers queryset
+        :return: Filtered queryset
+        """
+        self.is_valid()
+        data = self.cleaned_data
+        if data.get('category') is not None:
+            queryset = queryset.filter(category=data['category'])
+        if data.get('min_discount'):
+            queryset = queryset.filter(discount__gte=data['min_discount'])
+        if data.get('min_price') is not None:
+            queryset = queryset.filter(offer_price__gte=data['min_price'])
+        if data.get('max_price') is not None:
+            queryset = queryset.filter(offer_price__lte=data['max_price'])
+        return queryset
+
+
+class OfferImportForm(forms.Form):
+    """
+    Validates a single row of imported offer feed, category is given by its name
+    """
+    title = forms.CharField(max_length=100)
+    short_content = forms.CharField(max_length=300, required=False)
+    content = forms.CharField()
+    category = forms.CharField(max_length=100)
+    image = forms.CharField(max_length=100)
+    offer_ends = forms.DateTimeField()
+    original_price = forms.FloatField(min_value=0)
+    offer_price = forms.FloatField(min_value=0)
+    link = forms.URLField(max_length=200)
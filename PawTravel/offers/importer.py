@@ -0,0 +1,150 @@
+import csv
+import json
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.text import slugify
+
+from PawTravel import scoring
+from .forms import OfferImportForm
+from .models import Offer, OfferCategory
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+IMPORTED_FIELDS = ('title', 'short_content', 'content', 'category', 'image', 'offer_ends',
+                   'original_price', 'offer_price', 'link')
+
+
+def read_rows(lines, file_format):
+    """
+    Parse feed lazily, one row at a time
+    :param lines: File object or any other iterator of text lines
+    :param file_format: One of IMPORT_FORMATS
+    :return: Iterator of (line number, dict or error message) tuples
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as error:
+                yield line_number, 'Invalid json: {}'.format(error)
+                continue
+            yield line_number, row if isinstance(row, dict) else 'Row must be a json object'
+
+
+class OfferImporter:
+    """
+    Imports offers from a feed in batches. Offers are matched by their link,
+    so importing the same feed again updates offers instead of creating duplicates.
+    Only the current batch is kept in memory, so feeds of any size can be imported.
+    """
+
+    def __init__(self, author, batch_size=1000, create_categories=False, report_error=None):
+        """
+        :param author: User who becomes the author of created offers
+        :param batch_size: Amount of rows written in a single transaction
+        :param create_categories: Create categories which do not exist instead of rejecting their rows
+        :param report_error: Function called with line number and message of every rejected row
+        """
+        self.author = author
+        self.batch_size = batch_size
+        self.create_categories = create_categories
+        self.report_error = report_error
+        self.categories = dict(OfferCategory.objects.values_list('name', 'id'))
+        self.created = 0
+        self.updated = 0
+        self.rejected = 0
+
+    def reject(self, line_number, message):
+        self.rejected += 1
+        if self.report_error is not None:
+            self.report_error(line_number, message)
+
+    def run(self, rows):
+        """
+        :param rows: Iterator of (line number, dict or error message) tuples, see read_rows
+        """
+        batch = {}
+        for line_number, row in rows:
+            offer = self.clean_row(line_number, row)
+            if offer is None:
+                continue
+            # The last row with the same link wins
+            batch.pop(offer.link, None)
+            batch[offer.link] = offer
+            if len(batch) >= self.batch_size:
+                self.write_batch(list(batch.values()))
+                batch = {}
+        self.write_batch(list(batch.values()))
+
+    def clean_row(self, line_number, row):
+        """
+        :return: Unsaved offer built from the row or None if the row is invalid
+        """
+        if isinstance(row, str):
+            self.reject(line_number, row)
+            return None
+        form = OfferImportForm({field: row.get(field) for field in IMPORTED_FIELDS})
+        if not form.is_valid():
+            self.reject(line_number, '; '.join(
+                '{}: {}'.format(field, ' '.join(messages)) for field, messages in form.errors.items()))
+            return None
+        data = form.cleaned_data
+        category = data.pop('category')
+        category_id = self.get_category_id(category)
+        if category_id is None:
+            self.reject(line_number, 'category: Category "{}" does not exist'.format(category))
+            return None
+        return Offer(category_id=category_id, author=self.author, **data)
+
+    def get_category_id(self, name):
+        if name not in self.categories and self.create_categories:
+            self.categories[name] = OfferCategory.objects.get_or_create(name=name)[0].id
+        return self.categories.get(name)
+
+    def write_batch(self, offers):
+        """
+        Updates offers which already exist and creates the remaining ones in a single transaction.
+        Offers are written without calling save, so columns computed on save are filled here.
+        """
+        if not offers:
+            return
+        now = timezone.now()
+        for offer in offers:
+            offer.slug_url = slugify(offer.title)
+            offer.discount = Offer.compute_discount(offer.original_price, offer.offer_price)
+        with transaction.atomic():
+            existing = list(Offer.objects.filter(link__in=[offer.link for offer in offers])
+                            .only('id', 'link', 'score', 'num_comments', 'date_posted', 'archived',
+                                  'link_status', 'link_checked', 'link_broken'))
+            imported = {offer.link: offer for offer in offers}
+            for offer in existing:
+                new = imported[offer.link]
+                for field in IMPORTED_FIELDS + ('slug_url', 'discount'):
+                    if field != 'category':
+                        setattr(offer, field, getattr(new, field))
+                offer.category_id = new.category_id
+                if offer.offer_ends > now:
+                    # Refreshed offer is shown again, its link is checked anew by check_offer_links
+                    offer.archived = False
+                    offer.link_broken = False
+                    offer.link_status = None
+                    offer.link_checked = None
+                offer.hotness = scoring.hotness(offer.score, offer.num_comments, offer.date_posted)
+                offer.card_version = F('card_version') + 1
+            Offer.objects.bulk_update(existing, [field for field in IMPORTED_FIELDS if field != 'category']
+                                      + ['category', 'slug_url', 'discount', 'hotness', 'card_version', 'archived',
+                                         'link_broken', 'link_status', 'link_checked'])
+            existing_links = {offer.link for offer in existing}
+            to_create = [offer for offer in offers if offer.link not in existing_links]
+            for offer in to_create:
+                offer.hotness = scoring.hotness(0, 0, now)
+            Offer.objects.bulk_create(to_create)
+        self.created += len(to_create)
+        self.updated += len(existing)
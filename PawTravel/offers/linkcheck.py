@@ -0,0 +1,124 @@
+import asyncio
+import ssl
+import time
+from collections import defaultdict, namedtuple
+from urllib.parse import urljoin, urlsplit
+
+USER_AGENT = 'PawTravel-LinkChecker/1.0'
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+class LinkResult(namedtuple('LinkResult', ['status', 'error'])):
+    """
+    Result of checking a single link
+    status - HTTP status code of the final response or None if there was no response
+    error - description of a problem which prevented getting the response
+    """
+
+    @property
+    def broken(self):
+        """
+        Links which do not respond, do not exist or whose server fails are broken.
+        Other client errors such as 403 or 429 usually mean that the merchant does not like bots.
+        """
+        return self.status is None or self.status in (404, 410) or self.status >= 500
+
+
+class LinkChecker:
+    """
+    Checks many links concurrently using only asyncio streams.
+    At most `concurrency` links are checked at the same time and at most `per_host` of them on the same host,
+    requests to the same host are additionally spaced by `per_host_delay` seconds.
+    Servers answering HEAD with 405 or 501 are asked again with GET, redirects are followed.
+    """
+
+    def __init__(self, concurrency=100, per_host=2, per_host_delay=0.0, timeout=10.0, max_redirects=5):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.per_host_delay = per_host_delay
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self._ssl_context = ssl.create_default_context()
+
+    async def check_all(self, links):
+        """
+        :param links: Iterable of (key, url) tuples, it is consumed lazily
+        :return: Dictionary mapping keys to LinkResult
+        """
+        # Synchronization objects have to be created inside the running event loop
+        self._host_limits = defaultdict(lambda: asyncio.Semaphore(self.per_host))
+        self._host_last_request = defaultdict(float)
+        links = iter(links)
+        results = {}
+
+        async def worker():
+            # Workers share one iterator, so at most `concurrency` links are checked at once
+            for key, url in links:
+                results[key] = await self.check(url)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return results
+
+    async def check(self, url):
+        """
+        :param url: Checked url
+        :return: LinkResult of the url
+        """
+        try:
+            for _ in range(self.max_redirects + 1):
+                status, location = await self._request(url, 'HEAD')
+                if status in (405, 501):
+                    status, location = await self._request(url, 'GET')
+                if status in REDIRECT_CODES and location:
+                    url = urljoin(url, location)
+                    continue
+                return LinkResult(status, None)
+            return LinkResult(None, 'Too many redirects')
+        except asyncio.TimeoutError:
+            return LinkResult(None, 'Timeout')
+        except (OSError, ValueError, UnicodeError) as error:
+            return LinkResult(None, str(error) or error.__class__.__name__)
+
+    async def _request(self, url, method):
+        """
+        Sends single request to the host of url, respecting limits of the host
+        :return: Tuple of status code and Location header
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError('Unsupported url')
+        host = parts.hostname.lower()
+        async with self._host_limits[host]:
+            wait = self._host_last_request[host] + self.per_host_delay - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._host_last_request[host] = time.monotonic()
+            return await asyncio.wait_for(self._fetch(parts, method), self.timeout)
+
+    async def _fetch(self, parts, method):
+        https = parts.scheme == 'https'
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or (443 if https else 80),
+                                                       ssl=self._ssl_context if https else None)
+        try:
+            path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+            writer.write('{} {} HTTP/1.1\r\nHost: {}\r\nUser-Agent: {}\r\nAccept: */*\r\nConnection: close\r\n\r\n'
+                         .format(method, path, parts.netloc, USER_AGENT).encode('utf-8'))
+            await writer.drain()
+            status_line = (await reader.readline()).decode('latin-1').split()
+            if len(status_line) < 2 or not status_line[0].startswith('HTTP/') or not status_line[1].isdigit():
+                raise ValueError('Invalid HTTP response')
+            location = None
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                if name.strip().lower() == 'location':
+                    location = value.strip()
+            return int(status_line[1]), location
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (OSError, ssl.SSLError):
+                pass
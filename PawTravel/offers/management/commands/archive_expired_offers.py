@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from PawTravel import pagecache
+from offers.models import Offer
+
+
+class Command(BaseCommand):
+    """
+    Marks ended offers as archived, so they are no longer scanned by offer feeds.
+    Every batch is committed on its own, so locks are held only for a short time
+    and an interrupted run simply continues from the longest expired offer which is left.
+    """
+    help = 'Archives offers which have ended'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Amount of offers archived in a single transaction')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to wait between batches')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            archived = Offer.objects.archive_batch(options['batch_size'])
+            if not archived:
+                break
+            total += archived
+            if options['pause']:
+                time.sleep(options['pause'])
+        if total:
+            pagecache.purge(Offer)
+        self.stdout.write(self.style.SUCCESS('Archived {} offers'.format(total)))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from PawTravel import pagecache
+from offers.models import Offer
+
+
+class Command(BaseCommand):
+    """
+    Computes stored discount of offers created before the discount column existed.
+    New and edited offers get their discount on save.
+    """
+    help = 'Computes discount column of existing offers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Amount of offers updated in a single transaction')
+
+    def handle(self, *args, **options):
+        total = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                offers = list(Offer.objects.filter(id__gt=last_id).order_by('id')
+                              .only('id', 'original_price', 'offer_price', 'discount')[:options['batch_size']])
+                if not offers:
+                    break
+                last_id = offers[-1].id
+                changed = []
+                for offer in offers:
+                    discount = Offer.compute_discount(offer.original_price, offer.offer_price)
+                    if offer.discount != discount:
+                        offer.discount = discount
+                        offer.card_version = F('card_version') + 1
+                        changed.append(offer)
+                Offer.objects.bulk_update(changed, ['discount', 'card_version'])
+            total += len(changed)
+        if total:
+            pagecache.purge(Offer)
+        self.stdout.write(self.style.SUCCESS('Updated discount of {} offers'.format(total)))
@@ -0,0 +1,61 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from PawTravel import pagecache
+from offers.linkcheck import LinkChecker
+from offers.models import Offer
+
+
+class Command(BaseCommand):
+    """
+    Checks links of all offers which have not ended yet and stores the results on the offers.
+    Offers with broken links are hidden from offer feeds, until a later check finds their link working again.
+    Links are checked concurrently in batches, results of every batch are saved in a single transaction.
+    """
+    help = 'Checks links of active offers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=100,
+                            help='Maximum amount of links checked at the same time')
+        parser.add_argument('--per-host', type=int, default=2,
+                            help='Maximum amount of links of a single host checked at the same time')
+        parser.add_argument('--per-host-delay', type=float, default=0.5,
+                            help='Minimal amount of seconds between starts of requests to the same host')
+        parser.add_argument('--timeout', type=float, default=10,
+                            help='Seconds after which a single request is treated as failed')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Amount of offers loaded and updated at once')
+
+    def handle(self, *args, **options):
+        checker = LinkChecker(concurrency=options['concurrency'], per_host=options['per_host'],
+                              per_host_delay=options['per_host_delay'], timeout=options['timeout'])
+        offers = Offer.objects.filter(archived=False, offer_ends__gt=timezone.now())
+        checked = 0
+        broken = 0
+        changed = 0
+        last_id = 0
+        while True:
+            batch = list(offers.filter(id__gt=last_id).order_by('id')
+                         .only('id', 'link', 'link_status', 'link_checked', 'link_broken')[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            results = asyncio.run(checker.check_all((offer.id, offer.link) for offer in batch))
+            now = timezone.now()
+            for offer in batch:
+                result = results[offer.id]
+                if offer.link_broken != result.broken:
+                    changed += 1
+                offer.link_status, offer.link_broken, offer.link_checked = result.status, result.broken, now
+                broken += result.broken
+                if result.broken and options['verbosity'] > 1:
+                    self.stdout.write('Offer {}: {} {}'.format(offer.id, offer.link, result.error or result.status))
+            with transaction.atomic():
+                Offer.objects.bulk_update(batch, ['link_status', 'link_broken', 'link_checked'])
+            checked += len(batch)
+        if changed:
+            pagecache.purge(Offer)
+        self.stdout.write(self.style.SUCCESS('Checked {} offer links, {} broken'.format(checked, broken)))
@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from PawTravel import images
+from offers.models import Offer, OfferCategory
+from travel_guides.models import Guide, GuideCategory
+
+# Model and field of the image, its derivatives and model and lookup of objects whose cards show the image
+IMAGE_FIELDS = (
+    (Offer, 'image', images.IMAGE_DERIVATIVES, Offer, 'image'),
+    (Guide, 'image', images.IMAGE_DERIVATIVES, Guide, 'image'),
+    (OfferCategory, 'icon_image', images.ICON_DERIVATIVES, Offer, 'category__icon_image'),
+    (GuideCategory, 'icon_image', images.ICON_DERIVATIVES, Guide, 'category__icon_image'),
+)
+
+
+class Command(BaseCommand):
+    """
+    Generates missing derivatives of already uploaded offer, guide and category images on a process pool.
+    New uploads get their derivatives on save, so this is needed only for older media or after sizes change.
+    """
+    help = 'Generates scaled down copies of uploaded images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Amount of processes scaling images')
+        parser.add_argument('--force', action='store_true',
+                            help='Generate derivatives again even if they already exist')
+
+    def handle(self, *args, **options):
+        generated = 0
+        failed = 0
+        # Images of every submitted future, cards showing them are refreshed once all images are done
+        submitted = {}
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            pending = set()
+            for name, derivatives, owners in self.get_images():
+                try:
+                    if not default_storage.exists(name):
+                        continue
+                except SuspiciousFileOperation:
+                    continue
+                targets = images.get_missing_targets(name, derivatives, force=options['force'])
+                if not targets:
+                    continue
+                future = executor.submit(images.render_derivatives, default_storage.path(name), targets,
+                                         images.get_format()[0], settings.IMAGE_DERIVATIVE_QUALITY)
+                submitted[future] = (name, owners)
+                pending.add(future)
+                # Only a few images wait in the queue, so memory does not grow with amount of media
+                if len(pending) >= options['workers'] * 4:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    generated, failed = self.count(done, generated, failed)
+            generated, failed = self.count(wait(pending).done, generated, failed)
+        for future, (name, owners) in submitted.items():
+            if future.exception() is None:
+                images.forget_derivatives(name, owners)
+        self.stdout.write(self.style.SUCCESS('Generated {} image derivatives, {} images failed'.format(
+            generated, failed)))
+
+    @staticmethod
+    def get_images():
+        """
+        :return: Iterator of (storage name, derivative names, query set of objects showing it)
+        of every distinct uploaded image
+        """
+        for model, field, derivatives, owner_model, owner_lookup in IMAGE_FIELDS:
+            names = (model.objects.exclude(**{field: ''}).order_by().values_list(field, flat=True)
+                     .distinct().iterator())
+            for name in names:
+                yield name, derivatives, owner_model.objects.filter(**{owner_lookup: name})
+
+    def count(self, futures, generated, failed):
+        for future in futures:
+            try:
+                generated += future.result()
+            except Exception as error:
+                failed += 1
+                self.stderr.write(str(error))
+        return generated, failed
@@ -0,0 +1,51 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from PawTravel import pagecache
+from offers.importer import IMPORT_FORMATS, OfferImporter, read_rows
+from offers.models import Offer
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    """
+    Imports offers from a partner feed. The feed is read row by row and written in batches,
+    offers with a link which already exists are updated, so the same feed can be imported again.
+    Expected columns or keys: title, short_content, content, category (name), image,
+    offer_ends, original_price, offer_price, link.
+    """
+    help = 'Imports offers from a CSV or JSON lines feed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path of the feed, "-" reads standard input')
+        parser.add_argument('--author', required=True, help='Username of the author of imported offers')
+        parser.add_argument('--format', choices=IMPORT_FORMATS,
+                            help='Format of the feed, by default it is taken from the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Amount of offers written in a single transaction')
+        parser.add_argument('--create-categories', action='store_true',
+                            help='Create missing categories instead of rejecting their offers')
+
+    def handle(self, *args, **options):
+        try:
+            author = CustomUser.objects.get(username=options['author'])
+        except CustomUser.DoesNotExist:
+            raise CommandError('User "{}" does not exist'.format(options['author']))
+        file_format = options['format'] or options['path'].rpartition('.')[2].lower()
+        if file_format not in IMPORT_FORMATS:
+            raise CommandError('Unknown format of the feed, use --format')
+
+        importer = OfferImporter(author, batch_size=options['batch_size'],
+                                 create_categories=options['create_categories'],
+                                 report_error=lambda line, message: self.stderr.write(
+                                     'Line {}: {}'.format(line, message)))
+        if options['path'] == '-':
+            importer.run(read_rows(sys.stdin, file_format))
+        else:
+            with open(options['path'], newline='', encoding='utf-8') as feed:
+                importer.run(read_rows(feed, file_format))
+        if importer.created or importer.updated:
+            pagecache.purge(Offer)
+        self.stdout.write(self.style.SUCCESS('Created {} offers, updated {}, rejected {} rows'.format(
+            importer.created, importer.updated, importer.rejected)))
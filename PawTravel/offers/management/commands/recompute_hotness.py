@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from PawTravel.scoring import recompute_hotness
+from offers.models import Offer
+from travel_guides.models import Guide
+
+
+class Command(BaseCommand):
+    """
+    Recounts comments and recomputes hotness of all offers and guides.
+    Hotness is refreshed with every vote and comment, this command repairs it after
+    changes made outside of them and after the hotness formula changes.
+    """
+    help = 'Recomputes hotness ranking of offers and guides'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Amount of objects updated in a single transaction')
+
+    def handle(self, *args, **options):
+        for model in (Offer, Guide):
+            processed = recompute_hotness(model, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS('Recomputed hotness of {} {}'.format(
+                processed, model._meta.verbose_name_plural)))
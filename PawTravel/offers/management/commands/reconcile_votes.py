@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from PawTravel.scoring import reconcile_scores
+from offers.models import Offer
+from travel_guides.models import Guide
+
+
+class Command(BaseCommand):
+    """
+    Compares score and num_votes columns of offers and guides with stored votes
+    and repairs the ones which drifted, e.g. after votes were changed outside of the voting views.
+    """
+    help = 'Repairs stored vote scores of offers and guides'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Amount of objects checked in a single transaction')
+
+    def handle(self, *args, **options):
+        for model in (Offer, Guide):
+            repaired = reconcile_scores(model, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS('Repaired {} {}'.format(
+                repaired, model._meta.verbose_name_plural)))
@@ -1,13 +1,15 @@
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.text import slugify
 from tinymce.models import HTMLField
 
 from comments.models import Comment
-from voting.models import Vote
+from PawTravel import images, pagecache, scoring
 
 
 class OfferCategory(models.Model):
@@ -19,6 +21,37 @@ class OfferCategory(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        images.schedule_derivatives(self.icon_image, images.ICON_DERIVATIVES,
+                                    Offer.objects.filter(category=self))
+
+
+class OfferQuerySet(models.QuerySet):
+    def active(self):
+        """
+        :return: Offers which have not ended yet and whose links work
+        """
+        return self.filter(archived=False, offer_ends__gt=timezone.now(), link_broken=False)
+
+    def expired(self):
+        """
+        :return: Offers which have ended, but are not archived yet
+        """
+        return self.filter(archived=False, offer_ends__lte=timezone.now())
+
+    def archive_batch(self, batch_size):
+        """
+        Marks the longest expired offers as archived
+        :param batch_size: Maximum amount of archived offers
+        :return: Amount of archived offers
+        """
+        with transaction.atomic():
+            ids = list(self.expired().order_by('offer_ends', 'id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return 0
+            return self.filter(id__in=ids, archived=False).update(archived=True)
+
 
 class Offer(models.Model):
     """All fields needed for a single, individual offer"""
@@ -37,23 +70,79 @@ class Offer(models.Model):
     )
     original_price = models.FloatField()
     offer_price = models.FloatField()
+    discount = models.PositiveSmallIntegerField(default=0, editable=False)  # In percents, computed on save
     link = models.URLField()
+    link_status = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)  # Of the last link check
+    link_checked = models.DateTimeField(null=True, blank=True, editable=False)
+    link_broken = models.BooleanField(default=False, editable=False)  # Set by check_offer_links command
     comments = GenericRelation(Comment, related_query_name='all_comments')
+    score = models.IntegerField(default=0, editable=False)  # Sum of votes, updated with every vote
+    num_votes = models.PositiveIntegerField(default=0, editable=False)
+    num_comments = models.PositiveIntegerField(default=0, editable=False)
+    hotness = models.FloatField(default=0, editable=False)  # Ranking of Hot tab, see PawTravel.scoring.hotness
+    card_version = models.PositiveIntegerField(default=0, editable=False)  # Bumped whenever cached card gets stale
+    archived = models.BooleanField(default=False)  # Set for ended offers by archive_expired_offers command
+    hotness_date_field = 'date_posted'
+
+    objects = OfferQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Feeds only scan offers which are not archived
+            models.Index(fields=['-date_posted', '-id'], name='offer_date_posted_idx', condition=Q(archived=False)),
+            models.Index(fields=['-hotness', '-id'], name='offer_hotness_idx', condition=Q(archived=False)),
+            models.Index(fields=['offer_ends', 'id'], name='offer_ends_idx', condition=Q(archived=False)),
+            # Matching imported offers by their link
+            models.Index(fields=['link'], name='offer_link_idx'),
+            # Filtering by minimal discount within category
+            models.Index(fields=['category', 'discount'], name='offer_category_discount_idx',
+                         condition=Q(archived=False)),
+        ]
 
     def __str__(self):
         return self.title
 
     def save(self, **kwargs):
         self.slug_url = slugify(self.title)
-        super(Offer, self).save(kwargs)
+        self.hotness = scoring.hotness(self.score, self.num_comments, self.date_posted or timezone.now())
+        self.discount = self.compute_discount(self.original_price, self.offer_price)
+        adding = self._state.adding
+        if not adding:
+            # Bumped in the database, so concurrent votes and comments can not bring back an already used version
+            self.card_version = F('card_version') + 1
+            # Counters are changed by votes and comments in the meantime, a stale copy must not overwrite them
+            if kwargs.get('update_fields') is None:
+                kwargs['update_fields'] = scoring.get_saved_fields(self)
+        with transaction.atomic():
+            super(Offer, self).save(**kwargs)
+            if not adding:
+                scoring.refresh_hotness(Offer, self.pk)
+                self.refresh_from_db(fields=['card_version', *scoring.COUNTER_FIELDS])
+        pagecache.purge(Offer, self.pk)
+        images.schedule_derivatives(self.image, images.IMAGE_DERIVATIVES, Offer.objects.filter(pk=self.pk))
+
+    def delete(self, *args, **kwargs):
+        pk = self.pk
+        result = super().delete(*args, **kwargs)
+        pagecache.purge(Offer, pk)
+        return result
+
+    @staticmethod
+    def compute_discount(original_price, offer_price):
+        """
+        :return: Discount in whole percents, rounded down so offers never look better than they are
+        """
+        if not original_price or original_price <= 0 or offer_price >= original_price:
+            return 0
+        return min(100, int((1 - max(offer_price, 0) / original_price) * 100 + 1e-9))
 
     def get_absolute_url(self):
         return reverse('offer', kwargs={'pk': self.pk, 'slug_url': self.slug_url})
 
     @property
     def get_likes(self):
-        return Vote.objects.get_score(self)['score']
+        return self.score
 
     @property
     def get_votes(self):
-        return Vote.objects.get_score(self)['num_votes']
\ No newline at end of file
+        return self.num_votes
\ No newline at end of file
@@ -1,9 +1,17 @@
 import datetime
 import json
+import csv
 import tempfile
-
-from django.test import TestCase
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from offers.models import Offer, OfferCategory
 from parameterized import parameterized_class, parameterized
 from users.models import CustomUser
@@ -11,7 +19,17 @@ from pathlib import Path
 from django.test import Client
 import json
 from django.test.client import RequestFactory
-from .views import OfferDetailView, OfferVoteView
+from django.core.management import call_command
+from io import StringIO
+from .views import OfferDetailView, OfferVoteView, OfferHomepageView
+from .linkcheck import LinkChecker
+from voting.models import Vote
+from comments.models import Comment
+from PawTravel import scoring, cachestats, images
+from PIL import Image
+from django.template import Context, Template
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 
 class DetailOfferViewTestCase(TestCase):
@@ -184,6 +202,606 @@ class DetailOfferTestCase(TestCase):
         offer = Offer.objects.get(id=1)
         self.assertEquals(offer.get_absolute_url(), '/offers/testtitle-1/')
 
+class OfferFeedTestCase(TestCase):
+    """Base test case creating offers of different authors posted one hour after another"""
+
+    def setUp(self):
+        cache.clear()
+        self.category = OfferCategory.objects.create(name="TestCategory")
+        self.start = datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc)
+        self.ends = timezone.now() + datetime.timedelta(days=30)
+
+    def tearDown(self):
+        cache.clear()
+
+    def create_offers(self, amount):
+        for _ in range(amount):
+            number = Offer.objects.count()
+            author = CustomUser.objects.create(username='author{}'.format(number),
+                                               email='author{}@test.com'.format(number))
+            offer = Offer.objects.create(title="Offer {}".format(number), short_content="Short content",
+                                         content="<b>Styled content</b>", category=self.category,
+                                         image=tempfile.NamedTemporaryFile(suffix=".jpg").name,
+                                         offer_ends=self.ends, author=author, original_price=20,
+                                         offer_price=10, link="http://google.com")
+            Offer.objects.filter(id=offer.id).update(date_posted=self.start + datetime.timedelta(hours=number))
+            scoring.refresh_hotness(Offer, offer.id)
+
+    def count_homepage_queries(self):
+        # Whole pages are cached only for anonymous users, logged in ones run the homepage query set
+        self.client.force_login(CustomUser.objects.get_or_create(username='reader', email='reader@test.com')[0])
+        # First request fills avatar cache of authors
+        self.client.get(reverse('offer_homepage'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('offer_homepage'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any('offers_offer' in query['sql'] for query in queries.captured_queries))
+        return len(queries)
+
+
+class HomepageOfferTestCase(OfferFeedTestCase):
+    """Tests of the newest offers feed"""
+
+    def test_newest_offers_first(self):
+        self.create_offers(3)
+        response = self.client.get(reverse('offer_homepage'))
+        self.assertEqual([offer.title for offer in response.context['offers']], ["Offer 2", "Offer 1", "Offer 0"])
+
+    def test_pagination(self):
+        self.create_offers(OfferHomepageView.paginate_by + 1)
+        response = self.client.get(reverse('offer_homepage'))
+        self.assertEqual(len(response.context['offers']), OfferHomepageView.paginate_by)
+        response = self.client.get(reverse('offer_homepage') + '?page=2')
+        self.assertEqual([offer.title for offer in response.context['offers']], ["Offer 0"])
+
+    def test_content_is_not_loaded(self):
+        self.create_offers(1)
+        response = self.client.get(reverse('offer_homepage'))
+        self.assertIn('content', response.context['offers'][0].get_deferred_fields())
+
+    def test_constant_amount_of_queries(self):
+        self.create_offers(3)
+        small = self.count_homepage_queries()
+        self.create_offers(OfferHomepageView.paginate_by)
+        self.assertEqual(self.count_homepage_queries(), small)
+
+
+class HotOfferTestCase(OfferFeedTestCase):
+    """Tests of hotness ranking and the hot offers feed"""
+
+    def test_hotness_formula(self):
+        posted = self.start
+        self.assertGreater(scoring.hotness(10, 0, posted), scoring.hotness(1, 0, posted))
+        self.assertGreater(scoring.hotness(0, 10, posted), scoring.hotness(0, 0, posted))
+        self.assertLess(scoring.hotness(-10, 0, posted), scoring.hotness(0, 0, posted))
+        # Ten times more votes are worth as much as being posted HOTNESS_DECAY seconds later
+        later = posted + datetime.timedelta(seconds=scoring.HOTNESS_DECAY)
+        self.assertAlmostEqual(scoring.hotness(100, 0, posted), scoring.hotness(10, 0, later))
+
+    def test_hotness_follows_votes_and_comments(self):
+        self.create_offers(1)
+        offer = Offer.objects.get()
+        self.assertAlmostEqual(offer.hotness, scoring.hotness(0, 0, offer.date_posted), places=5)
+        voter = CustomUser.objects.create(username='voter', email='voter@test.com')
+        scoring.record_vote(offer, voter, 1)
+        comment = Comment.objects.create(text="Comment", author=voter, content_object=offer, object_id=offer.id)
+        offer.refresh_from_db()
+        self.assertEqual(offer.num_comments, 1)
+        self.assertAlmostEqual(offer.hotness, scoring.hotness(1, 1, offer.date_posted), places=5)
+        comment.delete()
+        offer.refresh_from_db()
+        self.assertEqual(offer.num_comments, 0)
+        self.assertAlmostEqual(offer.hotness, scoring.hotness(1, 0, offer.date_posted), places=5)
+
+    def test_saving_stale_offer_keeps_counters(self):
+        self.create_offers(1)
+        stale = Offer.objects.get()
+        voter = CustomUser.objects.create(username='voter', email='voter@test.com')
+        scoring.record_vote(Offer.objects.get(), voter, 1)
+        Comment.objects.create(text="Comment", author=voter, content_object=stale, object_id=stale.id)
+        stale.title = "Edited offer"
+        stale.save()
+        offer = Offer.objects.get()
+        self.assertEqual((offer.title, offer.score, offer.num_votes, offer.num_comments), ("Edited offer", 1, 1, 1))
+        self.assertAlmostEqual(offer.hotness, scoring.hotness(1, 1, offer.date_posted), places=5)
+        self.assertEqual((stale.score, stale.num_votes, stale.num_comments), (1, 1, 1))
+
+    def test_hot_feed_order(self):
+        self.create_offers(3)
+        voters = [CustomUser.objects.create(username='voter{}'.format(i), email='voter{}@test.com'.format(i))
+                  for i in range(20)]
+        old_offer = Offer.objects.get(title="Offer 0")
+        for voter in voters:
+            scoring.record_vote(old_offer, voter, 1)
+        response = self.client.get(reverse('offer_hot'))
+        self.assertEqual([offer.title for offer in response.context['offers']], ["Offer 0", "Offer 2", "Offer 1"])
+        self.assertContains(response, '<li class="uk-active"><a href="{}">Hot</a></li>'.format(reverse('offer_hot')),
+                            html=True)
+
+    def test_recompute_hotness(self):
+        self.create_offers(2)
+        offer = Offer.objects.get(title="Offer 0")
+        author = CustomUser.objects.get(username='author0')
+        Comment.objects.bulk_create([Comment(text="Comment", author=author, content_object=offer,
+                                             object_id=offer.id)])
+        Offer.objects.update(hotness=0)
+        out = StringIO()
+        call_command('recompute_hotness', stdout=out)
+        self.assertIn('Recomputed hotness of 2 offers', out.getvalue())
+        offer.refresh_from_db()
+        self.assertEqual(offer.num_comments, 1)
+        self.assertAlmostEqual(offer.hotness, scoring.hotness(0, 1, offer.date_posted), places=5)
+
+
+class ExpiredOfferTestCase(OfferFeedTestCase):
+    """Tests of hiding and archiving offers which have ended"""
+
+    def expire(self, *titles):
+        for number, title in enumerate(titles):
+            Offer.objects.filter(title=title).update(offer_ends=timezone.now() - datetime.timedelta(hours=number + 1))
+
+    def test_feeds_skip_ended_offers(self):
+        self.create_offers(3)
+        self.expire("Offer 1")
+        for url in [reverse('offer_homepage'), reverse('offer_hot')]:
+            response = self.client.get(url)
+            self.assertNotIn("Offer 1", [offer.title for offer in response.context['offers']])
+            self.assertEqual(len(response.context['offers']), 2)
+
+    def test_archive_in_batches(self):
+        self.create_offers(5)
+        self.expire("Offer 3", "Offer 0", "Offer 4")
+        self.assertEqual(Offer.objects.archive_batch(2), 2)
+        # The longest expired offers are archived first
+        self.assertEqual(set(Offer.objects.filter(archived=True).values_list('title', flat=True)),
+                         {"Offer 4", "Offer 0"})
+        out = StringIO()
+        call_command('archive_expired_offers', batch_size=2, stdout=out)
+        self.assertIn('Archived 1 offers', out.getvalue())
+        self.assertEqual(Offer.objects.filter(archived=True).count(), 3)
+        self.assertEqual(Offer.objects.expired().count(), 0)
+        self.assertEqual(Offer.objects.active().count(), 2)
+
+    def test_archived_offer_is_still_viewable(self):
+        self.create_offers(1)
+        self.expire("Offer 0")
+        call_command('archive_expired_offers', stdout=StringIO())
+        offer = Offer.objects.get()
+        self.assertEqual(self.client.get(offer.get_absolute_url()).status_code, 200)
+
+
+class DiscountFilterTestCase(OfferFeedTestCase):
+    """Tests of stored discount and filtering offer listings"""
+
+    def setUp(self):
+        super().setUp()
+        self.other_category = OfferCategory.objects.create(name="OtherCategory")
+        self.create_offers(4)
+        for title, category, offer_price in [("Offer 0", self.category, 5), ("Offer 1", self.category, 12),
+                                             ("Offer 2", self.other_category, 4), ("Offer 3", self.category, 20)]:
+            offer = Offer.objects.get(title=title)
+            offer.category = category
+            offer.offer_price = offer_price
+            offer.save()
+
+    def titles(self, **filters):
+        response = self.client.get(reverse('offer_homepage'), filters)
+        return [offer.title for offer in response.context['offers']]
+
+    @parameterized.expand([
+        (100, 50, 50),
+        (1999.99, 989.99, 50),
+        (10, 7, 30),
+        (10, 10, 0),
+        (10, 12, 0),
+        (0, 0, 0),
+        (10, 0, 100),
+    ])
+    def test_compute_discount(self, original_price, offer_price, discount):
+        self.assertEqual(Offer.compute_discount(original_price, offer_price), discount)
+
+    def test_discount_is_stored_on_save(self):
+        self.assertEqual(dict(Offer.objects.values_list('title', 'discount')),
+                         {"Offer 0": 75, "Offer 1": 40, "Offer 2": 80, "Offer 3": 0})
+
+    def test_filters(self):
+        self.assertEqual(self.titles(category=self.category.id), ["Offer 3", "Offer 1", "Offer 0"])
+        self.assertEqual(self.titles(min_discount=50), ["Offer 2", "Offer 0"])
+        self.assertEqual(self.titles(category=self.category.id, min_discount=40), ["Offer 1", "Offer 0"])
+        self.assertEqual(self.titles(min_price=5, max_price=12), ["Offer 1", "Offer 0"])
+
+    def test_invalid_filters_are_ignored(self):
+        self.assertEqual(self.titles(min_discount="much", category=self.category.id),
+                         ["Offer 3", "Offer 1", "Offer 0"])
+
+    def test_pagination_keeps_filters(self):
+        with mock.patch.object(OfferHomepageView, 'paginate_by', 1):
+            response = self.client.get(reverse('offer_homepage'), {'min_discount': 50})
+        self.assertContains(response, '?min_discount=50&amp;page=2')
+
+    def test_discount_filter_uses_index(self):
+        plan = Offer.objects.active().filter(category=self.category, discount__gte=50).explain()
+        self.assertIn('offer_category_discount_idx', plan)
+
+
+class CardCacheTestCase(OfferFeedTestCase):
+    """Tests of caching rendered offer cards"""
+
+    def setUp(self):
+        super().setUp()
+        self.create_offers(3)
+        self.offer = Offer.objects.get(title="Offer 1")
+        self.voter = CustomUser.objects.create(username='voter', email='voter@test.com')
+        # Whole pages of anonymous users are cached, cards matter for logged in ones
+        self.client.force_login(self.voter)
+
+    def render_homepage(self):
+        cachestats.reset()
+        response = self.client.get(reverse('offer_homepage'))
+        return response, cachestats.get_stats()['cards']
+
+    def test_cards_are_cached(self):
+        _, stats = self.render_homepage()
+        self.assertEqual((stats['hits'], stats['misses']), (0, 3))
+        _, stats = self.render_homepage()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_rate']), (3, 0, 1))
+
+    def test_cards_are_fetched_at_once(self):
+        self.render_homepage()
+        with mock.patch('PawTravel.cardcache.cache', wraps=cache) as card_cache, \
+                mock.patch('PawTravel.cachestats.cache', wraps=cache) as stats_cache:
+            _, stats = self.render_homepage()
+        self.assertEqual(card_cache.get_many.call_count, 1)
+        self.assertEqual(card_cache.get.call_count, 0)
+        self.assertEqual(stats_cache.incr.call_count, 1)
+        self.assertEqual((stats['hits'], stats['misses']), (3, 0))
+
+    def test_vote_refreshes_card(self):
+        self.render_homepage()
+        scoring.record_vote(self.offer, self.voter, 1)
+        response, stats = self.render_homepage()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+        self.assertContains(response, '<span class="countlikes">1</span>', html=True)
+
+    def test_edit_refreshes_card(self):
+        self.render_homepage()
+        offer = Offer.objects.get(id=self.offer.id)
+        offer.title = "Edited offer"
+        offer.save()
+        self.assertEqual(offer.card_version, 1)
+        response, stats = self.render_homepage()
+        self.assertEqual(stats['misses'], 1)
+        self.assertContains(response, "Edited offer")
+
+    def test_comment_refreshes_card(self):
+        self.render_homepage()
+        Comment.objects.create(text="Comment", author=self.voter, content_object=self.offer, object_id=self.offer.id)
+        _, stats = self.render_homepage()
+        self.assertEqual(stats['misses'], 1)
+
+    def test_stale_instance_does_not_reuse_version(self):
+        stale = Offer.objects.get(id=self.offer.id)
+        scoring.record_vote(self.offer, self.voter, 1)
+        stale.save()
+        self.assertEqual(stale.card_version, 2)
+
+    def test_stats_only_for_staff(self):
+        self.assertEqual(self.client.get(reverse('cache_stats')).status_code, 403)
+        self.voter.is_staff = True
+        self.voter.save()
+        self.render_homepage()
+        response = self.client.get(reverse('cache_stats'))
+        self.assertEqual(json.loads(response.content)['cards']['misses'], 3)
+
+
+class StubMerchantHandler(BaseHTTPRequestHandler):
+    """Local merchant server answering differently depending on the path"""
+
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def do_HEAD(self):
+        with self.lock:
+            StubMerchantHandler.active += 1
+            StubMerchantHandler.max_active = max(StubMerchantHandler.max_active, StubMerchantHandler.active)
+        try:
+            self.answer()
+        finally:
+            with self.lock:
+                StubMerchantHandler.active -= 1
+
+    def do_GET(self):
+        self.answer(head=False)
+
+    def answer(self, head=True):
+        if self.path == '/ok' or self.path.startswith('/ok?'):
+            self.send_response(200)
+        elif self.path == '/gone':
+            self.send_response(404)
+        elif self.path == '/moved':
+            self.send_response(301)
+            self.send_header('Location', '/ok')
+        elif self.path == '/loop':
+            self.send_response(302)
+            self.send_header('Location', '/loop')
+        elif self.path == '/no-head':
+            self.send_response(405 if head else 200)
+        elif self.path == '/slow':
+            time.sleep(0.1)
+            self.send_response(200)
+        elif self.path == '/hang':
+            time.sleep(1)
+            self.send_response(200)
+        else:
+            self.send_response(500)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class LinkCheckerTestCase(OfferFeedTestCase):
+    """Tests of checking offer links against a local stub server"""
+
+    def setUp(self):
+        super().setUp()
+        StubMerchantHandler.max_active = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubMerchantHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def check(self, paths, **options):
+        checker = LinkChecker(**options)
+        return asyncio.run(checker.check_all((path, self.base_url + path) for path in paths))
+
+    def test_statuses(self):
+        results = self.check(['/ok', '/gone', '/moved', '/no-head', '/broken', '/loop'], timeout=2)
+        self.assertEqual({path: result.status for path, result in results.items()},
+                         {'/ok': 200, '/gone': 404, '/moved': 200, '/no-head': 200, '/broken': 500, '/loop': None})
+        self.assertEqual({path for path, result in results.items() if result.broken}, {'/gone', '/broken', '/loop'})
+
+    def test_timeout_and_connection_errors(self):
+        results = self.check(['/hang'], timeout=0.2)
+        self.assertEqual(results['/hang'].error, 'Timeout')
+        checker = LinkChecker(timeout=1)
+        results = asyncio.run(checker.check_all([(1, 'http://127.0.0.1:1/'), (2, 'ftp://example.com/')]))
+        self.assertTrue(results[1].broken and results[2].broken)
+
+    def test_per_host_limit(self):
+        results = self.check(['/slow?{}'.format(i) for i in range(8)], concurrency=8, per_host=2)
+        self.assertEqual(len(results), 8)
+        self.assertLessEqual(StubMerchantHandler.max_active, 2)
+
+    def test_command_hides_broken_offers(self):
+        self.create_offers(3)
+        for title, path in [("Offer 0", '/ok'), ("Offer 1", '/gone'), ("Offer 2", '/moved')]:
+            Offer.objects.filter(title=title).update(link=self.base_url + path)
+        out = StringIO()
+        call_command('check_offer_links', per_host_delay=0, timeout=2, stdout=out)
+        self.assertIn('Checked 3 offer links, 1 broken', out.getvalue())
+        offer = Offer.objects.get(title="Offer 1")
+        self.assertEqual((offer.link_status, offer.link_broken), (404, True))
+        self.assertIsNotNone(offer.link_checked)
+        response = self.client.get(reverse('offer_homepage'))
+        self.assertEqual([offer.title for offer in response.context['offers']], ["Offer 2", "Offer 0"])
+
+
+class OfferImportTestCase(TestCase):
+    """Tests of importing offer feeds"""
+
+    def setUp(self):
+        cache.clear()
+        self.author = CustomUser.objects.create(username='partner', email='partner@test.com')
+        self.category = OfferCategory.objects.create(name="Hotels")
+        self.feed = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.feed.cleanup()
+        cache.clear()
+
+    def row(self, number, **changes):
+        row = {'title': 'Imported offer {}'.format(number), 'short_content': 'Short', 'content': '<b>Content</b>',
+               'category': 'Hotels', 'image': 'offers/{}.jpg'.format(number), 'offer_ends': '2030-01-01T12:00:00',
+               'original_price': '100', 'offer_price': '60', 'link': 'http://partner.com/offer/{}'.format(number)}
+        row.update(changes)
+        return row
+
+    def write_feed(self, name, rows):
+        path = Path(self.feed.name) / name
+        with open(path, 'w', newline='', encoding='utf-8') as feed:
+            if name.endswith('.csv'):
+                writer = csv.DictWriter(feed, fieldnames=list(rows[0].keys()))
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                feed.writelines(json.dumps(row) + '\n' for row in rows)
+        return str(path)
+
+    def import_feed(self, path, **options):
+        out, err = StringIO(), StringIO()
+        call_command('import_offers', path, author='partner', stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_import(self):
+        out, err = self.import_feed(self.write_feed('feed.csv', [self.row(i) for i in range(5)]), batch_size=2)
+        self.assertIn('Created 5 offers, updated 0, rejected 0 rows', out)
+        offer = Offer.objects.get(link='http://partner.com/offer/3')
+        self.assertEqual((offer.slug_url, offer.discount, offer.author, offer.category),
+                         ('imported-offer-3', 40, self.author, self.category))
+        self.assertGreater(offer.hotness, 0)
+        self.assertIsNotNone(offer.date_posted)
+
+    def test_reimport_updates_offers(self):
+        self.import_feed(self.write_feed('feed.jsonl', [self.row(i) for i in range(3)]))
+        rows = [self.row(1, title='Renamed offer', offer_price='25'), self.row(3)]
+        out, _ = self.import_feed(self.write_feed('feed.jsonl', rows))
+        self.assertIn('Created 1 offers, updated 1, rejected 0 rows', out)
+        self.assertEqual(Offer.objects.count(), 4)
+        offer = Offer.objects.get(link='http://partner.com/offer/1')
+        self.assertEqual((offer.title, offer.slug_url, offer.discount, offer.card_version),
+                         ('Renamed offer', 'renamed-offer', 75, 1))
+
+    def test_reimport_shows_extended_offers_again(self):
+        self.import_feed(self.write_feed('feed.jsonl', [self.row(0), self.row(1)]))
+        Offer.objects.update(archived=True, link_broken=True, link_status=404, link_checked=timezone.now())
+        self.import_feed(self.write_feed('feed.jsonl', [self.row(0, offer_ends='2031-01-01T12:00:00'),
+                                                        self.row(1, offer_ends='2020-01-01T12:00:00')]))
+        extended = Offer.objects.get(link='http://partner.com/offer/0')
+        self.assertEqual((extended.archived, extended.link_broken, extended.link_status, extended.link_checked),
+                         (False, False, None, None))
+        self.assertEqual(list(Offer.objects.active()), [extended])
+        ended = Offer.objects.get(link='http://partner.com/offer/1')
+        self.assertEqual((ended.archived, ended.link_broken, ended.link_status), (True, True, 404))
+
+    def test_invalid_rows_are_rejected(self):
+        path = self.write_feed('feed.jsonl', [self.row(0), self.row(1, offer_price='free'),
+                                              self.row(2, category='Flights'), self.row(3, link='not a link')])
+        with open(path, 'a', encoding='utf-8') as feed:
+            feed.write('{broken json\n')
+        out, err = self.import_feed(path)
+        self.assertIn('Created 1 offers, updated 0, rejected 4 rows', out)
+        self.assertIn('Line 2: offer_price', err)
+        self.assertIn('Line 3: category: Category "Flights" does not exist', err)
+        self.assertIn('Line 4: link', err)
+        self.assertIn('Line 5: Invalid json', err)
+
+    def test_create_categories(self):
+        out, _ = self.import_feed(self.write_feed('feed.csv', [self.row(0, category='Flights')]),
+                                  create_categories=True)
+        self.assertIn('Created 1 offers', out)
+        self.assertEqual(Offer.objects.get().category.name, 'Flights')
+
+    def test_queries_do_not_grow_with_rows(self):
+        path = self.write_feed('feed.csv', [self.row(i) for i in range(50)])
+        with CaptureQueriesContext(connection) as queries:
+            self.import_feed(path, batch_size=50)
+        self.assertLess(len(queries), 15)
+
+
+class ImageDerivativesTestCase(TestCase):
+    """Tests of generating scaled down copies of uploaded images"""
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media.name, IMAGE_DERIVATIVE_WORKERS=0)
+        self.settings_override.enable()
+        cache.clear()
+        self.author = CustomUser.objects.create(username='author', email='author@test.com')
+        self.category = OfferCategory.objects.create(name="Hotels")
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media.cleanup()
+        cache.clear()
+
+    def upload(self, name, size=(2000, 1000)):
+        Image.new('RGB', size, color=(200, 100, 50)).save(Path(self.media.name) / name)
+        return name
+
+    def create_offer(self, image):
+        return Offer.objects.create(title="Offer", short_content="Short", content="Content", category=self.category,
+                                    image=image, offer_ends=timezone.now() + datetime.timedelta(days=1),
+                                    author=self.author, original_price=20, offer_price=10, link="http://google.com")
+
+    def derivative_path(self, name, derivative):
+        return Path(self.media.name) / images.derivative_name(name, derivative)
+
+    def test_derivatives_are_generated_after_commit(self):
+        name = self.upload('beach.png')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_offer(name)
+        for derivative in images.IMAGE_DERIVATIVES:
+            with Image.open(self.derivative_path(name, derivative)) as image:
+                max_width, max_height = images.DERIVATIVE_SIZES[derivative]
+                self.assertEqual(image.format, images.get_format()[0])
+                self.assertLessEqual(image.width, max_width)
+                self.assertLessEqual(image.height, max_height)
+                # Aspect ratio is kept
+                self.assertAlmostEqual(image.width / image.height, 2, places=1)
+
+    def test_generated_derivatives_refresh_cards(self):
+        name = self.upload('beach.png')
+        with self.captureOnCommitCallbacks(execute=True):
+            offer = self.create_offer(name)
+        self.assertEqual(Offer.objects.get(id=offer.id).card_version, 1)
+        self.category.icon_image = self.upload('icon.png', size=(300, 300))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        self.assertEqual(Offer.objects.get(id=offer.id).card_version, 2)
+
+    def test_backfill_command_refreshes_cards(self):
+        offer = self.create_offer(self.upload('beach.png'))
+        call_command('generate_image_derivatives', workers=1, stdout=StringIO())
+        self.assertEqual(Offer.objects.get(id=offer.id).card_version, 1)
+
+    def test_derivatives_of_images_differing_in_extension(self):
+        self.assertNotEqual(images.derivative_name('uploads/photo.jpg', 'card'),
+                            images.derivative_name('uploads/photo.png', 'card'))
+
+    def test_small_images_are_not_scaled_up(self):
+        name = self.upload('small.png', size=(100, 50))
+        images.render_derivatives(str(Path(self.media.name) / name),
+                                  [(str(self.derivative_path(name, 'hero')), images.DERIVATIVE_SIZES['hero'])],
+                                  'JPEG', 80)
+        with Image.open(self.derivative_path(name, 'hero')) as image:
+            self.assertEqual(image.size, (100, 50))
+
+    def test_template_tags(self):
+        offer = self.create_offer(self.upload('beach.png'))
+        template = Template("{% load images %}{% derivative_url offer.image 'card' %}|{% image_srcset offer.image %}")
+        self.assertEqual(template.render(Context({'offer': offer})), '/uploads/beach.png|')
+        call_command('generate_image_derivatives', workers=1, stdout=StringIO())
+        src, srcset = template.render(Context({'offer': offer})).split('|')
+        self.assertEqual(src, '/uploads/' + images.derivative_name('beach.png', 'card'))
+        self.assertEqual(len(srcset.split(', ')), len(images.IMAGE_DERIVATIVES))
+        self.assertIn(' {}w'.format(images.DERIVATIVE_SIZES['hero'][0]), srcset)
+
+    def test_template_tags_check_storage_once(self):
+        name = self.upload('beach.png')
+        with self.captureOnCommitCallbacks(execute=True):
+            offer = self.create_offer(name)
+        template = Template("{% load images %}{% derivative_url offer.image 'card' %}|{% image_srcset offer.image %}")
+        with mock.patch.object(images.default_storage, 'exists', wraps=images.default_storage.exists) as exists:
+            for _ in range(3):
+                src, srcset = template.render(Context({'offer': offer})).split('|')
+        self.assertEqual(src, '/uploads/' + images.derivative_name(name, 'card'))
+        self.assertEqual(len(srcset.split(', ')), len(images.IMAGE_DERIVATIVES))
+        self.assertEqual(exists.call_count, len(images.DERIVATIVE_SIZES))
+
+    def test_failed_generation_is_logged(self):
+        with open(Path(self.media.name) / 'broken.png', 'w') as file:
+            file.write('not an image')
+        with self.settings(IMAGE_DERIVATIVE_WORKERS=1), self.assertLogs('PawTravel.images', 'ERROR') as logs:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.create_offer('broken.png')
+            images.get_executor().shutdown()
+            images.get_executor.cache_clear()
+        self.assertIn('broken.png', logs.output[0])
+
+    def test_backfill_command(self):
+        for number in range(3):
+            self.create_offer(self.upload('offer{}.png'.format(number)))
+        self.category.icon_image = self.upload('icon.png', size=(300, 300))
+        OfferCategory.objects.filter(id=self.category.id).update(icon_image='icon.png')
+        self.create_offer('missing.png')
+        out = StringIO()
+        call_command('generate_image_derivatives', workers=2, stdout=out)
+        self.assertIn('Generated {} image derivatives, 0 images failed'.format(3 * len(images.IMAGE_DERIVATIVES) + 1),
+                      out.getvalue())
+        self.assertTrue(self.derivative_path('icon.png', 'icon').exists())
+        out = StringIO()
+        call_command('generate_image_derivatives', workers=2, stdout=out)
+        self.assertIn('Generated 0 image derivatives', out.getvalue())
+
+
 class VotingSystemTests(TestCase):
     """
     This class is responsible for testing implementation of voting system
@@ -303,4 +921,67 @@ class VotingSystemTests(TestCase):
         response = view.post(self=view, request=request, pk=id, mode="like")
         json_response = json.loads(response.content.decode())
         self.assertEqual(json_response["likes"], 1)
-        self.assertEqual(json_response["num_votes"], 1)
\ No newline at end of file
+        self.assertEqual(json_response["num_votes"], 1)
+
+    @override_settings(RATE_LIMITS={'vote': (2, 60)})
+    def test_vote_rate_limit(self):
+        """
+        Checks if user voting too quickly gets 429 code with Retry-After header
+        """
+        cache.clear()
+        id = self.offer.id
+        vote_url = "/offers/vote/{}/like".format(id)
+        view = OfferVoteView
+        factory = RequestFactory()
+        request = factory.post(vote_url)
+        request.user = CustomUser.objects.create(username='testuser', email="test@test.com")
+        for mode in ["like", "dislike"]:
+            self.assertEqual(view.post(self=view, request=request, pk=id, mode=mode).status_code, 200)
+        response = view.post(self=view, request=request, pk=id, mode="like")
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(Vote.objects.get_score(self.offer)['score'], -1)
+        cache.clear()
+
+    def test_stored_score_follows_votes(self):
+        """
+        Checks if score and num_votes columns are changed together with votes
+        """
+        factory = RequestFactory()
+        view = OfferVoteView
+        users = [CustomUser.objects.create(username='voter{}'.format(i), email="voter{}@test.com".format(i))
+                 for i in range(3)]
+        for user, mode in zip(users, ["like", "like", "dislike"]):
+            request = factory.post("/offers/vote/{}/{}".format(self.offer.id, mode))
+            request.user = user
+            view.post(self=view, request=request, pk=self.offer.id, mode=mode)
+        request.user = users[0]
+        view.post(self=view, request=request, pk=self.offer.id, mode="remove")
+        self.offer.refresh_from_db()
+        self.assertEqual((self.offer.score, self.offer.num_votes), (0, 2))
+        self.assertEqual((self.offer.get_likes, self.offer.get_votes),
+                         tuple(Vote.objects.get_score(self.offer).values()))
+
+    def test_likes_read_without_aggregate(self):
+        """
+        Checks if reading likes of an offer does not query votes
+        """
+        with self.assertNumQueries(0):
+            self.offer.get_likes
+            self.offer.get_votes
+
+    def test_reconcile_votes(self):
+        """
+        Checks if reconciliation command repairs scores which drifted from votes
+        """
+        Vote.objects.record_vote(self.offer, self.user_one, 1)
+        Offer.objects.filter(id=self.offer.id).update(score=5, num_votes=7)
+        out = StringIO()
+        call_command('reconcile_votes', stdout=out)
+        self.offer.refresh_from_db()
+        self.assertEqual((self.offer.score, self.offer.num_votes), (1, 1))
+        self.assertEqual(self.offer.hotness, scoring.hotness(1, self.offer.num_comments, self.offer.date_posted))
+        self.assertIn('Repaired 1 offers', out.getvalue())
+        out = StringIO()
+        call_command('reconcile_votes', stdout=out)
+        self.assertIn('Repaired 0 offers', out.getvalue())
@@ -1,10 +1,13 @@
 from django.urls import path
 
-from .views import OfferDetailView, OfferVoteView
+from PawTravel.pagecache import cache_anonymous_page
+from .models import Offer
+from .views import OfferDetailView, OfferVoteView, OfferHotView
 
 urlpatterns = [
+    path('hot/', cache_anonymous_page(Offer)(OfferHotView.as_view()), name="offer_hot"),
     path('<int:pk>/', OfferDetailView.as_view(), name="offer"),
-    path('<slug_url>-<int:pk>/', OfferDetailView.as_view(), name="offer"),
+    path('<slug_url>-<int:pk>/', cache_anonymous_page(Offer, 'pk')(OfferDetailView.as_view()), name="offer"),
     path('vote/<int:pk>/<str:mode>', OfferVoteView.as_view(), name='offer_vote'),
 
 ]
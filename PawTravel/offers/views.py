@@ -7,7 +7,9 @@ from django.views.generic.list import MultipleObjectMixin, ListView
 
 from . import models
 from comments.forms import CommentForm
-from voting.models import Vote
+from .forms import OfferFilterForm
+from PawTravel import scoring
+from PawTravel.ratelimit import RateLimiter, RateLimitExceeded, too_many_requests
 from django.http import JsonResponse
 from django.views import View
 
@@ -25,8 +27,8 @@ class OfferDetailView(FormMixin, DetailView, MultipleObjectMixin):
         offer = self.get_object()
         object_list = offer.comments.all()
         context = super().get_context_data(object_list=object_list, **kwargs)
-        context["likes"] = Vote.objects.get_score(context['offer'])['score']
-        context["num_votes"] = Vote.objects.get_score(context['offer'])['num_votes']
+        context["likes"] = context['offer'].score
+        context["num_votes"] = context['offer'].num_votes
         return context
 
     def dispatch(self, request, *args, **kwargs):
@@ -41,6 +43,7 @@ class OfferDetailView(FormMixin, DetailView, MultipleObjectMixin):
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
         kwargs['form_object'] = self.get_object()
+        kwargs['user'] = self.request.user
         return kwargs
 
     def post(self, request, *args, **kwargs):
@@ -49,6 +52,8 @@ class OfferDetailView(FormMixin, DetailView, MultipleObjectMixin):
 
         if form.is_valid():
             return self.form_valid(form)
+        elif form.rate_limit_error is not None:
+            return too_many_requests(form.rate_limit_error, self.form_invalid(form))
         else:
             return self.form_invalid(form)
 
@@ -58,11 +63,42 @@ class OfferDetailView(FormMixin, DetailView, MultipleObjectMixin):
 
 
 class OfferHomepageView(ListView):
-    """A view showing list of the latest offers."""
+    """
+    A view showing list of the latest offers which have not ended yet.
+    Offers can be filtered by category, price range and minimal discount, see OfferFilterForm.
+    Author and category are fetched in the same query and only columns shown on offer cards are loaded,
+    so the page costs the same amount of queries regardless of amount of offers.
+    """
 
     model = models.Offer
     context_object_name = 'offers'
     template_name = 'offers/homepage_offers.html'
+    paginate_by = 20
+    ordering = ('-date_posted', '-id')
+    card_fields = ('id', 'title', 'slug_url', 'short_content', 'image', 'date_posted', 'offer_ends',
+                   'original_price', 'offer_price', 'discount', 'link', 'score', 'num_votes', 'card_version',
+                   'author__id', 'author__username', 'author__email',
+                   'category__id', 'category__name', 'category__icon_image')
+
+    def get_queryset(self):
+        self.filter_form = OfferFilterForm(self.request.GET)
+        queryset = self.filter_form.filter(models.Offer.objects.active())
+        return queryset.order_by(*self.ordering).select_related('author', 'category').only(*self.card_fields)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['filter_form'] = self.filter_form
+        # Filters are kept when moving between pages
+        query = self.request.GET.copy()
+        query.pop('page', None)
+        context['filter_query'] = query.urlencode()
+        return context
+
+
+class OfferHotView(OfferHomepageView):
+    """A view showing list of offers ordered by their stored hotness."""
+
+    ordering = ('-hotness', '-id')
 
 
 class OfferVoteView(View):
@@ -70,21 +106,28 @@ class OfferVoteView(View):
     View responsible for processing voting system
     """
 
+    rate_limiter = RateLimiter('vote')
+
     def post(self, request, pk, mode):
         user = request.user
+        if user.is_authenticated:
+            try:
+                self.rate_limiter.hit(user.id)
+            except RateLimitExceeded as error:
+                return too_many_requests(error)
         guide = models.Offer.objects.get(id=pk)
         self.record_vote(guide, mode, user)
         data = dict()
-        data["likes"] = Vote.objects.get_score(guide)['score']
-        data["num_votes"] = Vote.objects.get_score(guide)['num_votes']
+        data["likes"] = guide.score
+        data["num_votes"] = guide.num_votes
         return JsonResponse(data)
 
     @staticmethod
     def record_vote(guide, mode, user):
         if user.is_authenticated:
             if mode == "like":
-                Vote.objects.record_vote(guide, user, 1)
+                scoring.record_vote(guide, user, 1)
             elif mode == "dislike":
-                Vote.objects.record_vote(guide, user, -1)
+                scoring.record_vote(guide, user, -1)
             else:
-                Vote.objects.record_vote(guide, user, 0)
+                scoring.record_vote(guide, user, 0)
@@ -0,0 +1,28 @@
+// Suggest countries, categories and guide titles while typing into search inputs with data-typeahead url
+$(document).ready(function () {
+    var timeout = null;
+    var suggestions = {};
+
+    $('input[data-typeahead]').on('input', function (event) {
+        var input = $(this);
+        var query = input.val();
+        // Picking from the datalist does not come with a typed character, only then the suggestion is opened
+        var picked = !event.originalEvent || event.originalEvent.inputType === undefined
+            || event.originalEvent.inputType === 'insertReplacementText';
+        if (picked && suggestions[query]) {
+            window.location.href = suggestions[query];
+            return;
+        }
+        clearTimeout(timeout);
+        timeout = setTimeout(function () {
+            $.getJSON(input.data('typeahead'), {q: query}, function (data) {
+                var list = $('#' + input.attr('list')).empty();
+                suggestions = {};
+                $.each(data.suggestions, function (index, suggestion) {
+                    suggestions[suggestion.text] = suggestion.url;
+                    list.append($('<option>').attr('value', suggestion.text).text(suggestion.type));
+                });
+            });
+        }, 150);
+    });
+});
@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class TravelGuidesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'travel_guides'
+
+    def ready(self):
+        from .search import setup_index
+        post_migrate.connect(setup_index, sender=self)
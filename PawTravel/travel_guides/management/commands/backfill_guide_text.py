@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from PawTravel import pagecache
+from travel_guides.models import Guide
+from travel_guides.search import bump_version, get_backend
+
+
+class Command(BaseCommand):
+    """
+    Computes plain text, word count and reading time of guides saved before these fields existed.
+    Guides are processed in chunks ordered by id, every chunk is committed on its own,
+    and their text in the search index is refreshed together with them.
+    """
+    help = 'Computes plain text and reading time of all guides'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Amount of guides updated in a single transaction')
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        total = 0
+        last_id = 0
+        fields = ('body_text', 'word_count', 'reading_time')
+        while True:
+            guides = list(Guide.objects.filter(id__gt=last_id).order_by('id')
+                          .only('id', 'title', 'description', 'body')[:options['batch_size']])
+            if not guides:
+                break
+            for guide in guides:
+                guide.update_text()
+            with transaction.atomic():
+                Guide.objects.bulk_update(guides, fields)
+                backend.index(guides)
+            total += len(guides)
+            last_id = guides[-1].id
+        pagecache.purge(Guide)
+        # Results cached before the text was filled in miss guides found by it
+        bump_version()
+        self.stdout.write(self.style.SUCCESS('Updated text of {} guides'.format(total)))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from travel_guides.models import Guide
+from travel_guides.search import bump_version, get_backend
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the full-text index of guides.
+    Guides are indexed with every save, this command fills the index with guides
+    created before it existed and removes guides deleted in bulk.
+    Guides are replaced in the index batch by batch, every batch is committed on its own,
+    so searches never see the index empty and other writes are not blocked for the whole rebuild.
+    """
+    help = 'Rebuilds the full-text search index of guides'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Amount of guides indexed in a single transaction')
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        backend.setup()
+        total = 0
+        last_id = 0
+        fields = ('id', 'title', 'description', 'body_text')
+        while True:
+            with transaction.atomic():
+                guides = list(Guide.objects.filter(id__gt=last_id).order_by('id')
+                              .only(*fields)[:options['batch_size']])
+                # Indexed guides between the batches do not exist anymore
+                backend.retain(last_id, guides[-1].id if guides else None, [guide.id for guide in guides])
+                if not guides:
+                    break
+                backend.index(guides)
+            total += len(guides)
+            last_id = guides[-1].id
+        backend.optimize()
+        # Results cached while the index was being rebuilt may be stale
+        bump_version()
+        self.stdout.write(self.style.SUCCESS('Indexed {} guides'.format(total)))
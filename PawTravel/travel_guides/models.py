@@ -1,15 +1,21 @@
+import math
+from html import unescape
+
+from django.conf import settings
 from django.contrib.contenttypes.fields import GenericRelation
-from django.db import models
-from django.db.models import Q
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import F, Q
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.html import strip_tags
 from django.utils.text import slugify
 from tinymce.models import HTMLField
 
 from users.models import CustomUser
 from comments.models import Comment
-from voting.models import Vote
-
+from PawTravel import cachestats, images, pagecache, scoring
+from . import search
 
 
 class GuideSearchManager(models.Manager):
@@ -18,22 +24,37 @@ class GuideSearchManager(models.Manager):
         Search guides depending on defined arguments
         :param country: What country?
         :param category: What category
-        :param keywords: What keywords?
-        :return: Query set with guides matching above criteria
+        :param keywords: What keywords? Words of every keyword also match longer words starting with them
+        :return: Query set with guides matching above criteria, ordered by relevance if keywords are given
         """
         query_set = super().get_queryset().all()
         if country is not None:
             query_set = query_set.filter(country__name=country)
         if category is not None:
             query_set = query_set.filter(category__name=category)
+        query_set = query_set.filter(visible='visible').defer(*Guide.list_deferred_fields)
         if keywords is not None:
-            q_object = ~Q()
-            for item in keywords:
-                q_object &= Q(body__icontains=item) | Q(title__icontains=item) | Q(description__icontains=item)
-            query_set = query_set.filter(q_object)
-        query_set = query_set.filter(visible='visible')
+            query_set = search.get_backend().search(query_set, keywords)
         return query_set
 
+    def search_ids(self, country=None, category=None, keywords=None):
+        """
+        Get ids of guides found by search, the results are cached until any guide changes
+        :param country: What country?
+        :param category: What category
+        :param keywords: What keywords?
+        :return: List of ids of guides matching above criteria in the order of search
+        """
+        key = search.get_cache_key(country, category, keywords or [])
+        ids = cache.get(key)
+        if ids is not None:
+            cachestats.hit('search')
+            return ids
+        cachestats.miss('search')
+        ids = list(self.search(country=country, category=category, keywords=keywords).values_list('id', flat=True))
+        cache.set(key, ids, settings.SEARCH_CACHE_TIMEOUT)
+        return ids
+
     def search_by_user(self, username):
         """
         Get all guides written by specifc user
@@ -41,7 +62,7 @@ class GuideSearchManager(models.Manager):
         :return:
         """
         user = CustomUser.objects.get(username=username)
-        return super().get_queryset().filter(author=user, visible='visible')
+        return super().get_queryset().filter(author=user, visible='visible').defer(*Guide.list_deferred_fields)
 
 
 class GuideCategory(models.Model):
@@ -53,6 +74,17 @@ class GuideCategory(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        search.bump_version()
+        images.schedule_derivatives(self.icon_image, images.ICON_DERIVATIVES,
+                                    Guide.objects.filter(category=self))
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        search.bump_version()
+        return result
+
 
 class Country(models.Model):
     """Countries to which possibly anyone can travel"""
@@ -62,6 +94,15 @@ class Country(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        search.bump_version()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        search.bump_version()
+        return result
+
 
 class Guide(models.Model):
     """
@@ -77,21 +118,40 @@ class Guide(models.Model):
     country = models.ForeignKey(Country, on_delete=models.CASCADE, related_name='country', null=True, blank=True)
     visible = models.CharField(max_length=16, choices=VISIBILITY, default='visible')
     body = HTMLField()
+    body_text = models.TextField(blank=True, editable=False)  # Body without html, computed on save
+    word_count = models.PositiveIntegerField(default=0, editable=False)
+    reading_time = models.PositiveSmallIntegerField(default=0, editable=False)  # In minutes
     publish = models.DateTimeField(default=timezone.now)
     objects = models.Manager()  # Default manager
     search = GuideSearchManager()
     comments = GenericRelation(Comment, related_query_name='all_comments')
+    score = models.IntegerField(default=0, editable=False)  # Sum of votes, updated with every vote
+    num_votes = models.PositiveIntegerField(default=0, editable=False)
+    num_comments = models.PositiveIntegerField(default=0, editable=False)
+    hotness = models.FloatField(default=0, editable=False)  # Ranking of Hot tab, see PawTravel.scoring.hotness
+    card_version = models.PositiveIntegerField(default=0, editable=False)  # Bumped whenever cached card gets stale
+    hotness_date_field = 'publish'
+    list_deferred_fields = ('body', 'body_text')  # Not needed by lists and search results
+    WORDS_PER_MINUTE = 200
 
     @property
     def get_likes(self):
-        return Vote.objects.get_score(self)['score']
+        return self.score
 
     @property
     def get_votes(self):
-        return Vote.objects.get_score(self)['num_votes']
+        return self.num_votes
 
     class Meta:
         ordering = ('-publish',)
+        indexes = [
+            # Hot guides feed
+            models.Index(fields=['-hotness', '-id'], name='guide_hotness_idx'),
+            # Lists paginated by cursors, see GuideListView
+            models.Index(fields=['-publish', '-id'], name='guide_publish_idx', condition=Q(visible='visible')),
+            models.Index(fields=['author', '-publish', '-id'], name='guide_author_publish_idx',
+                         condition=Q(visible='visible')),
+        ]
 
     def __str__(self):
         return self.title
@@ -109,4 +169,54 @@ class Guide(models.Model):
         any changes should take into account slug refreshes in the url
         """
         self.slug_url = slugify(self.title)
-        super(Guide, self).save(kwargs)
\ No newline at end of file
+        self.hotness = scoring.hotness(self.score, self.num_comments, self.publish)
+        self.update_text()
+        adding = self._state.adding
+        if not adding:
+            # Bumped in the database, so concurrent votes and comments can not bring back an already used version
+            self.card_version = F('card_version') + 1
+            # Counters are changed by votes and comments in the meantime, a stale copy must not overwrite them
+            if kwargs.get('update_fields') is None:
+                kwargs['update_fields'] = scoring.get_saved_fields(self)
+        with transaction.atomic():
+            super(Guide, self).save(**kwargs)
+            if not adding:
+                scoring.refresh_hotness(Guide, self.pk)
+                self.refresh_from_db(fields=['card_version', *scoring.COUNTER_FIELDS])
+        search.get_backend().index([self])
+        if self.visible == 'visible' or not adding:
+            # Guide could have been found before this change
+            search.bump_version()
+        pagecache.purge(Guide, self.pk)
+        images.schedule_derivatives(self.image, images.IMAGE_DERIVATIVES, Guide.objects.filter(pk=self.pk))
+
+    def delete(self, *args, **kwargs):
+        pk = self.pk
+        result = super().delete(*args, **kwargs)
+        search.get_backend().remove([pk])
+        search.bump_version()
+        pagecache.purge(Guide, pk)
+        return result
+
+    def update_text(self):
+        """
+        Compute plain text, word count and reading time of the body
+        """
+        self.body_text = self.html_to_text(self.body)
+        self.word_count = len(self.body_text.split())
+        self.reading_time = self.compute_reading_time(self.word_count)
+
+    @staticmethod
+    def html_to_text(html):
+        """
+        :return: Text of the html without tags and entities, with whitespace collapsed to single spaces
+        """
+        # Space in place of every tag keeps words of neighbouring paragraphs apart
+        return ' '.join(unescape(strip_tags(html.replace('<', ' <'))).split())
+
+    @classmethod
+    def compute_reading_time(cls, word_count):
+        """
+        :return: Minutes needed to read given amount of words, at least one for any text
+        """
+        return math.ceil(word_count / cls.WORDS_PER_MINUTE)
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from PawTravel import cacheversions
+
+WORD_PATTERN = re.compile(r'\w+')
+SEARCH_VERSION_KEY = 'guide_search_version'
+
+
+def get_guide_text(guide):
+    """
+    :return: Tuple of indexed title, description and text of the body
+    """
+    return guide.title, guide.description, guide.body_text
+
+
+def get_terms(keywords):
+    """
+    Split keywords into lowercase words, so punctuation and operators typed by users are never interpreted
+    :param keywords: Iterable of keywords, each of them can consist of multiple words
+    :return: List of words
+    """
+    return [word.lower() for keyword in keywords for word in WORD_PATTERN.findall(keyword)]
+
+
+class SearchBackend:
+    """
+    Backend of the guide full-text search. Every database can provide its own index,
+    this one does not keep any index and filters guides with plain LIKE queries.
+    """
+
+    def setup(self):
+        """
+        Create the index if it does not exist yet
+        """
+
+    def index(self, guides):
+        """
+        Add guides to the index or replace their indexed text
+        :param guides: Iterable of guides
+        """
+
+    def remove(self, pks):
+        """
+        Remove guides from the index
+        :param pks: Iterable of guide ids
+        """
+
+    def clear(self):
+        """
+        Remove all guides from the index
+        """
+
+    def retain(self, after, up_to, pks):
+        """
+        Remove guides with ids in the range which are not among given ones, e.g. guides deleted in bulk
+        :param after: Only ids greater than this one are checked
+        :param up_to: Only ids up to this one are checked, None checks all greater ids
+        :param pks: Iterable of ids of guides which stay in the index
+        """
+
+    def optimize(self):
+        """
+        Compact the index after large changes
+        """
+
+    def search(self, query_set, keywords):
+        """
+        Filter guides containing all keywords
+        :param query_set: Query set of guides
+        :param keywords: Iterable of keywords
+        :return: Query set of matching guides, the best matches first if backend supports ranking
+        """
+        for term in get_terms(keywords):
+            query_set = query_set.filter(Q(body_text__icontains=term) | Q(title__icontains=term)
+                                         | Q(description__icontains=term))
+        return query_set
+
+
+class FTS5SearchBackend(SearchBackend):
+    """
+    Backend using SQLite FTS5 table with the text of all guides. Rowid of the table is id of the guide,
+    results are ranked with BM25 and every word also matches longer words starting with it.
+    """
+    table = 'travel_guides_guide_fts'
+    # BM25 weights of indexed columns: title, description, body
+    weights = (10.0, 5.0, 1.0)
+
+    def setup(self):
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5("
+                           "title, description, body, tokenize='unicode61 remove_diacritics 2')".format(self.table))
+
+    def index(self, guides):
+        rows = [(guide.pk, *get_guide_text(guide)) for guide in guides]
+        if not rows:
+            return
+        with transaction.atomic(), connection.cursor() as cursor:
+            # FTS5 tables have no unique constraint on rowid which could be used for an upsert
+            cursor.executemany("DELETE FROM {} WHERE rowid = %s".format(self.table), [row[:1] for row in rows])
+            cursor.executemany("INSERT INTO {}(rowid, title, description, body) VALUES (%s, %s, %s, %s)"
+                               .format(self.table), rows)
+
+    def remove(self, pks):
+        with connection.cursor() as cursor:
+            cursor.executemany("DELETE FROM {} WHERE rowid = %s".format(self.table), [(pk,) for pk in pks])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM {}".format(self.table))
+
+    def retain(self, after, up_to, pks):
+        pks = list(pks)
+        where = ['rowid > %s']
+        params = [after]
+        if up_to is not None:
+            where.append('rowid <= %s')
+            params.append(up_to)
+        if pks:
+            where.append('rowid NOT IN ({})'.format(', '.join(['%s'] * len(pks))))
+            params += pks
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM {} WHERE {}".format(self.table, ' AND '.join(where)), params)
+
+    def optimize(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO {0}({0}) VALUES ('optimize')".format(self.table))
+
+    @staticmethod
+    def get_match_query(terms):
+        """
+        :return: FTS5 query matching documents which contain words starting with every term
+        """
+        return ' '.join('"{}"*'.format(term) for term in terms)
+
+    def search(self, query_set, keywords):
+        terms = get_terms(keywords)
+        if not terms:
+            return query_set
+        guide_table = query_set.model._meta.db_table
+        rank = 'bm25({}, {})'.format(self.table, ', '.join(str(weight) for weight in self.weights))
+        # Joining the index lets the database rank and filter guides in a single query
+        return query_set.extra(
+            select={'search_rank': rank},
+            tables=[self.table],
+            where=['{}.rowid = {}.id'.format(self.table, guide_table), '{} MATCH %s'.format(self.table)],
+            params=[self.get_match_query(terms)],
+            order_by=['search_rank', '-id'],
+        )
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    """
+    :return: Search backend configured by GUIDE_SEARCH_BACKEND setting,
+    FTS5 on SQLite and plain LIKE queries on other databases if it is not set
+    """
+    path = getattr(settings, 'GUIDE_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    if connection.vendor == 'sqlite':
+        return FTS5SearchBackend()
+    return SearchBackend()
+
+
+def setup_index(**kwargs):
+    """
+    Receiver of post_migrate signal creating the index together with the other tables
+    """
+    get_backend().setup()
+
+
+def bump_version():
+    """
+    Invalidate all cached search results
+    """
+    cacheversions.bump([SEARCH_VERSION_KEY])
+
+
+def get_version():
+    return cacheversions.get([SEARCH_VERSION_KEY])[0]
+
+
+def get_cache_key(country, category, keywords):
+    """
+    :return: Cache key of search results, which is the same for keywords differing only in order, case or punctuation
+    """
+    normalized = json.dumps([country, category, sorted(set(get_terms(keywords)))])
+    return 'guide_search_{}_{}'.format(get_version(), hashlib.md5(normalized.encode()).hexdigest())
+
+
+class SearchResults:
+    """
+    Sequence of guides with given ids, which loads only guides of the requested slice
+    so it can be paginated without counting or fetching all results
+    """
+
+    def __init__(self, ids, query_set):
+        """
+        :param ids: Ordered list of ids of found guides
+        :param query_set: Query set used to fetch the guides
+        """
+        self.ids = ids
+        self.query_set = query_set
+
+    def __len__(self):
+        return len(self.ids)
+
+    def count(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            ids = self.ids[index]
+            guides = self.query_set.in_bulk(ids)
+            # Guides deleted since the results were cached are skipped
+            return [guides[pk] for pk in ids if pk in guides]
+        return self.query_set.get(pk=self.ids[index])
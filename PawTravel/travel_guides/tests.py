@@ -1,5 +1,7 @@
+from unittest import mock
 import tempfile
 
+from django.core.cache import cache
 from django.test import TestCase
 from django.test.client import RequestFactory
 from django.urls import reverse
@@ -10,6 +12,17 @@ from parameterized import parameterized
 from users.models import CustomUser
 from .views import GuideCreateFormView, GuideVoteView
 import json
+from comments.models import Comment
+from PawTravel import scoring, cachestats
+from .search import get_backend, get_version
+from .typeahead import Trie, Typeahead, typeahead
+from django.test import override_settings
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+import datetime
+from PawTravel.keyset import KeysetPaginator, InvalidCursor
+from io import StringIO
 
 # Create your tests here.
 class GuideModelTests(TestCase):
@@ -210,6 +223,382 @@ class GuideSearchTests(TestCase):
         self.assertEqual(len(Guide.search.search(keywords=["test", "lorem", "ipsum"])), 2)
 
 
+class FullTextSearchTests(TestCase):
+    """
+    Tests of the full-text index behind Guide.search.search
+    """
+    def setUp(self):
+        cache.clear()
+        self.author = CustomUser.objects.create(username="TestUser", email="test_email@test.com")
+        self.in_body = Guide.objects.create(author=self.author, title="Mountains", description="Trip",
+                                            body="<p>Hiking with a <strong>dog</strong> in Tatras</p>")
+        self.in_title = Guide.objects.create(author=self.author, title="Dog friendly hotels", description="Hotels",
+                                             body="<p>Rooms</p>")
+        self.in_description = Guide.objects.create(author=self.author, title="Lakes", description="Dogs on beaches",
+                                                   body="<p>Swimming</p>")
+
+    def search(self, *keywords):
+        return list(Guide.search.search(keywords=list(keywords)))
+
+    def test_results_are_ranked(self):
+        self.assertEqual(self.search("dog"), [self.in_title, self.in_description, self.in_body])
+
+    def test_prefix_matching(self):
+        self.assertEqual(self.search("hik"), [self.in_body])
+        self.assertEqual(self.search("DOG FRIEND"), [self.in_title])
+
+    def test_html_is_not_indexed(self):
+        self.assertEqual(self.search("strong"), [])
+
+    def test_operators_are_not_interpreted(self):
+        self.assertEqual(self.search('dog" -(hotels*'), [self.in_title])
+
+    def test_index_follows_changes(self):
+        self.in_body.body = "<p>Cycling</p>"
+        self.in_body.save()
+        self.assertEqual(self.search("hiking"), [])
+        self.assertEqual(self.search("cycling"), [self.in_body])
+        self.in_title.delete()
+        self.assertEqual(self.search("hotels"), [])
+
+    def test_hidden_guides_are_not_found(self):
+        self.in_title.visible = 'hidden'
+        self.in_title.save()
+        self.assertEqual(self.search("dog"), [self.in_description, self.in_body])
+
+    def test_rebuild_command(self):
+        get_backend().clear()
+        Guide.objects.filter(id=self.in_body.id).update(title="Volcanoes")
+        self.assertEqual(self.search("dog"), [])
+        out = StringIO()
+        call_command('rebuild_guide_index', batch_size=2, stdout=out)
+        self.assertIn('Indexed 3 guides', out.getvalue())
+        self.assertEqual(self.search("volcano"), [self.in_body])
+        self.assertEqual(len(self.search("dog")), 3)
+
+    def test_rebuild_invalidates_cached_results(self):
+        get_backend().clear()
+        self.assertEqual(Guide.search.search_ids(keywords=["dog"]), [])
+        call_command('rebuild_guide_index', stdout=StringIO())
+        self.assertEqual(len(Guide.search.search_ids(keywords=["dog"])), 3)
+
+    def test_failed_rebuild_keeps_index(self):
+        with mock.patch.object(type(get_backend()), 'index', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                call_command('rebuild_guide_index', stdout=StringIO())
+        self.assertEqual(len(self.search("dog")), 3)
+
+    def test_rebuild_commits_batches(self):
+        Guide.objects.filter(id=self.in_body.id).update(title="Volcanoes")
+        index = type(get_backend()).index
+        calls = []
+
+        def fail_second_batch(backend, guides):
+            calls.append(guides)
+            if len(calls) > 1:
+                raise RuntimeError
+            index(backend, guides)
+
+        with mock.patch.object(type(get_backend()), 'index', autospec=True, side_effect=fail_second_batch):
+            with self.assertRaises(RuntimeError):
+                call_command('rebuild_guide_index', batch_size=1, stdout=StringIO())
+        self.assertEqual(self.search("volcano"), [self.in_body])
+        self.assertEqual(len(self.search("dog")), 3)
+
+    def test_rebuild_removes_deleted_guides(self):
+        # Deleting a query set skips Guide.delete, so the index keeps those guides
+        Guide.objects.filter(id__in=[self.in_body.id, self.in_description.id]).delete()
+        call_command('rebuild_guide_index', batch_size=1, stdout=StringIO())
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT rowid FROM {}".format(get_backend().table))
+            self.assertEqual([row[0] for row in cursor.fetchall()], [self.in_title.id])
+
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            self.search("dog", "hotels")
+
+    def test_index_table_exists(self):
+        self.assertIn(get_backend().table, connection.introspection.table_names())
+
+
+class SearchResultCacheTests(TestCase):
+    """
+    Tests of caching ids of guides found by search
+    """
+    def setUp(self):
+        cache.clear()
+        self.author = CustomUser.objects.create(username="TestUser", email="test_email@test.com")
+        self.country = Country.objects.create(name="Poland")
+        self.hotel = Guide.objects.create(author=self.author, country=self.country, title="Dog friendly hotels")
+        self.beach = Guide.objects.create(author=self.author, title="Dog friendly beaches")
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_normalized_keywords_share_results(self):
+        self.assertEqual(Guide.search.search_ids(country="Poland", keywords=["Dog friendly HOTELS"]), [self.hotel.id])
+        with self.assertNumQueries(0):
+            ids = Guide.search.search_ids(country="Poland", keywords=["hotels, friendly", "dog"])
+        self.assertEqual(ids, [self.hotel.id])
+        self.assertEqual(cachestats.get_stats()['search'], {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_country_and_category_are_part_of_key(self):
+        self.assertEqual(len(Guide.search.search_ids(keywords=["dog"])), 2)
+        self.assertEqual(Guide.search.search_ids(country="Poland", keywords=["dog"]), [self.hotel.id])
+
+    def test_guide_changes_invalidate_results(self):
+        self.assertEqual(len(Guide.search.search_ids(keywords=["dog"])), 2)
+        guide = Guide.objects.create(author=self.author, title="Dog parks")
+        self.assertEqual(len(Guide.search.search_ids(keywords=["dog"])), 3)
+        guide.visible = 'hidden'
+        guide.save()
+        self.assertEqual(len(Guide.search.search_ids(keywords=["dog"])), 2)
+        self.beach.delete()
+        self.assertEqual(Guide.search.search_ids(keywords=["dog"]), [self.hotel.id])
+
+    def test_hidden_guides_do_not_invalidate_results(self):
+        version = get_version()
+        Guide.objects.create(author=self.author, title="Dog parks", visible='hidden')
+        self.assertEqual(get_version(), version)
+
+    def test_list_view_loads_only_shown_guides(self):
+        url = reverse('travel_guides:guide_list') + '?keywords=dog&country=Poland'
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['object_list']), [self.hotel])
+        shown = []
+        for page in (1, 2):
+            response = self.client.get(reverse('travel_guides:guide_list') + '?keywords=dog&page={}'.format(page))
+            self.assertEqual(response.context['paginator'].count, 2)
+            shown += response.context['object_list']
+        self.assertCountEqual(shown, [self.hotel, self.beach])
+        self.assertEqual(cachestats.get_stats()['search']['misses'], 2)
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    Tests of paginating guide lists by cursors
+    """
+    def setUp(self):
+        cache.clear()
+        self.author = CustomUser.objects.create(username="TestUser", email="test_email@test.com")
+        self.other = CustomUser.objects.create(username="OtherUser", email="other_email@test.com")
+        now = timezone.now()
+        self.guides = []
+        for number in range(7):
+            # Some guides are published at the same time, so only id tells them apart
+            self.guides.append(Guide.objects.create(title="Guide {}".format(number), author=self.author,
+                                                    publish=now - datetime.timedelta(hours=number // 2)))
+        Guide.objects.create(title="Hidden", author=self.author, visible='hidden')
+        Guide.objects.create(title="Other", author=self.other, publish=now - datetime.timedelta(days=1))
+        self.expected = sorted(self.guides, key=lambda guide: (guide.publish, guide.id), reverse=True)
+
+    def tearDown(self):
+        cache.clear()
+
+    def get_paginator(self, per_page=3):
+        return KeysetPaginator(Guide.objects.filter(author=self.author, visible='visible'), per_page,
+                               ('-publish', '-id'))
+
+    def test_pages_cover_all_guides_in_order(self):
+        paginator = self.get_paginator()
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            with self.assertNumQueries(1):
+                pages.append(paginator.get_page(after=pages[-1].next_cursor))
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual([guide for page in pages for guide in page], self.expected)
+        self.assertFalse(pages[0].has_previous())
+        self.assertTrue(pages[1].has_previous())
+
+    def test_previous_pages(self):
+        paginator = self.get_paginator()
+        second = paginator.get_page(after=paginator.get_page().next_cursor)
+        last = paginator.get_page(after=second.next_cursor)
+        self.assertEqual(list(paginator.get_page(before=last.previous_cursor)), list(second))
+        first = paginator.get_page(before=second.previous_cursor)
+        self.assertEqual(list(first), self.expected[:3])
+        self.assertFalse(first.has_previous())
+        self.assertTrue(first.has_next())
+
+    def test_invalid_cursor(self):
+        for cursor in ("not a cursor", "WyJ4Il0=", "WyJ4IiwgMV0="):
+            with self.assertRaises(InvalidCursor):
+                self.get_paginator().get_page(after=cursor)
+
+    def test_page_query_plan(self):
+        """
+        Checks if pages after and before a cursor seek the publish index instead of scanning it from the start
+        """
+        paginator = KeysetPaginator(Guide.objects.filter(visible='visible'), 3, ('-publish', '-id'))
+        values = paginator.decode_cursor(paginator.encode_cursor(self.guides[3]))
+        for forward in (True, False):
+            plan = paginator.queryset.filter(paginator.get_filter(values, forward)).order_by(
+                *(('-publish', '-id') if forward else ('publish', 'id')))[:4].explain()
+            self.assertIn('guide_publish_idx', plan)
+            self.assertIn('publish<' if forward else 'publish>', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_approximate_total_is_cached(self):
+        self.assertEqual(self.get_paginator().get_approximate_total(), 7)
+        Guide.objects.create(title="New", author=self.author)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_paginator().get_approximate_total(), 7)
+
+    def test_user_list_view(self):
+        url = reverse('travel_guides:get_user_guides', kwargs={'username': 'TestUser'})
+        shown = []
+        response = self.client.get(url + '?country=')
+        while True:
+            self.assertEqual(response.status_code, 200)
+            shown += response.context['object_list']
+            self.assertContains(response, 'About 7 guides.')
+            self.assertNotIn('page=', response.content.decode())
+            if not response.context['page_obj'].has_next():
+                break
+            response = self.client.get(url + '?after=' + response.context['page_obj'].next_cursor)
+        self.assertEqual(shown, self.expected)
+
+    def test_list_view_with_invalid_cursor(self):
+        response = self.client.get(reverse('travel_guides:guide_list') + '?after=broken')
+        self.assertEqual(response.status_code, 404)
+
+
+class GuideTextTests(TestCase):
+    """
+    Tests of plain text and reading time computed from the body of guides
+    """
+    def setUp(self):
+        cache.clear()
+        self.author = CustomUser.objects.create(username="TestUser", email="test_email@test.com")
+        self.guide = Guide.objects.create(author=self.author, title="Dogs",
+                                          body="<p>Hello&nbsp;<b>dog</b></p><p>lovers &amp; friends</p>")
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_text_is_computed_on_save(self):
+        self.assertEqual(self.guide.body_text, "Hello dog lovers & friends")
+        self.assertEqual(self.guide.word_count, 5)
+        self.assertEqual(self.guide.reading_time, 1)
+        self.guide.body = "<p>{}</p>".format("word " * (2 * Guide.WORDS_PER_MINUTE + 1))
+        self.guide.save()
+        self.assertEqual(self.guide.reading_time, 3)
+
+    def test_lists_do_not_load_body(self):
+        for queryset in (Guide.search.search(), Guide.search.search(keywords=["dog"]),
+                         Guide.search.search_by_user("TestUser")):
+            self.assertTrue({'body', 'body_text'} <= queryset.get().get_deferred_fields())
+        response = self.client.get(reverse('travel_guides:guides_homepage'))
+        self.assertIn('body', response.context['travel_guides'][0].get_deferred_fields())
+        response = self.client.get(reverse('travel_guides:guide_list') + '?keywords=lovers')
+        self.assertIn('body', response.context['object_list'][0].get_deferred_fields())
+
+    def test_backfill_command(self):
+        Guide.objects.create(author=self.author, title="Cats", body="<p>Meow</p>")
+        Guide.objects.update(body_text='', word_count=0, reading_time=0)
+        get_backend().clear()
+        out = StringIO()
+        call_command('backfill_guide_text', batch_size=1, stdout=out)
+        self.assertIn('Updated text of 2 guides', out.getvalue())
+        self.guide.refresh_from_db()
+        self.assertEqual((self.guide.body_text, self.guide.word_count, self.guide.reading_time),
+                         ("Hello dog lovers & friends", 5, 1))
+        self.assertEqual(list(Guide.search.search(keywords=["meow"]).values_list('title', flat=True)), ["Cats"])
+
+    def test_backfill_invalidates_cached_results(self):
+        cache.clear()
+        cats = Guide.objects.create(author=self.author, title="Cats", body="<p>Meow</p>")
+        Guide.objects.update(body_text='', word_count=0, reading_time=0)
+        get_backend().clear()
+        self.assertEqual(Guide.search.search_ids(keywords=["meow"]), [])
+        call_command('backfill_guide_text', stdout=StringIO())
+        self.assertEqual(Guide.search.search_ids(keywords=["meow"]), [cats.id])
+
+
+class TrieTests(TestCase):
+    """
+    Tests of the prefix tree behind autocomplete
+    """
+    def setUp(self):
+        self.trie = Trie(limit=2, depth=6)
+        for text in ["Zürich lakes", "Dog friendly hotels", "Dog parks", "Dog beaches"]:
+            self.trie.insert(text, {'text': text})
+
+    def find(self, prefix):
+        return [suggestion['text'] for suggestion in self.trie.find(prefix)]
+
+    def test_best_suggestions_are_kept(self):
+        self.assertEqual(self.find("dog"), ["Dog friendly hotels", "Dog parks"])
+        self.assertEqual(self.find("dog b"), ["Dog beaches"])
+
+    def test_words_inside_text_match(self):
+        self.assertEqual(self.find("hot"), ["Dog friendly hotels"])
+        self.assertEqual(self.find("FRIENDLY  ho"), ["Dog friendly hotels"])
+
+    def test_diacritics_are_ignored(self):
+        self.assertEqual(self.find("zur"), ["Zürich lakes"])
+
+    def test_prefixes_longer_than_depth(self):
+        self.assertEqual(self.find("dog friendly hotels"), ["Dog friendly hotels"])
+        self.assertEqual(self.find("dog frieze"), [])
+
+    def test_no_match(self):
+        self.assertEqual(self.find("cat"), [])
+
+
+@override_settings(TYPEAHEAD_CHECK_INTERVAL=0)
+class TypeaheadTests(TestCase):
+    """
+    Tests of suggesting countries, categories and guides
+    """
+    def setUp(self):
+        cache.clear()
+        self.author = CustomUser.objects.create(username="TestUser", email="test_email@test.com")
+        self.poland = Country.objects.create(name="Poland")
+        Country.objects.create(name="Portugal")
+        self.category = GuideCategory.objects.create(name="Pools")
+        Guide.objects.create(author=self.author, title="Polish mountains", country=self.poland)
+        Guide.objects.create(author=self.author, title="Poland secrets", visible='hidden')
+        self.typeahead = Typeahead()
+
+    def tearDown(self):
+        cache.clear()
+
+    def find(self, prefix):
+        return [(suggestion['type'], suggestion['text']) for suggestion in self.typeahead.find(prefix)]
+
+    def test_suggestions(self):
+        self.assertEqual(self.find("po"), [('country', "Poland"), ('country', "Portugal"), ('category', "Pools"),
+                                           ('guide', "Polish mountains")])
+        self.assertEqual(self.find("mount"), [('guide', "Polish mountains")])
+        self.assertEqual(self.find(" "), [])
+
+    def test_lookups_do_not_query_database(self):
+        self.find("po")
+        with self.assertNumQueries(0):
+            self.find("pol")
+
+    def test_changes_refresh_suggestions(self):
+        self.find("po")
+        Country.objects.create(name="Poznan region")
+        self.assertIn(('country', "Poznan region"), self.find("poz"))
+        self.category.delete()
+        self.assertNotIn(('category', "Pools"), self.find("poo"))
+
+    @override_settings(TYPEAHEAD_CHECK_INTERVAL=60)
+    def test_version_is_checked_once_per_interval(self):
+        self.find("po")
+        Country.objects.create(name="Poznan region")
+        self.assertEqual(self.find("poz"), [])
+
+    def test_endpoint(self):
+        typeahead.trie = None
+        response = self.client.get(reverse('travel_guides:typeahead'), {'q': 'pola'})
+        self.assertEqual(response.json(), {'suggestions': [
+            {'type': 'country', 'text': "Poland", 'url': reverse('travel_guides:guide_list') + '?country=Poland'},
+        ]})
+
+
 class VisibilityTest(TestCase):
     """
     This class tests if visibility settings works correctly
@@ -263,6 +652,17 @@ class VotingSystemTests(TestCase):
         self.guide=Guide(title="Test guide", author=self.user_one, image=self.mock_file)
         self.guide.save()
 
+    def test_saving_stale_guide_keeps_counters(self):
+        """
+        Checks if saving guide loaded before a vote does not bring back its old score
+        """
+        stale = Guide.objects.get(id=self.guide.id)
+        scoring.record_vote(self.guide, self.user_one, 1)
+        stale.title = "Edited guide"
+        stale.save()
+        guide = Guide.objects.get(id=self.guide.id)
+        self.assertEqual((guide.title, guide.score, guide.num_votes), ("Edited guide", 1, 1))
+        self.assertAlmostEqual(guide.hotness, scoring.hotness(1, 0, guide.publish), places=5)
 
     def test_context_score_load(self):
         """
@@ -361,3 +761,84 @@ class VotingSystemTests(TestCase):
         self.assertEqual(json_response["likes"], 1)
         self.assertEqual(json_response["num_votes"], 1)
 
+
+class HotGuidesTests(TestCase):
+    """
+    Test class responsible for testing the hot guides feed
+    """
+    def setUp(self) -> None:
+        self.author = CustomUser.objects.create(username="TestUser", email="test_email@test.com")
+        self.guides = []
+        for title, visible in [("Old guide", 'visible'), ("New guide", 'visible'), ("Hidden guide", 'hidden')]:
+            guide = Guide(title=title, author=self.author, visible=visible,
+                          image=tempfile.NamedTemporaryFile(suffix=".jpg").name)
+            guide.save()
+            self.guides.append(guide)
+
+    def test_hot_guides_order(self):
+        view = GuideVoteView
+        factory = RequestFactory()
+        for i in range(3):
+            request = factory.post("/guides/vote/{}/like".format(self.guides[0].id))
+            request.user = CustomUser.objects.create(username='voter{}'.format(i), email="voter{}@test.com".format(i))
+            view.post(self=view, request=request, pk=self.guides[0].id, mode="like")
+        response = self.client.get(reverse('travel_guides:guides_hot'))
+        self.assertEqual([guide.title for guide in response.context['travel_guides']], ["Old guide", "New guide"])
+
+
+class AnonymousPageCacheTests(TestCase):
+    """
+    Test class responsible for testing caching of pages shown to anonymous users
+    """
+    def setUp(self) -> None:
+        cache.clear()
+        self.author = CustomUser.objects.create(username="TestUser", email="test_email@test.com")
+        self.guides = []
+        for title in ["Viral guide", "Other guide"]:
+            guide = Guide(title=title, author=self.author, image=tempfile.NamedTemporaryFile(suffix=".jpg").name)
+            guide.save()
+            self.guides.append(guide)
+        self.url = self.guides[0].get_absolute_url()
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def test_second_visit_is_served_from_cache(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(first.content, second.content)
+        self.assertIn('Cookie', second['Vary'])
+
+    def test_logged_in_users_are_not_cached(self):
+        self.client.get(self.url)
+        self.client.force_login(self.author)
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Hello, again <b>TestUser</b>!')
+        self.assertEqual(cachestats.get_stats()['pages']['hits'], 0)
+
+    def test_vote_purges_guide_page(self):
+        self.client.get(self.url)
+        scoring.record_vote(self.guides[0], self.author, 1)
+        response = self.client.get(self.url)
+        self.assertEqual(response.context["likes"], 1)
+
+    def test_comment_purges_guide_page(self):
+        self.client.get(self.url)
+        Comment.objects.create(text="Viral comment", author=self.author, content_object=self.guides[0],
+                               object_id=self.guides[0].id)
+        self.assertContains(self.client.get(self.url), "Viral comment")
+
+    def test_other_guides_do_not_purge_page(self):
+        self.client.get(self.url)
+        scoring.record_vote(self.guides[1], self.author, 1)
+        self.guides[1].title = "Edited guide"
+        self.guides[1].save()
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+    def test_edit_purges_listing(self):
+        self.client.get(reverse('travel_guides:guides_homepage'))
+        self.guides[1].title = "Edited guide"
+        self.guides[1].save()
+        self.assertContains(self.client.get(reverse('travel_guides:guides_homepage')), "Edited guide")
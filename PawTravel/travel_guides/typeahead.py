@@ -0,0 +1,135 @@
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from . import search
+from .models import Country, Guide, GuideCategory
+
+
+def normalize(text):
+    """
+    :return: Lowercase text without diacritics, so "zurich" finds "Zürich"
+    """
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+class Trie:
+    """
+    Prefix tree whose every node keeps the best suggestions of all words below it,
+    so a lookup only walks the characters of the typed prefix.
+    Suggestions have to be inserted from the best one, then a node simply keeps the first `limit` of them.
+    """
+
+    def __init__(self, limit, depth):
+        """
+        :param limit: Maximum amount of suggestions kept in a single node
+        :param depth: Maximum length of indexed prefixes, which bounds the amount of nodes
+        """
+        self.limit = limit
+        self.depth = depth
+        self.root = ({}, [])
+
+    def insert(self, text, suggestion):
+        """
+        Make suggestion reachable by prefixes of text and of every its word
+        """
+        normalized = normalize(text)
+        words = normalized.split()
+        for start in range(len(words)):
+            node = self.root
+            for char in ' '.join(words[start:])[:self.depth]:
+                node = node[0].setdefault(char, ({}, []))
+                if len(node[1]) < self.limit and suggestion not in node[1]:
+                    node[1].append(suggestion)
+
+    def find(self, prefix):
+        """
+        :return: List of the best suggestions containing a word starting with the prefix
+        """
+        normalized = ' '.join(normalize(prefix).split())
+        node = self.root
+        for char in normalized[:self.depth]:
+            node = node[0].get(char)
+            if node is None:
+                return []
+        if len(normalized) <= self.depth:
+            return list(node[1])
+        # Longer prefixes than the indexed ones are checked against whole text
+        return [suggestion for suggestion in node[1]
+                if (' ' + normalize(suggestion['text'])).find(' ' + normalized) >= 0]
+
+
+def get_suggestions():
+    """
+    :return: List of all suggestions, countries and categories with the most guides first, then the hottest guides
+    """
+    # Reverse relations of guides are named after the foreign keys
+    countries = (Country.objects.annotate(guides=Count('country', filter=Q(country__visible='visible')))
+                 .order_by('-guides', 'name'))
+    categories = (GuideCategory.objects.annotate(guides=Count('category', filter=Q(category__visible='visible')))
+                  .order_by('-guides', 'name'))
+    guides = (Guide.objects.filter(visible='visible').order_by('-hotness', '-id')
+              .only('id', 'title', 'slug_url')[:settings.TYPEAHEAD_GUIDES])
+    list_url = reverse('travel_guides:guide_list')
+    suggestions = [{'type': 'country', 'text': country.name,
+                    'url': '{}?{}'.format(list_url, urlencode({'country': country.name}))}
+                   for country in countries]
+    suggestions += [{'type': 'category', 'text': category.name,
+                     'url': '{}?{}'.format(list_url, urlencode({'category': category.name}))}
+                    for category in categories]
+    suggestions += [{'type': 'guide', 'text': guide.title, 'url': guide.get_absolute_url()} for guide in guides]
+    return suggestions
+
+
+def build_trie():
+    trie = Trie(settings.TYPEAHEAD_RESULTS, settings.TYPEAHEAD_PREFIX_LENGTH)
+    for suggestion in get_suggestions():
+        trie.insert(suggestion['text'], suggestion)
+    return trie
+
+
+class Typeahead:
+    """
+    Per process trie of suggestions, built on the first lookup and rebuilt after guides,
+    countries or categories change. Changes are noticed through the guide search version,
+    which is checked at most once per TYPEAHEAD_CHECK_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.trie = None
+        self.version = None
+        self.checked = 0
+
+    def get_trie(self):
+        now = time.monotonic()
+        if self.trie is not None and now - self.checked < settings.TYPEAHEAD_CHECK_INTERVAL:
+            return self.trie
+        version = search.get_version()
+        if self.trie is not None and version == self.version:
+            self.checked = now
+            return self.trie
+        with self.lock:
+            # Other thread could have rebuilt it in the meantime
+            if self.trie is None or self.version != version:
+                self.trie = build_trie()
+                self.version = version
+            self.checked = now
+        return self.trie
+
+    def find(self, prefix):
+        """
+        :return: List of dictionaries with type, text and url of the best suggestions for the prefix
+        """
+        if not prefix.strip():
+            return []
+        return self.get_trie().find(prefix)
+
+
+typeahead = Typeahead()
@@ -1,14 +1,19 @@
 from django.urls import path
+from PawTravel.pagecache import cache_anonymous_page
 from . import views
+from .models import Guide
 
 app_name='travel_guides'
 urlpatterns = [
-    path('', views.GuideHomepageView.as_view(), name="guides_homepage"),
+    path('', cache_anonymous_page(Guide)(views.GuideHomepageView.as_view()), name="guides_homepage"),
+    path('hot/', cache_anonymous_page(Guide)(views.GuideHotView.as_view()), name="guides_hot"),
     path('user/<str:username>/', views.GuideListView.as_view(), name="get_user_guides"),
     path('add/', views.GuideCreateFormView.as_view(), name="add_guide"),
     path('list/', views.GuideListView.as_view(), name='guide_list'),
+    path('typeahead/', views.TypeaheadView.as_view(), name='typeahead'),
     path('<int:pk>/', views.GuideDetailView.as_view(), name='guide_detail'),
-    path('<slug_url>-<int:pk>/', views.GuideDetailView.as_view(), name="guide_detail"),
+    path('<slug_url>-<int:pk>/', cache_anonymous_page(Guide, 'pk')(views.GuideDetailView.as_view()),
+         name="guide_detail"),
     path('vote/<int:pk>/<str:mode>', views.GuideVoteView.as_view(), name='guide_vote'),
 
 ]
\ No newline at end of file
@@ -1,9 +1,11 @@
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
 from django.views import View
 from django.views.generic import ListView, DetailView, CreateView
 
 from .forms import GuideForm
 from .models import Guide
+from .search import SearchResults
+from .typeahead import typeahead
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.http import HttpResponseRedirect
 from django.urls import reverse
@@ -15,33 +17,59 @@ from comments.forms import CommentForm
 
 # Create your views here.
 from comments.forms import CommentForm
-from voting.models import Vote
+from PawTravel import scoring
+from PawTravel.keyset import InvalidCursor, KeysetPaginator
+from PawTravel.ratelimit import RateLimiter, RateLimitExceeded, too_many_requests
 
 
 class GuideListView(ListView):
     """
     Guide List view. It shows list of guides.
     If url has format /guides/user/<value> It will return list of guides of user with value username
+    Lists without keywords are paginated by cursors (?after=... or ?before=...) instead of page numbers
     """
     model = Guide
     paginate_by = 1
     template_name = "travel_guides/guide_list.html"
+    keyset_ordering = ('-publish', '-id')
+    show_total = True  # Show cached approximate amount of guides in lists paginated by cursors
 
     def get_queryset(self):
-        category = None
-        country = None
+        category = self.request.GET.get('category') or None
+        country = self.request.GET.get('country') or None
         keywords = None
-        if 'category' in self.request.GET:
-            category = self.request.GET['category']
-        if 'country' in self.request.GET:
-            category = self.request.GET['country']
         if 'keywords' in self.request.GET:
             keywords = [self.request.GET['keywords']]
+        if keywords is not None and 'username' not in self.kwargs:
+            # Ids of popular searches are cached, so only guides of the shown page are loaded
+            return SearchResults(Guide.search.search_ids(country=country, category=category, keywords=keywords),
+                                 Guide.objects.select_related('author').defer(*Guide.list_deferred_fields))
         queryset = Guide.search.search(country=country, category=category, keywords=keywords)
         if 'username' in self.kwargs:
             queryset = queryset.filter(author=CustomUser.objects.get(username=self.kwargs['username']),
                                        visible='visible')
-        return queryset
+        return queryset.select_related('author')
+
+    def paginate_queryset(self, queryset, page_size):
+        if isinstance(queryset, SearchResults):
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, page_size, self.keyset_ordering)
+        try:
+            page = paginator.get_page(after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        except InvalidCursor:
+            raise Http404("Invalid page cursor")
+        if self.show_total:
+            page.total = paginator.get_approximate_total()
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Filters are kept when moving between pages
+        query = self.request.GET.copy()
+        for parameter in ('page', 'after', 'before'):
+            query.pop(parameter, None)
+        context['filter_query'] = query.urlencode()
+        return context
 
 
 class GuideDetailView(FormMixin, DetailView, MultipleObjectMixin):
@@ -60,8 +88,8 @@ class GuideDetailView(FormMixin, DetailView, MultipleObjectMixin):
         guide = self.get_object()
         object_list = guide.comments.all()
         context = super().get_context_data(object_list=object_list, **kwargs)
-        context["likes"] = Vote.objects.get_score(context['guide'])['score']
-        context["num_votes"] = Vote.objects.get_score(context['guide'])['num_votes']
+        context["likes"] = context['guide'].score
+        context["num_votes"] = context['guide'].num_votes
         return context
 
     def dispatch(self, request, *args, **kwargs):
@@ -81,6 +109,7 @@ class GuideDetailView(FormMixin, DetailView, MultipleObjectMixin):
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
         kwargs['form_object'] = self.get_object()
+        kwargs['user'] = self.request.user
         return kwargs
 
     def post(self, request, *args, **kwargs):
@@ -89,6 +118,8 @@ class GuideDetailView(FormMixin, DetailView, MultipleObjectMixin):
 
         if form.is_valid():
             return self.form_valid(form)
+        elif form.rate_limit_error is not None:
+            return too_many_requests(form.rate_limit_error, self.form_invalid(form))
         else:
             return self.form_invalid(form)
 
@@ -118,27 +149,57 @@ class GuideHomepageView(ListView):
     context_object_name = 'travel_guides'
     template_name = 'travel_guides/homepage_travel_guides.html'
 
+    def get_queryset(self):
+        return super().get_queryset().defer(*Guide.list_deferred_fields)
+
+
+class GuideHotView(GuideHomepageView):
+    """A view showing list of visible guides ordered by their stored hotness."""
+
+    paginate_by = 20
+    ordering = ('-hotness', '-id')
+
+    def get_queryset(self):
+        return super().get_queryset().filter(visible='visible').select_related('author', 'category')
+
 
 class GuideVoteView(View):
     """
     View responsible for processing voting system
     """
 
+    rate_limiter = RateLimiter('vote')
+
     def post(self, request, pk, mode):
         user = request.user
+        if user.is_authenticated:
+            try:
+                self.rate_limiter.hit(user.id)
+            except RateLimitExceeded as error:
+                return too_many_requests(error)
         guide = Guide.objects.get(id=pk)
         self.record_vote(guide, mode, user)
         data = dict()
-        data["likes"] = Vote.objects.get_score(guide)['score']
-        data["num_votes"] = Vote.objects.get_score(guide)['num_votes']
+        data["likes"] = guide.score
+        data["num_votes"] = guide.num_votes
         return JsonResponse(data)
 
     @staticmethod
     def record_vote(guide, mode, user):
         if user.is_authenticated:
             if mode == "like":
-                Vote.objects.record_vote(guide, user, 1)
+                scoring.record_vote(guide, user, 1)
             elif mode == "dislike":
-                Vote.objects.record_vote(guide, user, -1)
+                scoring.record_vote(guide, user, -1)
             else:
-                Vote.objects.record_vote(guide, user, 0)
+                scoring.record_vote(guide, user, 0)
+
+
+class TypeaheadView(View):
+    """
+    View suggesting countries, categories and guide titles for the typed beginning of a search
+    Return format: {"suggestions": [{"type": "country"|"category"|"guide", "text": ..., "url": ...}, ...]}
+    """
+
+    def get(self, request):
+        return JsonResponse({'suggestions': typeahead.find(request.GET.get('q', ''))})